@@ -0,0 +1,128 @@
+"""
+Benchmark: sequential vs batched contract qualification.
+
+Runs against a local IB stub whose reqContractDetails answers after a fixed
+round-trip delay, so no IB Gateway is needed. The sequential path is the
+loop _async_set_contract used before batching: one qualifyContractsAsync
+call per fallback candidate.
+
+Usage:
+    python benchmarks/bench_contract_qualification.py [--rtt 0.05] [--symbols 200]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Keep the bot module's startup connection away from any real gateway
+os.environ.setdefault('IB_HOST', '127.0.0.1')
+os.environ.setdefault('IB_PORT', '1')
+os.environ.setdefault('JOURNAL_DIR', '')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import trading_bot_webhooking_v2 as bot_module  # noqa: E402
+
+
+class StubIB:
+    """Answers qualifyContractsAsync like IB: concurrent requests, fixed RTT"""
+
+    def __init__(self, rtt, listings):
+        self.rtt = rtt
+        self.listings = listings  # {(symbol, exchange, currency): conId}
+        self.requests = 0
+
+    async def _details(self, contract):
+        self.requests += 1
+        await asyncio.sleep(self.rtt)
+        return self.listings.get((contract.symbol, contract.exchange, contract.currency))
+
+    async def qualifyContractsAsync(self, *contracts):
+        conIds = await asyncio.gather(*(self._details(c) for c in contracts))
+        qualified = []
+        for contract, conId in zip(contracts, conIds):
+            if conId:
+                contract.conId = conId
+                qualified.append(contract)
+        return qualified
+
+
+async def sequential_resolve(bot, symbol):
+    """The pre-batching path: try each candidate in turn"""
+    for contract in bot._contract_candidates(symbol):
+        qualified = await bot.ib.qualifyContractsAsync(contract)
+        if qualified:
+            return qualified[0]
+    return None
+
+
+def make_bot(ib):
+    # Only the qualification helpers are exercised; skip the connection thread
+    bot = bot_module.TradingBotAsync.__new__(bot_module.TradingBotAsync)
+    bot.ib = ib
+    bot.contracts = bot_module.ContractRegistry(max_size=100000)
+    return bot
+
+
+def make_listings(n):
+    """Symbols listed on their 1st, 2nd or 3rd candidate exchange"""
+    listings = {}
+    symbols = []
+    exchanges = ['SMART', 'NASDAQ', 'NYSE']
+    for i in range(n):
+        symbol = f"SYM{i}"
+        listings[(symbol, exchanges[i % 3], 'USD')] = 1000 + i
+        symbols.append(symbol)
+    return symbols, listings
+
+
+async def run(rtt, n, batch_size):
+    symbols, listings = make_listings(n)
+
+    # Single cold symbol listed on the last fallback exchange
+    cold = symbols[2]
+    ib = StubIB(rtt, listings)
+    start = time.perf_counter()
+    await sequential_resolve(make_bot(ib), cold)
+    seq_single = time.perf_counter() - start
+    seq_single_requests = ib.requests
+
+    ib = StubIB(rtt, listings)
+    start = time.perf_counter()
+    await make_bot(ib)._async_resolve_contract(cold)
+    batch_single = time.perf_counter() - start
+    batch_single_requests = ib.requests
+
+    # Bulk warm-up of the whole symbol list
+    ib = StubIB(rtt, listings)
+    bot = make_bot(ib)
+    start = time.perf_counter()
+    for symbol in symbols:
+        await sequential_resolve(bot, symbol)
+    seq_bulk = time.perf_counter() - start
+
+    ib = StubIB(rtt, listings)
+    bot = make_bot(ib)
+    bot_module.qualify_batch_size = batch_size
+    start = time.perf_counter()
+    await bot._async_warm_up([(symbol, None, None) for symbol in symbols])
+    batch_bulk = time.perf_counter() - start
+
+    print(f"IB round trip: {rtt * 1000:.0f} ms, symbols: {n}, batch size: {batch_size}")
+    print(f"{'case':<28}{'sequential':>14}{'batched':>14}{'speedup':>10}")
+    print(f"{'cold symbol (3rd candidate)':<28}{seq_single * 1000:>11.1f} ms{batch_single * 1000:>11.1f} ms"
+          f"{seq_single / batch_single:>9.1f}x")
+    print(f"{'  requests sent':<28}{seq_single_requests:>14}{batch_single_requests:>14}")
+    print(f"{f'warm-up of {n} symbols':<28}{seq_bulk * 1000:>11.1f} ms{batch_bulk * 1000:>11.1f} ms"
+          f"{seq_bulk / batch_bulk:>9.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rtt', type=float, default=0.05, help='simulated IB round trip in seconds')
+    parser.add_argument('--symbols', type=int, default=200, help='symbols in the bulk warm-up')
+    parser.add_argument('--batch-size', type=int, default=50, help='symbols per qualification batch')
+    args = parser.parse_args()
+    asyncio.run(run(args.rtt, args.symbols, args.batch_size))
@@ -0,0 +1,186 @@
+"""
+Benchmark: end-to-end webhook latency and throughput against a simulated IB.
+
+Serves the Flask app on a loopback port with the bot connected to FakeIB,
+then fires webhook signals from concurrent HTTP clients at increasing
+concurrency. Every request goes through the full path: security filter,
+parsing, dedup, handoff to the IB loop, position reservation, order
+placement and the completion wait. No IB Gateway or network is needed, so
+it runs offline in CI.
+
+Each client alternates opening and closing a few symbols of its own, so
+every signal places an order. Reports p50/p99/p999 latency per
+concurrency level and the highest throughput whose p99 stays within the
+SLO with no failed requests.
+
+Usage:
+    python benchmarks/bench_end_to_end.py [--concurrency 1,4,16,64] [--duration 5]
+        [--ack-ms 5] [--fill-ms 20] [--fill full] [--completion ack] [--order-type market]
+        [--slo-ms 250]
+"""
+
+import argparse
+import collections
+import http.client
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# Keep the bot module's startup connection away from any real gateway, and
+# let the load through the per-IP rate limiter
+os.environ.setdefault('IB_HOST', '127.0.0.1')
+os.environ.setdefault('IB_PORT', '1')
+os.environ.setdefault('JOURNAL_DIR', '')
+os.environ.setdefault('RATE_LIMIT_REQUESTS', '1000000000')
+os.environ.setdefault('CONTRACT_CACHE_SIZE', '4096')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import trading_bot_webhooking_v2 as bot_module  # noqa: E402
+from fake_ib import FILL_MODES, FakeIB  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+SYMBOLS_PER_CLIENT = 4
+
+
+def start_bot(ib):
+    """Swap the import-time bots for one connected to the simulator"""
+    manager = bot_module.bot_manager
+    manager.stop()
+    bot = bot_module.TradingBotAsync(bot_module.ib_host, bot_module.ib_port, bot_module.client_id,
+                                     bot_module.order_size, ib=ib,
+                                     contract_spec=(bot_module.exchange, "STK", bot_module.instructment),
+                                     on_change=manager.refresh_health)
+    manager.bots = {manager.primary: bot}
+    if not bot.ready.wait(10):
+        raise SystemExit(f"Bot did not become ready: {bot.connection_error}")
+    return bot
+
+
+def start_server():
+    server = make_server('127.0.0.1', 0, bot_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def client_symbols(client):
+    return [f"C{client}S{k}" for k in range(SYMBOLS_PER_CLIENT)]
+
+
+def post(port, body):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('POST', '/webhook', body, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def run_level(port, clients, duration, completion, order_type, run_id):
+    """Closed loop: each client sends its next signal when the last returns"""
+    latencies = [[] for _ in range(clients)]
+    statuses = [collections.Counter() for _ in range(clients)]
+    barrier = threading.Barrier(clients + 1)
+    deadline = [0.0]
+
+    def worker(client):
+        symbols = client_symbols(client)
+        barrier.wait()
+        n = 0
+        while time.perf_counter() < deadline[0]:
+            # long each symbol in turn, then close them in the same order
+            direction = 'long' if (n // len(symbols)) % 2 == 0 else 'close_long'
+            body = json.dumps({'direction': direction, 'symbol': symbols[n % len(symbols)],
+                               'completion': completion, 'order_type': order_type,
+                               'idempotency_key': f"{run_id}-{client}-{n}"})
+            started = time.perf_counter()
+            try:
+                status = post(port, body)
+            except OSError:
+                status = 'connection error'
+            latencies[client].append(time.perf_counter() - started)
+            statuses[client][status] += 1
+            n += 1
+
+    workers = [threading.Thread(target=worker, args=(c,)) for c in range(clients)]
+    for w in workers:
+        w.start()
+    deadline[0] = time.perf_counter() + duration
+    start = time.perf_counter()
+    barrier.wait()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    samples = sorted(latency for per_client in latencies for latency in per_client)
+    total = sum(statuses, collections.Counter())
+    return samples, total, elapsed
+
+
+def percentile(samples, q):
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', default='1,4,16,64', help='comma separated client counts')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per concurrency level')
+    parser.add_argument('--rtt-ms', type=float, default=5, help='simulated contract lookup round trip')
+    parser.add_argument('--ack-ms', type=float, default=5, help='simulated order acknowledgement delay')
+    parser.add_argument('--fill-ms', type=float, default=20, help='simulated delay from ack to fill')
+    parser.add_argument('--fill', choices=FILL_MODES, default='full')
+    parser.add_argument('--completion', choices=bot_module.ORDER_COMPLETION_POLICIES, default='ack')
+    parser.add_argument('--order-type', choices=bot_module.EXECUTION_MODES, default='market')
+    parser.add_argument('--slo-ms', type=float, default=250, help='p99 target for sustained throughput')
+    parser.add_argument('--verbose', action='store_true', help='keep the bot and server logs')
+    args = parser.parse_args()
+    levels = [int(c) for c in args.concurrency.split(',')]
+
+    if not args.verbose:
+        # Per-request logs would measure the terminal, not the bot
+        logging.disable(logging.ERROR)
+        sys.stdout = open(os.devnull, 'w')
+    report = sys.__stdout__
+
+    ib = FakeIB(rtt=args.rtt_ms / 1000, ack_delay=args.ack_ms / 1000, fill_delay=args.fill_ms / 1000,
+                fill=args.fill)
+    bot = start_bot(ib)
+    bot.warm_up([(symbol, None, None) for c in range(max(levels)) for symbol in client_symbols(c)]).result(30)
+    server = start_server()
+
+    print(f"FakeIB: ack {args.ack_ms:g} ms, fill {args.fill_ms:g} ms ({args.fill}), "
+          f"completion policy: {args.completion}, order type: {args.order_type}, {args.duration:g}s per level",
+          file=report)
+    print(f"{'clients':>8}{'signals':>10}{'signals/s':>11}{'p50 ms':>9}{'p99 ms':>9}{'p999 ms':>9}{'failed':>8}",
+          file=report)
+    best = None
+    for level, clients in enumerate(levels):
+        samples, statuses, elapsed = run_level(server.server_port, clients, args.duration, args.completion,
+                                               args.order_type, level)
+        failed = sum(count for status, count in statuses.items() if status != 200)
+        rate = len(samples) / elapsed
+        p50, p99, p999 = (percentile(samples, q) * 1000 for q in (0.5, 0.99, 0.999))
+        print(f"{clients:>8}{len(samples):>10}{rate:>11.1f}{p50:>9.1f}{p99:>9.1f}{p999:>9.1f}{failed:>8}",
+              file=report)
+        if failed:
+            print(f"{'':>8}statuses: {dict(statuses)}", file=report)
+        if not failed and p99 <= args.slo_ms and (best is None or rate > best[0]):
+            best = (rate, clients)
+
+    if best:
+        print(f"Max sustained: {best[0]:.1f} signals/s at {best[1]} clients "
+              f"(p99 <= {args.slo_ms:g} ms, no failures)", file=report)
+    else:
+        print(f"No level met p99 <= {args.slo_ms:g} ms without failures", file=report)
+
+    server.shutdown()
+    bot.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark: rate limiter throughput under concurrent load and memory per client.
+
+Compares the original per-IP deque of timestamps with RateLimiter in its
+sliding-window and token-bucket modes. Worker threads hammer the limiter the
+way Flask's threaded server would, drawing client IPs from a pool that
+includes a large scan of distinct addresses.
+
+Usage:
+    python benchmarks/bench_rate_limiter.py [--threads 8] [--requests 200000] [--clients 100000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+
+# Keep the bot module's startup connection away from any real gateway
+os.environ.setdefault('IB_HOST', '127.0.0.1')
+os.environ.setdefault('IB_PORT', '1')
+os.environ.setdefault('JOURNAL_DIR', '')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import trading_bot_webhooking_v2 as bot_module  # noqa: E402
+
+
+class DequeLimiter:
+    """The original is_rate_limited: unbounded dict of timestamp deques, no lock"""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.request_counts = defaultdict(lambda: deque())
+
+    def is_limited(self, ip):
+        now = time.time()
+        requests = self.request_counts[ip]
+        while requests and requests[0] < now - self.window:
+            requests.popleft()
+        if len(requests) >= self.limit:
+            return True
+        requests.append(now)
+        return False
+
+    def __len__(self):
+        return len(self.request_counts)
+
+
+def make_limiters(limit, window, max_clients):
+    return {
+        'deque (original)': lambda: DequeLimiter(limit, window),
+        'sliding_window': lambda: bot_module.RateLimiter(limit, window, 'sliding_window', max_clients),
+        'token_bucket': lambda: bot_module.RateLimiter(limit, window, 'token_bucket', max_clients),
+    }
+
+
+def throughput(limiter, threads, requests, ips):
+    per_thread = requests // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        picks = [rng.choice(ips) for _ in range(per_thread)]
+        barrier.wait()
+        for ip in picks:
+            limiter.is_limited(ip)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def memory(limiter, clients):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(clients):
+        limiter.is_limited(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}")
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, len(limiter)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200000, help='total requests across threads')
+    parser.add_argument('--clients', type=int, default=100000, help='distinct IPs in the scan')
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--window', type=int, default=60)
+    parser.add_argument('--max-clients', type=int, default=10000, help='RateLimiter LRU bound')
+    args = parser.parse_args()
+
+    # A few busy clients plus a scan over many distinct addresses
+    ips = [f"192.168.0.{i}" for i in range(16)] * 100
+    ips += [f"172.16.{i >> 8 & 255}.{i & 255}" for i in range(args.clients // 10)]
+
+    print(f"{args.threads} threads, {args.requests} requests, limit {args.limit}/{args.window}s")
+    print(f"{'limiter':<20}{'requests/s':>14}{'tracked clients':>18}{'memory':>12}")
+    for name, factory in make_limiters(args.limit, args.window, args.max_clients).items():
+        rate = throughput(factory(), args.threads, args.requests, ips)
+        used, tracked = memory(factory(), args.clients)
+        print(f"{name:<20}{rate:>14,.0f}{tracked:>18,}{used / 1024 / 1024:>9.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: signal-to-placeOrder latency of the thread-to-IB-loop bridge.
+
+Calls TradingBotAsync.handle_signal from caller threads, the way the Flask
+webhook hands signals to the IB event loop, with the bot connected to
+FakeIB. Measures how long each signal takes from the handoff until FakeIB's
+placeOrder is called, and until the caller gets its result back, so the
+cost of the command bridge is seen without HTTP in the way.
+
+Each caller alternates opening and closing a few symbols of its own, so
+every signal places an order. Reports p50/p99/p999 per caller count.
+
+Usage:
+    python benchmarks/bench_signal_latency.py [--threads 1,4,16] [--signals 2000] [--ack-ms 0]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+from bench_end_to_end import client_symbols, percentile, start_bot
+from fake_ib import FakeIB
+
+
+def run_level(bot, placed, threads, signals, level):
+    """Each caller sends its next signal when the last returns; returns the
+    sorted (to placeOrder, round trip) samples"""
+    to_place = [[] for _ in range(threads)]
+    round_trip = [[] for _ in range(threads)]
+    barrier = threading.Barrier(threads)
+
+    def caller(c):
+        symbols = [f"L{level}{symbol}" for symbol in client_symbols(c)]
+        barrier.wait()
+        for n in range(signals // threads):
+            symbol = symbols[n % len(symbols)]
+            direction = 'long' if (n // len(symbols)) % 2 == 0 else 'close_long'
+            started = time.perf_counter()
+            result = bot.handle_signal({'direction': direction, 'symbol': symbol, 'completion': 'ack'})
+            finished = time.perf_counter()
+            if 'error' in result:
+                raise SystemExit(f"Signal failed: {result['error']}")
+            to_place[c].append(placed.pop(symbol) - started)
+            round_trip[c].append(finished - started)
+
+    workers = [threading.Thread(target=caller, args=(c,)) for c in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return sorted(sum(to_place, [])), sorted(sum(round_trip, []))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', default='1,4,16', help='comma separated caller thread counts')
+    parser.add_argument('--signals', type=int, default=2000, help='signals per level')
+    parser.add_argument('--ack-ms', type=float, default=0, help='simulated order acknowledgement delay')
+    parser.add_argument('--verbose', action='store_true', help='keep the bot logs')
+    args = parser.parse_args()
+    levels = [int(t) for t in args.threads.split(',')]
+
+    if not args.verbose:
+        # Per-signal logs would measure the terminal, not the bridge
+        logging.disable(logging.ERROR)
+        sys.stdout = open(os.devnull, 'w')
+    report = sys.__stdout__
+
+    ib = FakeIB(ack_delay=args.ack_ms / 1000, fill_delay=0.001)
+    placed = {}  # symbol -> when placeOrder was called for it
+    place_order = ib.placeOrder
+
+    def timed_place_order(contract, order):
+        placed[contract.symbol] = time.perf_counter()
+        return place_order(contract, order)
+
+    ib.placeOrder = timed_place_order
+    bot = start_bot(ib)
+    bot.warm_up([(f"L{level}{symbol}", None, None) for level in range(len(levels))
+                 for t in range(max(levels)) for symbol in client_symbols(t)]).result(30)
+
+    print(f"FakeIB: ack {args.ack_ms:g} ms, {args.signals} signals per level, completion policy: ack",
+          file=report)
+    print(f"{'threads':>8}{'to placeOrder p50/p99/p999 ms':>32}{'round trip p50/p99/p999 ms':>30}", file=report)
+    for level, threads in enumerate(levels):
+        to_place, round_trip = run_level(bot, placed, threads, args.signals, level)
+        columns = ['/'.join(f"{percentile(samples, q) * 1000:.2f}" for q in (0.5, 0.99, 0.999))
+                   for samples in (to_place, round_trip)]
+        print(f"{threads:>8}{columns[0]:>32}{columns[1]:>30}", file=report)
+
+    bot.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+In-process stand-in for ib_insync.IB, for benchmarks and offline runs.
+
+FakeIB implements the part of the IB API the bot uses: connectAsync,
+isConnected, disconnect, positions, trades, openTrades, fills,
+reqCurrentTimeAsync, qualifyContractsAsync, reqMktData, cancelMktData,
+placeOrder and cancelOrder, plus the positionEvent, execDetailsEvent,
+commissionReportEvent and disconnectedEvent subscriptions. Orders get real ib_insync Trade objects
+whose status and fill events fire on the event loop after configurable
+delays, so the bot's completion policies, execution modes, position book
+and reservations run unchanged. Orders keep working and filling while the
+API connection is down, without events, and a disconnect drops the Trade
+objects handed out before it, as ib_insync does on reconnect: trades()
+then returns fresh ones, like IB's startup sync.
+
+Usage:
+    from fake_ib import FakeIB
+    bot = TradingBotAsync(host, port, clientId, ib=FakeIB(ack_delay=0.005, fill_delay=0.02))
+"""
+
+import asyncio
+import copy
+import itertools
+from datetime import datetime, timezone
+
+from ib_insync import (CommissionReport, Event, Execution, Fill, OrderStatus, Position, Ticker, Trade,
+                       TradeLogEntry)
+
+FILL_MODES = ['full', 'partial', 'none', 'reject']
+
+
+class FakeIB:
+    """Simulated IB Gateway with configurable latency and fill behavior.
+
+    connect_delay: seconds connectAsync takes
+    rtt: seconds a qualifyContractsAsync or reqCurrentTimeAsync round trip takes
+    ack_delay: seconds from placeOrder until the order is Submitted
+    fill_delay: seconds from the acknowledgement until the order fills
+    fill: 'full' fills in one execution, 'partial' fills half and then the
+          rest after another fill_delay, 'none' leaves the order working and
+          'reject' cancels it instead of acknowledging it
+    fill_price: price market orders fill at, and the quote's midpoint;
+          limit orders fill only when they reach it
+    spread: quoted bid/ask spread around fill_price
+    volume_rate: shares the simulated market trades per second, or None
+          for quotes without volume, as without a market data subscription
+    listed: predicate deciding which contracts qualify (default: all)
+    position_first: report the position update before the execution, as
+          IB sometimes does, instead of after it
+    """
+
+    TICK_INTERVAL = 0.1  # Seconds between market data updates
+
+    def __init__(self, connect_delay=0.0, rtt=0.005, ack_delay=0.005, fill_delay=0.02, fill='full',
+                 fill_price=100.0, spread=0.02, volume_rate=1000.0, account='DU0000000', listed=None,
+                 position_first=False):
+        if fill not in FILL_MODES:
+            raise ValueError(f"fill must be one of {', '.join(FILL_MODES)}")
+        self.connect_delay = connect_delay
+        self.rtt = rtt
+        self.ack_delay = ack_delay
+        self.fill_delay = fill_delay
+        self.fill = fill
+        self.fill_price = fill_price
+        self.spread = spread
+        self.volume_rate = volume_rate
+        self.account = account
+        self.listed = listed or (lambda contract: True)
+        self.position_first = position_first
+
+        self.connectedEvent = Event('connectedEvent')
+        self.disconnectedEvent = Event('disconnectedEvent')
+        self.positionEvent = Event('positionEvent')
+        self.execDetailsEvent = Event('execDetailsEvent')
+        self.commissionReportEvent = Event('commissionReportEvent')
+        self.orderStatusEvent = Event('orderStatusEvent')
+
+        self._connected = False
+        self._positions = {}  # conId -> Position
+        self._con_ids = {}  # (symbol, exchange, currency) -> conId
+        self._next_con_id = itertools.count(1000)
+        self._next_order_id = itertools.count(1)
+        self._next_exec_id = itertools.count(1)
+        self._tickers = {}  # conId -> Ticker while subscribed
+        self._volume = 0.0
+        self._trades = {}  # orderId -> the current Trade
+
+    async def connectAsync(self, host='127.0.0.1', port=7497, clientId=1, timeout=4, readonly=False, account=''):
+        await asyncio.sleep(self.connect_delay)
+        self._connected = True
+        self.connectedEvent.emit()
+        return self
+
+    def isConnected(self):
+        return self._connected
+
+    def disconnect(self):
+        if self._connected:
+            self._connected = False
+            # The client's Trade objects go stale: IB keeps working the orders
+            self._trades = {orderId: self._copy(trade) for orderId, trade in self._trades.items()}
+            self.disconnectedEvent.emit()
+    
+    @staticmethod
+    def _copy(trade):
+        """A fresh Trade for the same order, as ib_insync builds on connect"""
+        return Trade(trade.contract, copy.copy(trade.order), copy.copy(trade.orderStatus),
+                     list(trade.fills), list(trade.log))
+
+    def positions(self, account=''):
+        return list(self._positions.values())
+
+    def trades(self):
+        return list(self._trades.values())
+
+    def openTrades(self):
+        return [trade for trade in self._trades.values() if not trade.isDone()]
+
+    def fills(self):
+        return [fill for trade in self._trades.values() for fill in trade.fills]
+
+    async def reqCurrentTimeAsync(self):
+        await asyncio.sleep(self.rtt)
+        return self._now()
+
+    async def qualifyContractsAsync(self, *contracts):
+        await asyncio.sleep(self.rtt)
+        qualified = []
+        for contract in contracts:
+            if self.listed(contract):
+                key = (contract.symbol, contract.exchange, contract.currency)
+                if key not in self._con_ids:
+                    self._con_ids[key] = next(self._next_con_id)
+                contract.conId = self._con_ids[key]
+                qualified.append(contract)
+        return qualified
+
+    def reqMktData(self, contract, genericTickList='', snapshot=False, regulatorySnapshot=False,
+                   mktDataOptions=None):
+        ticker = self._tickers.get(contract.conId)
+        if ticker is None:
+            ticker = self._tickers[contract.conId] = Ticker(contract=contract, minTick=0.01)
+            asyncio.get_event_loop().call_later(self.rtt, self._tick, ticker)
+        return ticker
+
+    def cancelMktData(self, contract):
+        self._tickers.pop(contract.conId, None)
+
+    def _tick(self, ticker):
+        """Quote around fill_price, with volume growing at volume_rate"""
+        if self._tickers.get(ticker.contract.conId) is not ticker:
+            return
+        ticker.bid = self.fill_price - self.spread / 2
+        ticker.ask = self.fill_price + self.spread / 2
+        ticker.last = self.fill_price
+        if self.volume_rate is not None:
+            self._volume += self.volume_rate * self.TICK_INTERVAL
+            ticker.volume = self._volume
+        ticker.time = self._now()
+        ticker.updateEvent.emit(ticker)
+        asyncio.get_event_loop().call_later(self.TICK_INTERVAL, self._tick, ticker)
+
+    def cancelOrder(self, order, manualCancelOrderTime=''):
+        trade = self._trades.get(order.orderId)
+        if trade and not trade.isDone():
+            self._set_status(trade, 'PendingCancel')
+            asyncio.get_event_loop().call_later(self.ack_delay, self._set_status, trade, 'Cancelled')
+        return trade
+
+    def _marketable(self, order):
+        if order.orderType != 'LMT':
+            return True
+        if order.action == 'BUY':
+            return order.lmtPrice >= self.fill_price
+        return order.lmtPrice <= self.fill_price
+
+    def placeOrder(self, contract, order):
+        if not order.orderId:
+            order.orderId = next(self._next_order_id)
+        trade = Trade(contract, order, OrderStatus(orderId=order.orderId, status='PendingSubmit',
+                                                   remaining=order.totalQuantity))
+        trade.log.append(TradeLogEntry(self._now(), 'PendingSubmit', ''))
+        self._trades[order.orderId] = trade
+
+        loop = asyncio.get_event_loop()
+        if self.fill == 'reject':
+            loop.call_later(self.ack_delay, self._set_status, trade, 'Cancelled', 'Order rejected by simulator')
+            return trade
+        loop.call_later(self.ack_delay, self._set_status, trade, 'Submitted')
+        if not self._marketable(order):
+            return trade
+        if self.fill == 'full':
+            loop.call_later(self.ack_delay + self.fill_delay, self._execute, trade, order.totalQuantity)
+        elif self.fill == 'partial':
+            half = max(1, order.totalQuantity // 2)
+            loop.call_later(self.ack_delay + self.fill_delay, self._execute, trade, half)
+            loop.call_later(self.ack_delay + 2 * self.fill_delay, self._execute, trade,
+                            order.totalQuantity - half)
+        return trade
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc)
+
+    def _set_status(self, trade, status, message=''):
+        trade = self._trades[trade.order.orderId]  # Replaced if there was a disconnect since
+        if trade.isDone():
+            return
+        trade.orderStatus.status = status
+        trade.log.append(TradeLogEntry(self._now(), status, message))
+        if not self._connected:
+            return
+        self.orderStatusEvent.emit(trade)
+        trade.statusEvent.emit(trade)
+        if status == 'Cancelled':
+            trade.cancelledEvent.emit(trade)
+
+    def _execute(self, trade, shares):
+        """Report an execution the way IB does: execution, then status, then
+        position; the position comes first with position_first"""
+        trade = self._trades[trade.order.orderId]
+        if trade.isDone() or shares <= 0:
+            return
+        status = trade.orderStatus
+        status.filled += shares
+        status.remaining = trade.order.totalQuantity - status.filled
+        status.avgFillPrice = status.lastFillPrice = self.fill_price
+
+        side = 'BOT' if trade.order.action == 'BUY' else 'SLD'
+        execution = Execution(execId=f"sim.{next(self._next_exec_id)}", time=self._now(),
+                              acctNumber=self.account, exchange=trade.contract.exchange, side=side,
+                              shares=shares, price=self.fill_price, orderId=trade.order.orderId,
+                              cumQty=status.filled, avgPrice=self.fill_price, orderRef=trade.order.orderRef)
+        fill = Fill(trade.contract, execution, CommissionReport(execId=execution.execId), execution.time)
+        trade.fills.append(fill)
+
+        conId = trade.contract.conId
+        previous = self._positions.get(conId)
+        signed = shares if side == 'BOT' else -shares
+        position = Position(self.account, trade.contract, (previous.position if previous else 0) + signed,
+                            self.fill_price)
+        self._positions[conId] = position
+        if self.position_first and self._connected:
+            self.positionEvent.emit(position)
+
+        if self._connected:
+            self.execDetailsEvent.emit(trade, fill)
+            trade.fillEvent.emit(trade, fill)
+            self.commissionReportEvent.emit(trade, fill, fill.commissionReport)
+
+        self._set_status(trade, 'Filled' if status.remaining <= 0 else 'Submitted')
+        if status.remaining <= 0 and self._connected:
+            trade.filledEvent.emit(trade)
+        if not self.position_first and self._connected:
+            self.positionEvent.emit(position)
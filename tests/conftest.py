@@ -0,0 +1,51 @@
+"""
+Shared fixtures: the bot module imported offline, and a bot running on
+FakeIB in place of the bot manager's IB connections.
+"""
+
+import os
+import sys
+
+import pytest
+
+# Settings are read at import: no IB Gateway, journal, health ping or rate limit
+os.environ.update(IB_PORT='1', JOURNAL_DIR='', HEALTH_PING_INTERVAL='0', RATE_LIMIT_REQUESTS='1000000')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+import trading_bot_webhooking_v2 as bot_module  # noqa: E402
+from fake_ib import FakeIB  # noqa: E402
+
+
+@pytest.fixture
+def tb():
+    """The bot module, with a clean dedup cache"""
+    bot_module.bot_manager.stop()
+    bot_module.signal_dedup = bot_module.SignalDedupCache(bot_module.dedup_cache_size)
+    return bot_module
+
+
+@pytest.fixture
+def make_bot(tb):
+    """make_bot(**FakeIB options) -> a ready bot on FakeIB serving every route"""
+    bots = []
+
+    def make(order_size=100, **fake_ib_options):
+        manager = tb.bot_manager
+        bot = tb.TradingBotAsync('fake', 1, 1, order_size=order_size, ib=FakeIB(**fake_ib_options),
+                                 contract_spec=('SMART', 'STK', 'AAPL'), on_change=manager.refresh_health)
+        bots.append(bot)
+        manager.bots = {manager.primary: bot}
+        assert bot.ready.wait(5), "bot did not connect to FakeIB"
+        return bot
+
+    yield make
+    for bot in bots:
+        bot.stop()
+    tb.bot_manager.bots = {}
+
+
+@pytest.fixture
+def client(tb):
+    return tb.app.test_client()
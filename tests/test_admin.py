@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+
+def asgi_get(tb, path, query=b'', headers=()):
+    """GET path through the ASGI app; returns (status, body)"""
+    scope = {'type': 'http', 'path': path, 'method': 'GET', 'query_string': query, 'client': ('127.0.0.1', 0),
+             'headers': [(name.encode(), value.encode()) for name, value in headers]}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(event):
+        sent.append(event)
+
+    asyncio.run(tb.asgi_app(scope, receive, send))
+    return sent[0]['status'], sent[1]['body'].decode()
+
+
+@pytest.fixture
+def admin(tb, monkeypatch):
+    monkeypatch.setattr(tb, 'admin_token', 's3cret')
+    return {'X-Admin-Token': 's3cret'}
+
+
+def test_trades_need_the_admin_token(tb, client, admin):
+    assert client.get('/trades').status_code == 403
+    assert client.get('/trades', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    response = client.get('/trades', headers=admin)
+    assert response.status_code == 200
+    assert 'trades' in response.get_json()
+
+    assert asgi_get(tb, '/trades')[0] == 403
+    assert asgi_get(tb, '/trades', headers=[('authorization', 'Bearer s3cret')])[0] == 200
+
+
+def test_trades_are_closed_without_an_admin_token(tb, client):
+    assert tb.admin_token == ''
+    assert client.get('/trades').status_code == 403
+    assert asgi_get(tb, '/trades')[0] == 403
+
+
+def test_health_detail_needs_the_admin_token(tb, make_bot, client, admin):
+    make_bot()
+    plain = client.get('/health')
+    assert plain.status_code == 200
+    assert 'connections' not in plain.get_json()
+
+    assert client.get('/health?detail=1').status_code == 403
+    assert asgi_get(tb, '/health', b'detail=1')[0] == 403
+    detail = client.get('/health?detail=1', headers=admin)
+    assert detail.status_code == 200
+    assert asgi_get(tb, '/health', b'detail=1', [('x-admin-token', 's3cret')])[0] == 200
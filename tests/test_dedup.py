@@ -0,0 +1,51 @@
+import json
+import threading
+import time
+
+
+def post(client, signal, **headers):
+    response = client.post('/webhook', data=json.dumps(signal), content_type='application/json', headers=headers)
+    return response.status_code, response.get_data(as_text=True)
+
+
+def test_repeated_keyless_bodies_all_reach_ib(tb, make_bot, client, monkeypatch):
+    """long, close_long, long: the second long is a new position, not a retry"""
+    monkeypatch.setattr(tb, 'dedup_window', 10)
+    bot = make_bot()
+    long = {'direction': 'long', 'symbol': 'D', 'completion': 'filled'}
+    close = {'direction': 'close_long', 'symbol': 'D', 'completion': 'filled'}
+
+    replies = [post(client, signal) for signal in (long, close, long)]
+
+    assert [status for status, _ in replies] == [200, 200, 200]
+    assert not any('Duplicate' in text for _, text in replies)
+    assert [(trade.order.action, trade.order.totalQuantity) for trade in bot.ib.trades()] == [
+        ('BUY', 100), ('SELL', 100), ('BUY', 100)]
+
+
+def test_idempotency_key_retry_is_marked_duplicate(make_bot, client):
+    bot = make_bot()
+    signal = {'direction': 'long', 'symbol': 'K', 'idempotency_key': 'k-1'}
+
+    first = post(client, signal, **{'X-Request-ID': 'first-1'})
+    retry = post(client, signal)
+
+    assert first[0] == retry[0] == 200
+    assert retry[1] == f"Duplicate of request first-1: {first[1]}"
+    assert len(bot.ib.trades()) == 1
+
+
+def test_in_flight_identical_body_is_duplicate(tb, make_bot, client, monkeypatch):
+    monkeypatch.setattr(tb, 'dedup_window', 10)
+    bot = make_bot(fill_delay=0.3)
+    signal = {'direction': 'long', 'symbol': 'F', 'completion': 'filled'}
+    replies = []
+    first = threading.Thread(target=lambda: replies.append(post(client, signal, **{'X-Request-ID': 'first-2'})))
+    first.start()
+    time.sleep(0.1)
+
+    duplicate = post(client, signal)
+    first.join()
+
+    assert duplicate == (replies[0][0], f"Duplicate of request first-2: {replies[0][1]}")
+    assert len(bot.ib.trades()) == 1
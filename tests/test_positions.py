@@ -0,0 +1,52 @@
+import json
+import time
+
+import pytest
+
+
+def post(client, signal):
+    response = client.post('/webhook', data=json.dumps(signal), content_type='application/json')
+    return response.status_code, response.get_data(as_text=True)
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.mark.parametrize('position_first', [False, True], ids=['exec-first', 'position-first'])
+@pytest.mark.parametrize('fill', ['full', 'partial'])
+def test_fill_counts_once_whichever_event_comes_first(make_bot, client, position_first, fill):
+    bot = make_bot(order_size=500, fill=fill, position_first=position_first)
+
+    assert post(client, {'direction': 'long', 'symbol': 'P', 'completion': 'filled'})[0] == 200
+    conId = bot.ib.trades()[0].contract.conId
+    assert wait_for(lambda: not bot.positions._reservations)
+    assert bot.positions.position(conId) == 500
+    assert bot.positions.exposure(conId) == 500
+
+    assert post(client, {'direction': 'close_long', 'symbol': 'P', 'completion': 'filled'})[0] == 200
+    close = bot.ib.trades()[1].order
+    assert (close.action, close.totalQuantity) == ('SELL', 500)
+    assert wait_for(lambda: bot.positions.exposure(conId) == 0)
+
+
+def test_position_update_arriving_first_is_not_double_counted(tb):
+    from ib_insync import Contract, Execution, Fill, Position
+
+    book = tb.PositionBook()
+    contract = Contract(conId=7)
+    fill = Fill(contract, Execution(acctNumber='A', side='BOT', shares=500), None, None)
+
+    book.on_position(Position('A', contract, 500, 100.0))
+    assert book.position(7) == 500
+    book.on_exec(type('Trade', (), {'order': type('Order', (), {'orderId': 1})})(), fill)
+    assert book.position(7) == 500
+
+    # And the usual order: the fill first, then the update that covers it
+    book.on_exec(type('Trade', (), {'order': type('Order', (), {'orderId': 2})})(), fill)
+    assert book.position(7) == 1000
+    book.on_position(Position('A', contract, 1000, 100.0))
+    assert book.position(7) == 1000
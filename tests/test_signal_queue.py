@@ -0,0 +1,54 @@
+import concurrent.futures
+import json
+import threading
+import time
+
+
+def refuse_first_run(bot):
+    """Make the bot refuse its first queued entry as busy, as full lanes do"""
+    run_queued, calls = bot.run_queued, []
+
+    def first_refused(*args):
+        calls.append(args)
+        if len(calls) > 1:
+            return run_queued(*args)
+        future = concurrent.futures.Future()
+        threading.Timer(0.05, future.set_result, [{'error': 'Bot busy', 'http_status': 503}]).start()
+        return future
+
+    bot.run_queued = first_refused
+    return calls
+
+
+def test_retried_entry_keeps_its_place_before_later_signals(tb, make_bot, tmp_path):
+    bot = make_bot()
+    calls = refuse_first_run(bot)
+    queue = tb.SignalQueue(str(tmp_path), lambda *route: bot, retry_interval=0.1)
+    try:
+        for i, direction in enumerate(['long', 'close_long']):
+            queue.accept(f'r{i}', (None, None), {'direction': direction, 'symbol': 'Q', 'completion': 'filled'})
+        deadline = time.monotonic() + 5
+        while queue.pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        queue.close()
+
+    assert [args[1]['direction'] for args in calls] == ['long', 'long', 'close_long']
+    assert [(trade.order.action, trade.order.totalQuantity) for trade in bot.ib.trades()] == [
+        ('BUY', 100), ('SELL', 100)]
+    with open(tmp_path / 'signals.wal') as f:
+        done = [record['response'] for record in map(json.loads, f) if record['op'] == 'done']
+    assert [status for _, status in done] == [200, 200]
+
+
+def test_other_symbols_are_not_held_up_by_a_retry(tb, make_bot, tmp_path):
+    bot = make_bot()
+    calls = refuse_first_run(bot)
+    queue = tb.SignalQueue(str(tmp_path), lambda *route: bot, retry_interval=0.5)
+    try:
+        queue.accept('r0', (None, None), {'direction': 'long', 'symbol': 'Q'})
+        queue.accept('r1', (None, None), {'direction': 'long', 'symbol': 'R'})
+        time.sleep(0.2)
+        assert [args[1]['symbol'] for args in calls] == ['Q', 'R']
+    finally:
+        queue.close()
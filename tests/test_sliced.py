@@ -0,0 +1,40 @@
+import json
+import time
+
+
+def post(client, signal):
+    response = client.post('/webhook', data=json.dumps(signal), content_type='application/json')
+    return response.status_code, response.get_data(as_text=True)
+
+
+def sliced_done(bot, timeout=3.0):
+    """The journal's record of the first finished sliced order"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for trade in bot.journal.page(None, 50):
+            if trade.get('kind') == 'parent':
+                return trade
+        time.sleep(0.02)
+    return None
+
+
+def test_unknown_volume_stops_the_order_by_default(tb, make_bot, client, monkeypatch):
+    monkeypatch.setattr(tb, 'slice_interval', 0.05)
+    bot = make_bot(order_size=300, volume_rate=None)
+
+    status, text = post(client, {'direction': 'long', 'symbol': 'V', 'order_type': 'sliced'})
+    assert status == 400 and 'No market volume' in text
+
+    done = sliced_done(bot)
+    assert 'No market volume' in done['reason']
+    assert bot.ib.trades() == []
+
+
+def test_unknown_volume_falls_back_to_the_minimum_slice(tb, make_bot, client, monkeypatch):
+    monkeypatch.setattr(tb, 'slice_interval', 0.05)
+    monkeypatch.setattr(tb, 'slice_min_size', 100)
+    bot = make_bot(order_size=300, volume_rate=None)
+
+    post(client, {'direction': 'long', 'symbol': 'V', 'order_type': 'sliced', 'completion': 'filled'})
+
+    assert [trade.order.totalQuantity for trade in bot.ib.trades()] == [100, 100, 100]
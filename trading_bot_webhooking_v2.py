@@ -3,18 +3,55 @@ from ib_insync import *
 from datetime import datetime, timezone
 import asyncio
 import threading
+import concurrent.futures
 import queue
+import atexit
 import time
 import logging
+import logging.handlers
 import os
+import hashlib
+import hmac
+import urllib.parse
+import json
+import re
+import uuid
+import random
+import itertools
+import bisect
+import math
+import contextlib
+import contextvars
+import signal
 from dotenv import load_dotenv
-from collections import defaultdict, deque
+from collections import defaultdict, deque, OrderedDict
+
+# orjson parses webhook bodies several times faster when it is installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 # Load environment variables
 load_dotenv()
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue records unformatted; the listener thread renders and writes them"""
+    
+    def prepare(self, record):
+        return record
+
+# Set up logging: callers only enqueue records, and a background listener
+# formats and writes them, so terminal or disk I/O never holds up a webhook
+# or the IB event loop
+log_queue = queue.SimpleQueue()
+_log_output = logging.StreamHandler()
+_log_output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, _log_output)
+logging.basicConfig(level=logging.INFO, handlers=[DeferredQueueHandler(log_queue)])
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 ############################
@@ -22,161 +59,1726 @@ logger = logging.getLogger(__name__)
 exchange = os.getenv('EXCHANGE', 'SMART')
 instructment = os.getenv('INSTRUMENT', '2800')
 order_size = int(os.getenv('ORDER_SIZE', '500'))
-retry_interval = int(os.getenv('RETRY_INTERVAL', '30'))
+retry_interval = int(os.getenv('RETRY_INTERVAL', '30'))  # Max reconnect backoff
+reconnect_backoff_initial = float(os.getenv('RECONNECT_BACKOFF_INITIAL', '0.5'))
 ib_host = os.getenv('IB_HOST', '127.0.0.1')
 ib_port = int(os.getenv('IB_PORT', '4002'))
 client_id = int(os.getenv('CLIENT_ID', '130'))
+# Connection pool: name:host:port:clientId[:account], comma separated; empty
+# uses one connection from IB_HOST, IB_PORT and CLIENT_ID
+ib_connections = os.getenv('IB_CONNECTIONS', '')
+strategy_routes = os.getenv('STRATEGY_ROUTES', '')  # strategy=connection, comma separated
 webhook_port = int(os.getenv('WEBHOOK_PORT', '8001'))
 
+# 'flask' (threaded dev server) or 'asgi' (uvicorn, sharing the IB event loop)
+server_mode = os.getenv('SERVER_MODE', 'flask').lower()
+
+# Order completion: 'ack' returns once IB acknowledges the order,
+# 'first_fill' on the first execution, 'filled' once fully filled
+ORDER_COMPLETION_POLICIES = ['ack', 'first_fill', 'filled']
+order_completion = os.getenv('ORDER_COMPLETION', 'ack').lower()
+order_completion_timeout = float(os.getenv('ORDER_COMPLETION_TIMEOUT', '5'))
+signal_timeout = max(30, order_completion_timeout + 5)  # Longest a webhook waits on IB
+
+# Execution: 'market' sends one market order. 'limit' rests a limit order at
+# the bid/ask midpoint (LIMIT_PRICE=mid) or last trade (last) for
+# LIMIT_TIMEOUT seconds, then sends whatever is unfilled at market.
+# 'sliced' sends market child orders of at most SLICE_SIZE every
+# SLICE_INTERVAL seconds, keeping fills within SLICE_PARTICIPATION of the
+# volume traded since the order started. Without volume from IB, children
+# are held to SLICE_MIN_SIZE, or the order stops when that is 0. Signals
+# may pick the mode with "order_type" and the size with "qty"
+EXECUTION_MODES = ['market', 'limit', 'sliced']
+execution_mode = os.getenv('EXECUTION_MODE', 'market').lower()
+limit_price_source = os.getenv('LIMIT_PRICE', 'mid').lower()
+limit_timeout = float(os.getenv('LIMIT_TIMEOUT', '10'))
+limit_tick = float(os.getenv('LIMIT_TICK', '0.01'))  # When IB does not report the contract's tick
+slice_size = int(os.getenv('SLICE_SIZE', '100'))
+slice_interval = float(os.getenv('SLICE_INTERVAL', '5'))
+slice_participation = float(os.getenv('SLICE_PARTICIPATION', '0.1'))  # 0 disables the cap
+slice_min_size = int(os.getenv('SLICE_MIN_SIZE', '0'))  # Child size while volume is unknown; 0 stops
+slice_max_duration = float(os.getenv('SLICE_MAX_DURATION', '1800'))
+quote_timeout = float(os.getenv('QUOTE_TIMEOUT', '2'))
+
+# Pre-trade risk limits, 0 disables each: shares per symbol, notional per
+# order, orders per symbol per minute, and realized loss per day before new
+# entries stop. Halts are set through /admin/halt, which needs ADMIN_TOKEN
+risk_max_position = float(os.getenv('RISK_MAX_POSITION', '0'))
+risk_max_notional = float(os.getenv('RISK_MAX_NOTIONAL', '0'))
+risk_max_orders_per_minute = int(os.getenv('RISK_MAX_ORDERS_PER_MINUTE', '0'))
+risk_max_daily_loss = float(os.getenv('RISK_MAX_DAILY_LOSS', '0'))
+admin_token = os.getenv('ADMIN_TOKEN', '')  # Empty disables the admin endpoints
+
+# Runtime settings: CONFIG_FILE holds a JSON object of reloadable settings
+# by their env names, applied over the environment at startup and again on
+# SIGHUP. POST /admin/config changes them directly
+config_file = os.getenv('CONFIG_FILE', '')
+
+# Batch signals: most legs accepted in one webhook
+batch_max_signals = int(os.getenv('BATCH_MAX_SIGNALS', '20'))
+
+# Per-symbol order lanes: signals for one symbol run in arrival order.
+# Beyond LANE_MAX_DEPTH signals queued for a symbol (429) or
+# MAX_PENDING_SIGNALS overall (503), new signals are refused at once
+lane_max_depth = int(os.getenv('LANE_MAX_DEPTH', '8'))
+max_pending_signals = int(os.getenv('MAX_PENDING_SIGNALS', '256'))
+
+# Health: /health and /ready serve a snapshot kept current by connection
+# and position events. IB round-trip latency is measured by a lightweight
+# ping every HEALTH_PING_INTERVAL seconds (0 disables it)
+health_ping_interval = float(os.getenv('HEALTH_PING_INTERVAL', '15'))
+health_ping_timeout = float(os.getenv('HEALTH_PING_TIMEOUT', '5'))
+
+# Contract registry: symbols to pre-qualify at startup, as SYMBOL or
+# SYMBOL:EXCHANGE:CURRENCY, comma separated
+warmup_symbols = [tuple(part or None for part in (spec.strip().split(':') + [None, None])[:3])
+                  for spec in os.getenv('WARMUP_SYMBOLS', '').split(',') if spec.strip()]
+contract_cache_size = int(os.getenv('CONTRACT_CACHE_SIZE', '256'))
+contract_cache_ttl = int(os.getenv('CONTRACT_CACHE_TTL', '86400'))
+qualify_batch_size = int(os.getenv('QUALIFY_BATCH_SIZE', '50'))
+
+# Quote cache: streaming market data for the configured contract and the
+# most recently traded ones, at most QUOTE_CACHE_SIZE subscriptions (keep it
+# under the account's market data lines; 0 streams only while an order
+# needs a quote). Order logic and GET /quote read it without waiting on IB
+quote_cache_size = int(os.getenv('QUOTE_CACHE_SIZE', '50'))
+
 # Security settings
 enable_security_filter = os.getenv('ENABLE_SECURITY_FILTER', 'true').lower() == 'true'
 rate_limit_requests = int(os.getenv('RATE_LIMIT_REQUESTS', '10'))
 rate_limit_window = int(os.getenv('RATE_LIMIT_WINDOW', '60'))
+rate_limit_algorithm = os.getenv('RATE_LIMIT_ALGORITHM', 'sliding_window').lower()
+rate_limit_routes = os.getenv('RATE_LIMIT_ROUTES', '')  # e.g. /health=120/60,/metrics=30/60
+rate_limit_max_clients = int(os.getenv('RATE_LIMIT_MAX_CLIENTS', '10000'))
+# User-Agent substrings to block (case-insensitive), comma separated
+blocked_user_agents = [ua.strip() for ua in os.getenv('BLOCKED_USER_AGENTS', 'bot,scanner,crawler').split(',')
+                       if ua.strip()]
+body_sniff_bytes = int(os.getenv('BODY_SNIFF_BYTES', '8'))
+security_rules_file = os.getenv('SECURITY_RULES_FILE', '')  # JSON, overrides the settings above
+
+# Signal deduplication: signals repeating an explicit idempotency key within
+# IDEMPOTENCY_KEY_TTL get the first signal's result instead of reaching IB
+# again. With DEDUP_WINDOW > 0, a keyless body identical to one that is still
+# being processed (for at most DEDUP_WINDOW seconds) is a duplicate too
+dedup_window = int(os.getenv('DEDUP_WINDOW', '0'))
+idempotency_key_ttl = int(os.getenv('IDEMPOTENCY_KEY_TTL', '86400'))
+dedup_cache_size = int(os.getenv('DEDUP_CACHE_SIZE', '4096'))
+
+# Durable signal queue: with SIGNAL_QUEUE_DIR set, accepted signals are
+# appended to a write-ahead log there and answered with 202 right away. A
+# worker drains the log into the bot, and after a restart replays what was
+# unfinished, skipping signals IB already has orders for. SIGNAL_QUEUE_FSYNC:
+# 'always' syncs the log before answering, 'interval' every
+# SIGNAL_QUEUE_FSYNC_INTERVAL seconds, 'never' leaves it to the OS.
+# Empty SIGNAL_QUEUE_DIR keeps webhooks waiting for IB
+SIGNAL_QUEUE_FSYNC_POLICIES = ['always', 'interval', 'never']
+signal_queue_dir = os.getenv('SIGNAL_QUEUE_DIR', '')
+signal_queue_fsync = os.getenv('SIGNAL_QUEUE_FSYNC', 'always').lower()
+signal_queue_fsync_interval = float(os.getenv('SIGNAL_QUEUE_FSYNC_INTERVAL', '0.05'))
+signal_queue_max_pending = int(os.getenv('SIGNAL_QUEUE_MAX_PENDING', '10000'))
+signal_queue_max_inflight = int(os.getenv('SIGNAL_QUEUE_MAX_INFLIGHT', '64'))
+signal_queue_max_age = float(os.getenv('SIGNAL_QUEUE_MAX_AGE', '0'))  # 0 never drops unsent signals
+signal_queue_retry_interval = float(os.getenv('SIGNAL_QUEUE_RETRY_INTERVAL', '1'))
+signal_queue_compact_bytes = int(os.getenv('SIGNAL_QUEUE_COMPACT_BYTES', str(16 * 1024 * 1024)))
+
+# Trade journal: recent trades in memory, full history as JSONL segments
+# under JOURNAL_DIR (empty keeps history in memory only)
+journal_dir = os.getenv('JOURNAL_DIR', 'logs')
+journal_memory_size = int(os.getenv('JOURNAL_MEMORY_SIZE', '1000'))
+journal_segment_bytes = int(os.getenv('JOURNAL_SEGMENT_BYTES', str(16 * 1024 * 1024)))
+journal_max_segments = int(os.getenv('JOURNAL_MAX_SEGMENTS', '20'))
+journal_flush_interval = float(os.getenv('JOURNAL_FLUSH_INTERVAL', '0.5'))
+
+def _positive(value):
+    return value > 0
+
+def _non_negative(value):
+    return value >= 0
+
+# Settings CONFIG_FILE and /admin/config may change, by env name:
+# (module global, parser, check)
+RELOADABLE_SETTINGS = {
+    'INSTRUMENT': ('instructment', str, bool),
+    'EXCHANGE': ('exchange', str.upper, bool),
+    'ORDER_SIZE': ('order_size', int, _positive),
+    'ORDER_COMPLETION': ('order_completion', str.lower, lambda value: value in ORDER_COMPLETION_POLICIES),
+    'ORDER_COMPLETION_TIMEOUT': ('order_completion_timeout', float, _positive),
+    'EXECUTION_MODE': ('execution_mode', str.lower, lambda value: value in EXECUTION_MODES),
+    'LIMIT_PRICE': ('limit_price_source', str.lower, lambda value: value in ('mid', 'last')),
+    'LIMIT_TIMEOUT': ('limit_timeout', float, _non_negative),
+    'LIMIT_TICK': ('limit_tick', float, _positive),
+    'SLICE_SIZE': ('slice_size', int, _positive),
+    'SLICE_INTERVAL': ('slice_interval', float, _non_negative),
+    'SLICE_PARTICIPATION': ('slice_participation', float, _non_negative),
+    'SLICE_MIN_SIZE': ('slice_min_size', int, _non_negative),
+    'SLICE_MAX_DURATION': ('slice_max_duration', float, _positive),
+    'QUOTE_TIMEOUT': ('quote_timeout', float, _positive),
+    'QUOTE_CACHE_SIZE': ('quote_cache_size', int, _non_negative),
+    'RISK_MAX_POSITION': ('risk_max_position', float, _non_negative),
+    'RISK_MAX_NOTIONAL': ('risk_max_notional', float, _non_negative),
+    'RISK_MAX_ORDERS_PER_MINUTE': ('risk_max_orders_per_minute', int, _non_negative),
+    'RISK_MAX_DAILY_LOSS': ('risk_max_daily_loss', float, _non_negative),
+    'BATCH_MAX_SIGNALS': ('batch_max_signals', int, _positive),
+    'LANE_MAX_DEPTH': ('lane_max_depth', int, _positive),
+    'MAX_PENDING_SIGNALS': ('max_pending_signals', int, _positive),
+    'DEDUP_WINDOW': ('dedup_window', int, _non_negative),
+    'IDEMPOTENCY_KEY_TTL': ('idempotency_key_ttl', int, _positive),
+    'RATE_LIMIT_REQUESTS': ('rate_limit_requests', int, _positive),
+    'RATE_LIMIT_WINDOW': ('rate_limit_window', int, _positive),
+}
+
+def parse_settings(changes):
+    """Validate {env name: value}; raises ValueError at the first bad one, so
+    a change is applied whole or not at all"""
+    if not isinstance(changes, dict):
+        raise ValueError("Settings must be a JSON object of env names to values")
+    settings = {}
+    for name, raw in changes.items():
+        if name not in RELOADABLE_SETTINGS:
+            raise ValueError(f"'{name}' cannot be changed at runtime; "
+                             f"reloadable: {', '.join(RELOADABLE_SETTINGS)}")
+        _, parse, check = RELOADABLE_SETTINGS[name]
+        try:
+            if isinstance(raw, bool) or not isinstance(raw, (str, int, float)):
+                raise ValueError
+            value = parse(str(raw).strip())
+            if not check(value):
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"Invalid {name} '{raw}'") from None
+        settings[name] = value
+    return settings
+
+def settings_globals(settings):
+    """Module globals for validated settings, with the values derived from them"""
+    updates = {RELOADABLE_SETTINGS[name][0]: value for name, value in settings.items()}
+    updates['signal_timeout'] = max(30, updates.get('order_completion_timeout', order_completion_timeout) + 5)
+    return updates
+
+def load_config_file(path):
+    """CONFIG_FILE's settings, validated; raises ValueError"""
+    try:
+        with open(path, 'rb') as f:
+            return parse_settings(json_loads(f.read()))
+    except OSError as e:
+        raise ValueError(f"Could not read {path}: {e}") from None
+
+if config_file:
+    try:
+        globals().update(settings_globals(load_config_file(config_file)))
+    except ValueError as e:
+        raise SystemExit(f"CONFIG_FILE: {e}")
 ############################
 
-class BotManager:
+class Metrics:
+    """Counters, gauges and latency histograms in Prometheus text format.
+    
+    Every thread records into its own shard, so recording on the hot path
+    takes no lock; /metrics merges the shards when it is scraped. Shards of
+    threads that have exited are folded into a retired shard.
+    """
+    
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    
     def __init__(self):
-        self.bot = None
-        self.initialization_thread = None
-        self.is_initializing = False
-        self.last_init_attempt = 0
-        
-    def get_bot(self):
-        """Get the bot instance, trigger initialization if needed"""
-        current_time = time.time()
-        
-        # If bot is None or not connected, and enough time has passed since last attempt
-        if (self.bot is None or not self._is_bot_connected()) and \
-           (current_time - self.last_init_attempt) > retry_interval and \
-           not self.is_initializing:
-            
-            logger.info("Bot not available, triggering initialization...")
+        self._local = threading.local()
+        self._lock = threading.Lock()  # Guards the shard list, not the shards
+        self._shards = []  # (thread, shard)
+        self._retired = self._new_shard()
+        self._gauges = {}  # name -> (help, callable returning {labels: value})
+        self._help = {}
+    
+    @staticmethod
+    def _new_shard():
+        return {'counters': defaultdict(float), 'histograms': {}}
+    
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = self._new_shard()
+            with self._lock:
+                if len(self._shards) > 64:
+                    self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+    
+    def _retire_dead_shards(self):
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = alive
+    
+    def _merge(self, into, shard):
+        for key, value in list(shard['counters'].items()):
+            into['counters'][key] += value
+        for key, (buckets, total, count) in list(shard['histograms'].items()):
+            merged = into['histograms'].setdefault(key, [[0] * (len(self.BUCKETS) + 1), 0.0, 0])
+            for i, n in enumerate(buckets):
+                merged[0][i] += n
+            merged[1] += total
+            merged[2] += count
+    
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+    
+    def inc(self, name, value=1, **labels):
+        self._shard()['counters'][(name, tuple(sorted(labels.items())))] += value
+    
+    def observe(self, name, value, **labels):
+        histograms = self._shard()['histograms']
+        key = (name, tuple(sorted(labels.items())))
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * (len(self.BUCKETS) + 1), 0.0, 0]
+        histogram[0][bisect.bisect_left(self.BUCKETS, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+    
+    def timer(self, name, **labels):
+        """Context manager observing the elapsed seconds of its block"""
+        return _MetricsTimer(self, name, labels)
+    
+    def gauge(self, name, help_text, read):
+        """Register a gauge; read() returns a value or a {labels: value} dict"""
+        self._gauges[name] = (help_text, read)
+    
+    @staticmethod
+    def _labels(labels, extra=None):
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+    
+    def render(self):
+        """Prometheus text exposition of everything recorded so far"""
+        total = self._new_shard()
+        with self._lock:
+            self._retire_dead_shards()
+            self._merge(total, self._retired)
+            for _, shard in self._shards:
+                self._merge(total, shard)
+        
+        lines = []
+        by_name = defaultdict(list)
+        for (name, labels), value in total['counters'].items():
+            by_name[name].append((labels, value))
+        for name in sorted(by_name):
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(by_name[name]):
+                lines.append(f"{name}{self._labels(labels)} {value:g}")
+        
+        by_name = defaultdict(list)
+        for (name, labels), histogram in total['histograms'].items():
+            by_name[name].append((labels, histogram))
+        for name in sorted(by_name):
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, (buckets, value_sum, count) in sorted(by_name[name]):
+                cumulative = 0
+                for bound, n in zip(self.BUCKETS + (float('inf'),), buckets):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                    lines.append(f"{name}_bucket{self._labels(labels, ('le', le))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {value_sum:.6f}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        
+        for name, (help_text, read) in sorted(self._gauges.items()):
+            try:
+                values = read()
+            except Exception:
+                continue
+            if not isinstance(values, dict):
+                values = {(): values}
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in sorted(values.items()):
+                if value is not None:
+                    lines.append(f"{name}{self._labels(labels)} {float(value):g}")
+        return '\n'.join(lines) + '\n'
+
+class _MetricsTimer:
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+    
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+metrics = Metrics()
+metrics.describe('tradingbot_signals_total', 'Webhook signals received, by direction')
+metrics.describe('tradingbot_orders_total', 'Orders placed, by action and resulting status')
+metrics.describe('tradingbot_rejects_total', 'Requests rejected before reaching IB, by reason')
+metrics.describe('tradingbot_rate_limited_total', 'Requests refused by the rate limiter')
+metrics.describe('tradingbot_timeouts_total', 'IB commands whose caller gave up waiting, by action')
+metrics.describe('tradingbot_duplicates_total', 'Signals answered from the dedup cache')
+metrics.describe('tradingbot_stage_seconds', 'Latency of each webhook pipeline stage')
+metrics.describe('tradingbot_command_seconds', 'Time spent running each IB command on the event loop')
+
+def new_request_id():
+    """Short unique ID used to correlate a webhook with its IB commands"""
+    return uuid.uuid4().hex[:12]
+
+# IB orderRef for the orders the current command places: its request ID (or
+# signal queue entry), plus /<leg> in a batch. Replayed signals are matched
+# to the orders they already have at IB by it
+order_ref = contextvars.ContextVar('order_ref', default='')
+
+async def with_order_ref(ref, coro):
+    """Await coro with the orders it places tagged ref"""
+    order_ref.set(ref)
+    return await coro
+
+def parse_connections(spec):
+    """Parse IB_CONNECTIONS into (name, host, port, clientId, account) tuples"""
+    connections = []
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, host, port, client, account = (item.strip().split(':') + [None])[:5]
+        connections.append((name, host, int(port), int(client), account or None))
+    return connections or [('default', ib_host, ib_port, client_id, None)]
+
+def parse_strategy_routes(spec):
+    """Parse STRATEGY_ROUTES into {strategy: connection name}"""
+    return dict(item.strip().split('=', 1) for item in spec.split(',') if item.strip())
+
+class BotManager:
+    """Pool of IB connections, each a TradingBotAsync with its own event loop.
+    
+    Signals are routed by account or strategy, otherwise to the first
+    connection. When the chosen connection is down, another ready
+    connection trading the same account takes the signal.
+    """
+    
+    def __init__(self, connections, strategy_routes=None):
+        self.connections = {spec[0]: spec for spec in connections}
+        self.primary = connections[0][0]
+        self.strategy_routes = strategy_routes or {}
+        for strategy, name in self.strategy_routes.items():
+            if name not in self.connections:
+                raise ValueError(f"Strategy '{strategy}' routes to unknown connection '{name}'")
+        self.bots = {}  # name -> TradingBotAsync
+        self.loop = None  # Shared event loop in ASGI mode
+        
+        # Health snapshot (summary, detail, ready), rebuilt by the bots on
+        # every connection or position change so probes only read it
+        self._health = None
+        self._health_lock = threading.Lock()
+    
+    @property
+    def bot(self):
+        """The primary connection's bot"""
+        return self.bots.get(self.primary)
+        
+    def get_bot(self, account=None, strategy=None):
+        """Get a bot that is ready for the signal's route, else None.
+        
+        Starts the pool on first use; after that each bot's supervisor
+        keeps its IB connection up, so this never blocks or spawns anything.
+        Raises ValueError for an unknown account or strategy.
+        """
+        if not self.bots:
             self._start_initialization()
+        for name in self.route(account, strategy):
+            bot = self.bots.get(name)
+            if bot is not None and bot.is_ready():
+                return bot
+        return None
+    
+    def route(self, account=None, strategy=None):
+        """Connection names for a signal: the preferred one, then its failovers"""
+        if strategy:
+            if strategy not in self.strategy_routes:
+                raise ValueError(f"Unknown strategy '{strategy}'")
+            preferred = self.strategy_routes[strategy]
+            if account and account != self.connections[preferred][4]:
+                raise ValueError(f"Strategy '{strategy}' does not trade account '{account}'")
+        elif account:
+            preferred = next((name for name, spec in self.connections.items() if spec[4] == account), None)
+            if preferred is None:
+                raise ValueError(f"Unknown account '{account}'")
+        else:
+            preferred = self.primary
+        
+        # Fail over only to connections trading the same account
+        account = self.connections[preferred][4]
+        return [preferred] + [name for name, spec in self.connections.items()
+                              if spec[4] == account and name != preferred]
+    
+    def status(self):
+        """Health of every connection in the pool"""
+        status = {}
+        for name, spec in self.connections.items():
+            bot = self.bots.get(name)
+            status[name] = {
+                "ready": bot is not None and bot.is_ready(),
+                "account": spec[4],
+                "endpoint": f"{spec[1]}:{spec[2]}/{spec[3]}",
+                "reconnects": bot.reconnect_count if bot else 0,
+                "error": bot.connection_error if bot else None,
+                "latency_ms": round(bot.latency * 1000, 3) if bot and bot.latency is not None else None,
+                "last_ping": bot.last_ping if bot else None,
+                "open_positions": bot.positions.open_positions() if bot else 0,
+            }
+        return status
+    
+    def refresh_health(self):
+        """Rebuild the health snapshot; the bots call this on state changes"""
+        with self._health_lock:
+            bot = next((self.bots[name] for name in self.route()
+                        if name in self.bots and self.bots[name].is_ready()), None)
+            if bot and bot.contract:
+                summary = {"status": "healthy", "bot": "connected", "contract": str(bot.contract),
+                           "time_to_ready": bot.time_to_ready, "reconnects": bot.reconnect_count}
+            else:
+                summary = {"status": "initializing", "bot": "connecting"}
+            summary["updated_at"] = time.time()
+            detail = dict(summary, connections=self.status())
+            self._health = (summary, detail, bot is not None)
+            return self._health
+    
+    def health(self):
+        """Latest health snapshot, without touching IB or starting anything"""
+        return self._health or self.refresh_health()
+    
+    def attach_loop(self, loop):
+        """Create future bots on the given (ASGI server) event loop"""
+        self.loop = loop
+    
+    def _start_initialization(self):
+        """Create the bots; connecting and contract setup run in the background"""
+        if self.bots:
+            return
+        
+        logger.info("Starting bot initialization...")
+        logger.info(f"Setting contract for {instructment} on {exchange}...")
+        for name, host, port, client, account in self.connections.values():
+            logger.info(f"Connection {name}: {host}:{port} client {client}" + (f" account {account}" if account else ""))
+            self.bots[name] = TradingBotAsync(host, port, client, order_size, loop=self.loop,
+                                              contract_spec=(exchange, "STK", instructment),
+                                              warmup=warmup_symbols, account=account,
+                                              on_change=self.refresh_health)
+        self.refresh_health()
+    
+    def stop(self):
+        """Disconnect every connection"""
+        for bot in self.bots.values():
+            bot.stop()
+
+# Global bot manager
+bot_manager = BotManager(parse_connections(ib_connections), parse_strategy_routes(strategy_routes))
+
+def per_connection(read):
+    """Gauge reader labelled by connection name"""
+    return lambda: {(('connection', name),): read(bot) for name, bot in bot_manager.bots.items()}
+
+metrics.gauge('tradingbot_ib_connected', 'Whether the IB connection is up',
+              per_connection(lambda bot: bot.ib.isConnected()))
+metrics.gauge('tradingbot_ready', 'Whether the bot is accepting signals',
+              per_connection(lambda bot: bot.is_ready()))
+metrics.gauge('tradingbot_pending_commands', 'IB commands dispatched and not yet finished',
+              per_connection(lambda bot: len(bot.pending_requests)))
+metrics.gauge('tradingbot_time_to_ready_seconds', 'Seconds from start or last disconnect until ready',
+              per_connection(lambda bot: bot.time_to_ready))
+metrics.gauge('tradingbot_reconnects', 'IB reconnections since start',
+              per_connection(lambda bot: bot.reconnect_count))
+metrics.gauge('tradingbot_ib_latency_seconds', 'IB round trip measured by the health ping',
+              per_connection(lambda bot: bot.latency))
+metrics.gauge('tradingbot_queued_signals', 'Signals running or waiting in the order lanes',
+              per_connection(lambda bot: bot.lanes.pending))
+metrics.gauge('tradingbot_quote_subscriptions', 'Contracts streaming market data into the quote cache',
+              per_connection(lambda bot: len(bot.quotes)))
+
+class ContractRegistry:
+    """Bounded LRU cache of qualified contracts with a time-to-live.
+    
+    Keyed by (symbol, exchange, currency) as given in the signal, so a
+    repeat signal never pays for qualifyContractsAsync again.
+    """
+    
+    def __init__(self, max_size=256, ttl=86400):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, contract)
+    
+    @staticmethod
+    def key(symbol, exchange=None, currency=None):
+        return (symbol.upper(), (exchange or '').upper(), (currency or '').upper())
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def put(self, key, contract):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, contract)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def __len__(self):
+        return len(self._entries)
+
+class QuoteCache:
+    """Streaming quotes for the configured and recently traded contracts.
+    
+    Holds at most max_size reqMktData subscriptions in LRU order; to make
+    room, the least recently used one that no working order is reading is
+    cancelled. IB keeps every Ticker current, so a price lookup is a dict
+    read and never waits on IB. Subscribe on the IB loop; read from any thread.
+    """
+    
+    def __init__(self, ib, max_size=50):
+        self.ib = ib
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._tickers = OrderedDict()  # conId -> Ticker
+        self._pinned = set()  # conIds never evicted: the configured contract
+        self._users = defaultdict(int)  # conId -> working orders reading the ticker
+    
+    def track(self, contract, pin=False):
+        """Keep a contract streaming; a no-op with the cache disabled"""
+        if self.max_size <= 0 or contract is None or not contract.conId:
+            return None
+        if pin:
+            self._pinned = {contract.conId}
+        return self._subscribe(contract)
+    
+    @contextlib.contextmanager
+    def hold(self, contract):
+        """Keep a contract streaming while a working order reads its ticker"""
+        self._users[contract.conId] += 1
+        try:
+            yield self._subscribe(contract)
+        finally:
+            self._users[contract.conId] -= 1
+            if not self._users[contract.conId]:
+                del self._users[contract.conId]
+            self._evict()
+    
+    def _subscribe(self, contract):
+        with self._lock:
+            ticker = self._tickers.get(contract.conId)
+            if ticker is not None:
+                self._tickers.move_to_end(contract.conId)
+                return ticker
+        ticker = self.ib.reqMktData(contract)
+        with self._lock:
+            self._tickers[contract.conId] = ticker
+        self._evict()
+        return ticker
+    
+    def _evict(self):
+        """Cancel least recently used subscriptions beyond max_size"""
+        with self._lock:
+            excess = len(self._tickers) - max(self.max_size, 0)
+            evicted = []
+            for conId in list(self._tickers):
+                if len(evicted) >= excess:
+                    break
+                if conId not in self._pinned and conId not in self._users:
+                    evicted.append(self._tickers.pop(conId))
+        for ticker in evicted:
+            self.ib.cancelMktData(ticker.contract)
+    
+    def resize(self, max_size):
+        self.max_size = max_size
+        if max_size <= 0:
+            self._pinned = set()
+        self._evict()
+    
+    def resubscribe(self):
+        """Request every stream again: subscriptions do not survive a reconnect"""
+        with self._lock:
+            contracts = [ticker.contract for ticker in self._tickers.values()]
+        for contract in contracts:
+            ticker = self.ib.reqMktData(contract)
+            with self._lock:
+                self._tickers[contract.conId] = ticker
+    
+    def ticker(self, conId):
+        return self._tickers.get(conId)
+    
+    def price(self, conId, source='mid'):
+        """Current price of a streaming contract, or None"""
+        return quote_price(self._tickers.get(conId), source)
+    
+    def quote(self, conId):
+        """Bid, ask and last of a streaming contract, or None"""
+        ticker = self._tickers.get(conId)
+        return self._quote(ticker) if ticker is not None else None
+    
+    def quotes(self):
+        with self._lock:
+            tickers = list(self._tickers.values())
+        return [self._quote(ticker) for ticker in reversed(tickers)]
+    
+    @staticmethod
+    def _quote(ticker):
+        contract = ticker.contract
+        return {
+            "symbol": contract.symbol,
+            "conId": contract.conId,
+            "exchange": contract.exchange,
+            "currency": contract.currency,
+            "bid": ticker.bid if valid_price(ticker.bid) else None,
+            "ask": ticker.ask if valid_price(ticker.ask) else None,
+            "last": ticker.last if valid_price(ticker.last) else None,
+            "mid": quote_price(ticker) if valid_price(ticker.bid) and valid_price(ticker.ask) else None,
+            "volume": ticker.volume if ticker.volume == ticker.volume else None,
+            "time": ticker.time.isoformat() if ticker.time else None,
+        }
+    
+    def __len__(self):
+        return len(self._tickers)
+
+class PositionBook:
+    """Positions and in-flight order quantities keyed by conId.
+    
+    Loaded from ib.positions() at connect time and kept current from
+    positionEvent and execDetailsEvent, so position checks are a dict
+    lookup instead of a scan of ib.positions(). Updated on the IB loop and
+    read from webhook threads, hence the lock.
+    
+    positionEvent is authoritative. A fill seen before its position update
+    counts as unconfirmed on top of IB's position until an update covers
+    it; a position change seen before its fill is kept as a short-lived
+    credit that the fill then consumes instead of counting twice.
+    """
+    
+    CREDIT_TTL = 5.0  # Seconds a position change waits for its fill
+    
+    def __init__(self, account=None):
+        self.account = account  # Only count this account's positions, if set
+        self._lock = threading.Lock()
+        self._positions = defaultdict(dict)  # conId -> {account: position}
+        self._unconfirmed = defaultdict(dict)  # conId -> {account: signed fills not yet in the position}
+        self._credits = {}  # (conId, account) -> (signed position change not yet filled, monotonic time)
+        self._pending = defaultdict(float)  # conId -> signed unfilled quantity
+        self._reservations = {}  # reservation -> [conId, signed unfilled quantity]
+        self._orders = {}  # orderId -> reservation
+        self._next_reservation = itertools.count(1)
+    
+    def load(self, positions):
+        """Replace the book with a full positions snapshot"""
+        with self._lock:
+            self._positions.clear()
+            self._unconfirmed.clear()
+            self._credits.clear()
+            for pos in positions:
+                if not self.account or pos.account == self.account:
+                    self._positions[pos.contract.conId][pos.account] = pos.position
+    
+    def on_position(self, pos):
+        """positionEvent handler: IB's absolute position for one account"""
+        if self.account and pos.account != self.account:
+            return
+        conId, account = pos.contract.conId, pos.account
+        with self._lock:
+            accounts = self._positions[conId]
+            change = pos.position - accounts.get(account, 0)
+            accounts[account] = pos.position
+            # The change first covers fills already counted, the rest waits for its fill
+            unconfirmed = self._unconfirmed[conId]
+            covered = self._overlap(unconfirmed.get(account, 0), change)
+            if covered:
+                unconfirmed[account] -= covered
+                change -= covered
+            if change:
+                self._credits[conId, account] = (self._credit(conId, account) + change, time.monotonic())
+    
+    def on_exec(self, trade, fill):
+        """execDetailsEvent handler: count the fill until its position update arrives"""
+        execution = fill.execution
+        if self.account and execution.acctNumber != self.account:
+            return
+        signed = execution.shares if execution.side == 'BOT' else -execution.shares
+        conId, account = fill.contract.conId, execution.acctNumber
+        with self._lock:
+            # A position update that came first already counted (part of) this fill
+            credit = self._credit(conId, account)
+            covered = self._overlap(credit, signed)
+            if covered:
+                self._credits[conId, account] = (credit - covered, self._credits[conId, account][1])
+            unconfirmed = self._unconfirmed[conId]
+            unconfirmed[account] = unconfirmed.get(account, 0) + signed - covered
             
-        return self.bot
+            reservation = self._orders.get(trade.order.orderId)
+            if reservation in self._reservations:
+                entry = self._reservations[reservation]
+                remaining = entry[1] - signed
+                if remaining * entry[1] <= 0:
+                    remaining = 0
+                self._pending[conId] += remaining - entry[1]
+                entry[1] = remaining
+    
+    def _credit(self, conId, account):
+        credit, at = self._credits.get((conId, account), (0, 0.0))
+        if time.monotonic() - at > self.CREDIT_TTL:
+            self._credits.pop((conId, account), None)
+            return 0
+        return credit
+    
+    @staticmethod
+    def _overlap(pending, change):
+        """The part of change that pending (of the same sign) accounts for"""
+        if pending > 0 and change > 0:
+            return min(pending, change)
+        if pending < 0 and change < 0:
+            return max(pending, change)
+        return 0
+    
+    def _position(self, conId):
+        return sum(self._positions.get(conId, {}).values()) + sum(self._unconfirmed.get(conId, {}).values())
+    
+    def open_positions(self):
+        """Number of contracts with a nonzero filled position"""
+        with self._lock:
+            return sum(1 for conId in self._positions.keys() | self._unconfirmed.keys() if self._position(conId))
+    
+    def position(self, conId):
+        """Net filled position across accounts"""
+        with self._lock:
+            return self._position(conId)
+    
+    def exposure(self, conId):
+        """Filled position plus orders that are still working"""
+        with self._lock:
+            return self._exposure(conId)
+    
+    def _exposure(self, conId):
+        # Credits are fills already in the position whose orders still count as pending
+        pending = self._pending.get(conId, 0)
+        credits = sum(self._credit(*key) for key in list(self._credits) if key[0] == conId)
+        return self._position(conId) + pending - self._overlap(pending, credits)
+    
+    def reserve(self, conId, signed_qty, threshold=None, check=None):
+        """Count an order as in flight before it is placed.
+        
+        With a threshold, the reservation is refused (None is returned) when
+        the exposure in the order's direction already reaches it, so a burst
+        of identical signals cannot stack duplicate orders. check(signed_qty,
+        exposure) runs against the same exposure and may raise to refuse it.
+        """
+        with self._lock:
+            return self._reserve(conId, signed_qty, threshold, check)
+    
+    def reserve_close(self, conId, direction):
+        """Reserve an order flattening the current exposure.
+        
+        Returns (reservation, signed_qty), or (None, exposure) when there is
+        nothing to close in that direction.
+        """
+        with self._lock:
+            return self._reserve_close(conId, direction)
+    
+    def reserve_batch(self, legs):
+        """Reserve the legs of a batch signal in one pass over the book.
+        
+        Legs are (conId, direction, qty, threshold, check) and are applied
+        in order, so a close followed by a new entry on the same contract
+        sees the close. Returns (reservation, signed_qty, error) per leg,
+        with the same None results as reserve() and reserve_close(), and the
+        exception of a leg its check refused.
+        """
+        results = []
+        with self._lock:
+            for conId, direction, qty, threshold, check in legs:
+                if direction in ("close_long", "close_short"):
+                    results.append(self._reserve_close(conId, direction) + (None,))
+                    continue
+                signed_qty = qty if direction == "long" else -qty
+                try:
+                    results.append((self._reserve(conId, signed_qty, threshold, check), signed_qty, None))
+                except Exception as e:
+                    results.append((None, signed_qty, e))
+        return results
+    
+    def _reserve(self, conId, signed_qty, threshold, check=None):
+        exposure = self._exposure(conId)
+        if threshold is not None:
+            if (signed_qty > 0 and exposure >= threshold) or \
+               (signed_qty < 0 and exposure <= -threshold):
+                return None
+        if check is not None:
+            check(signed_qty, exposure)
+        return self._add_reservation(conId, signed_qty)
+    
+    def _reserve_close(self, conId, direction):
+        exposure = self._exposure(conId)
+        if (direction == "close_long" and exposure <= 0) or \
+           (direction == "close_short" and exposure >= 0):
+            return None, exposure
+        return self._add_reservation(conId, -exposure), -exposure
+    
+    def _add_reservation(self, conId, signed_qty):
+        reservation = next(self._next_reservation)
+        self._reservations[reservation] = [conId, signed_qty]
+        self._pending[conId] += signed_qty
+        return reservation
+    
+    def track(self, reservation, trade, release=True):
+        """Attach a placed order so fills update its reservation, and its
+        completion releases it unless release is False"""
+        with self._lock:
+            self._orders[trade.order.orderId] = reservation
+        if not release:
+            return
+        
+        def on_status(trade):
+            if trade.isDone() or trade.orderStatus.status == 'Inactive':
+                self.release(reservation)
+        
+        trade.statusEvent += on_status
+        on_status(trade)
+    
+    def reconcile(self, reservation, unfilled):
+        """Set a reservation's signed unfilled quantity, e.g. after a
+        reconnect, when fills made while disconnected were never seen"""
+        with self._lock:
+            entry = self._reservations.get(reservation)
+            if entry:
+                self._pending[entry[0]] += unfilled - entry[1]
+                entry[1] = unfilled
+    
+    def release(self, reservation):
+        """Drop whatever is left of a reservation"""
+        with self._lock:
+            entry = self._reservations.pop(reservation, None)
+            if entry:
+                self._pending[entry[0]] -= entry[1]
+                for orderId, res in list(self._orders.items()):
+                    if res == reservation:
+                        del self._orders[orderId]
+
+class Backpressure(Exception):
+    """A signal refused because the order lanes are full"""
+    
+    def __init__(self, message, http_status):
+        super().__init__(message)
+        self.http_status = http_status
+
+class _Lane:
+    __slots__ = ('lock', 'depth')
+    
+    def __init__(self):
+        self.lock = asyncio.Lock()  # FIFO, so signals run in arrival order
+        self.depth = 0  # Signals running or waiting in this lane
+
+class OrderLanes:
+    """Per-symbol ordered lanes on the IB event loop.
+    
+    Signals for the same symbol run one at a time, in arrival order, so
+    open and close decisions on a contract never race; signals for other
+    symbols run alongside them. Lanes are bounded: a signal is refused with
+    Backpressure when its lane already holds max_depth signals, or when
+    max_pending signals are queued in total, instead of waiting out its
+    timeout. Only used from the IB loop, so no lock is needed.
+    """
     
-    def _is_bot_connected(self):
-        """Check if bot is connected and has a valid contract"""
+    def __init__(self, max_depth=8, max_pending=256):
+        self.max_depth = max_depth
+        self.max_pending = max_pending
+        self.pending = 0
+        self._lanes = {}  # key -> _Lane
+    
+    @contextlib.asynccontextmanager
+    async def hold(self, keys):
+        """Run the body once every lane in keys is free.
+        
+        Lanes are entered in sorted order, so batches spanning several
+        symbols cannot deadlock each other.
+        """
+        keys = sorted(set(keys))
+        if self.pending >= self.max_pending:
+            raise Backpressure(f"Bot busy: {self.pending} signals pending", 503)
+        for key in keys:
+            lane = self._lanes.get(key)
+            if lane is not None and lane.depth >= self.max_depth:
+                raise Backpressure(f"Too many pending signals for {key}", 429)
+        
+        lanes = []
+        for key in keys:
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = _Lane()
+            lane.depth += 1
+            lanes.append(lane)
+        self.pending += 1
+        
+        acquired = []
         try:
-            return (self.bot is not None and 
-                   self.bot.ib.isConnected() and 
-                   self.bot.contract is not None)
-        except:
-            return False
+            for lane in lanes:
+                await lane.lock.acquire()
+                acquired.append(lane)
+            yield
+        finally:
+            for lane in acquired:
+                lane.lock.release()
+            for key, lane in zip(keys, lanes):
+                lane.depth -= 1
+                if lane.depth == 0:
+                    del self._lanes[key]
+            self.pending -= 1
+
+def valid_price(price):
+    """IB reports missing prices as nan, and sometimes as -1"""
+    return price is not None and price == price and price > 0
+
+def quote_price(ticker, source='mid'):
+    """Reference price from a ticker: the bid/ask midpoint or the last trade,
+    falling back to the other; None without a usable quote"""
+    if ticker is None:
+        return None
+    mid = (ticker.bid + ticker.ask) / 2 if valid_price(ticker.bid) and valid_price(ticker.ask) else None
+    last = ticker.last if valid_price(ticker.last) else None
+    return (mid or last) if source == 'mid' else (last or mid)
+
+class ParentOrder:
+    """One signal's order, worked as one or more IB child orders.
     
-    def _start_initialization(self):
-        """Start bot initialization in a separate thread"""
-        if self.is_initializing:
+    Collects the children's acknowledgements and fills for the webhook's
+    completion policy, and prices every execution against the reference
+    price (the signal's "price", else the quote when the order started).
+    """
+    
+    def __init__(self, contract, action, qty, mode, reference_price=None, opening=True):
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"Invalid order type: {mode}")
+        self.contract = contract
+        self.action = action
+        self.qty = qty
+        self.mode = mode
+        self.opening = opening  # An entry, as opposed to a close
+        self.reference_price = reference_price if valid_price(reference_price) else None
+        self.children = []  # Trades, in the order they were placed
+        self.reservation = None  # The PositionBook reservation it is worked against
+        self.reason = None  # Why the order stopped short, if it did
+        self.stop_reason = None
+        self.stopped = asyncio.Event()  # Set to stop working the order early
+        self.started = time.monotonic()
+        self.time_to_fill = None  # Seconds from start to the latest execution
+        self.acked = asyncio.Event()
+        self.first_fill = asyncio.Event()
+        self.done = asyncio.Event()
+    
+    @property
+    def filled(self):
+        return sum(trade.orderStatus.filled for trade in self.children)
+    
+    def avg_price(self):
+        executions = [fill.execution for trade in self.children for fill in trade.fills]
+        shares = sum(execution.shares for execution in executions)
+        if not shares:
+            return None
+        return sum(execution.shares * execution.price for execution in executions) / shares
+    
+    def slippage_bps(self, price):
+        """Cost of a fill price against the reference in basis points; positive is worse"""
+        if self.reference_price is None or price is None:
+            return None
+        sign = 1 if self.action == 'BUY' else -1
+        return round(sign * (price - self.reference_price) / self.reference_price * 10000, 2) + 0.0  # No -0.0
+    
+    def status(self):
+        """Status in the same terms as a single trade's"""
+        filled = self.filled
+        if filled >= self.qty:
+            return 'Filled'
+        if filled > 0:
+            return 'PartiallyFilled'
+        last = self.children[-1].orderStatus.status if self.children else 'PendingSubmit'
+        if self.done.is_set():
+            return last if last in OrderStatus.DoneStates or last == 'Inactive' else 'Cancelled'
+        if self.acked.is_set():
+            return last if last in ('PreSubmitted', 'Submitted') else 'Submitted'
+        return last
+    
+    def stop(self, reason):
+        """Stop working the order: no further children are sent"""
+        self.stop_reason = reason
+        self.stopped.set()
+    
+    def cancel_reason(self):
+        if self.reason:
+            return self.reason
+        trade = self.children[-1] if self.children else None
+        return trade.log[-1].message if trade and trade.log else "Unknown reason"
+    
+    def fill_summary(self):
+        """' @ price (slippage, time to fill)' for the webhook reply, or ''"""
+        price = self.avg_price()
+        if price is None:
+            return ''
+        details = []
+        slippage = self.slippage_bps(price)
+        if slippage is not None:
+            details.append(f"slippage {slippage:g} bps")
+        if self.time_to_fill is not None:
+            details.append(f"{self.time_to_fill:.2f}s to fill")
+        return f" @ {price:g}" + (f" ({', '.join(details)})" if details else '')
+
+class RiskRejected(Exception):
+    """An order refused by the pre-trade risk checks"""
+    
+    http_status = 403
+
+class RiskEngine:
+    """Pre-trade limits checked in constant time on the order path.
+    
+    Prices, realized P&L and order counts are kept current from fills, the
+    position stream and commission reports, so a check is a few lookups and
+    never waits on IB. Limits and halts stop new entries only: closing
+    orders always pass, so positions can still be flattened.
+    """
+    
+    WINDOW = 60  # Seconds the order rate is counted over
+    
+    def __init__(self, max_position=0, max_notional=0, max_orders_per_minute=0, max_daily_loss=0):
+        self.max_position = max_position
+        self.max_notional = max_notional
+        self.max_orders_per_minute = max_orders_per_minute
+        self.max_daily_loss = max_daily_loss
+        self._lock = threading.Lock()
+        self.halted = False
+        self.halted_symbols = set()
+        self._prices = {}  # conId -> last fill price or position cost
+        self._orders = defaultdict(lambda: deque(maxlen=max_orders_per_minute or 1))  # symbol -> order times
+        self._day = None
+        self._realized = 0.0  # Realized P&L since midnight
+    
+    def on_exec(self, trade, fill):
+        """execDetailsEvent handler: the latest price traded"""
+        self._prices[fill.contract.conId] = fill.execution.price
+    
+    def on_position(self, pos):
+        """positionEvent handler: a price for contracts not traded yet today"""
+        if pos.avgCost and pos.contract.conId not in self._prices:
+            self._prices[pos.contract.conId] = pos.avgCost
+    
+    def last_price(self, conId):
+        """Last fill price or position cost, None when unknown"""
+        return self._prices.get(conId)
+    
+    def on_commission(self, trade, fill, report):
+        """commissionReportEvent handler: realized P&L of closing fills"""
+        if report.realizedPNL and abs(report.realizedPNL) < 1e300:  # IB's unset value is DBL_MAX
+            with self._lock:
+                self._roll_day()
+                self._realized += report.realizedPNL
+    
+    def _roll_day(self):
+        today = datetime.now().date()
+        if today != self._day:
+            self._day = today
+            self._realized = 0.0
+    
+    def daily_pnl(self):
+        with self._lock:
+            self._roll_day()
+            return self._realized
+    
+    def is_halted(self, symbol):
+        return self.halted or symbol in self.halted_symbols
+    
+    def halt(self, halted, symbol=None):
+        """Stop (or resume) new entries everywhere, or for one symbol"""
+        with self._lock:
+            if symbol is None:
+                self.halted = halted
+            elif halted:
+                self.halted_symbols.add(symbol)
+            else:
+                self.halted_symbols.discard(symbol)
+    
+    def check_signal(self, symbol, direction):
+        """Checks that need no position: halts and the daily loss limit"""
+        if direction in ("close_long", "close_short"):
+            return
+        if self.is_halted(symbol):
+            raise RiskRejected(f"Trading halted{'' if self.halted else f' for {symbol}'}")
+        if self.max_daily_loss and self.daily_pnl() <= -self.max_daily_loss:
+            raise RiskRejected(f"Daily loss limit of {self.max_daily_loss:g} reached")
+    
+    def check_entry(self, symbol, conId, signed_qty, exposure, price=None):
+        """Full check of a new entry order; raises RiskRejected.
+        
+        exposure is the contract's filled position plus working orders.
+        Notional is priced from price, the market quote, else the last fill
+        or position cost; never from the signal, whose price the sender
+        controls. With a notional limit set, an entry in a contract with no
+        known price is refused.
+        """
+        self.check_signal(symbol, "long")
+        if self.max_position and abs(exposure + signed_qty) > self.max_position:
+            raise RiskRejected(f"Position limit: {symbol} would reach {exposure + signed_qty:g} "
+                               f"(max {self.max_position:g})")
+        price = price or self._prices.get(conId)
+        if self.max_notional and not price:
+            raise RiskRejected(f"Notional limit: no market price for {symbol} yet")
+        if self.max_notional and abs(signed_qty) * price > self.max_notional:
+            raise RiskRejected(f"Notional limit: {abs(signed_qty):g} {symbol} @ {price:g} "
+                               f"exceeds {self.max_notional:g}")
+        self.count_order(symbol, limit=True)
+    
+    def configure(self, max_position=0, max_notional=0, max_orders_per_minute=0, max_daily_loss=0):
+        """Swap the limits, keeping halts, P&L and the orders already counted"""
+        with self._lock:
+            if max_orders_per_minute != self.max_orders_per_minute:
+                orders = self._orders
+                self._orders = defaultdict(lambda: deque(maxlen=max_orders_per_minute or 1))
+                for symbol, times in orders.items():
+                    self._orders[symbol].extend(times)
+            self.max_position = max_position
+            self.max_notional = max_notional
+            self.max_orders_per_minute = max_orders_per_minute
+            self.max_daily_loss = max_daily_loss
+    
+    def count_order(self, symbol, limit=False):
+        """Count an order towards the symbol's rate; with limit, refuse one over it"""
+        if not self.max_orders_per_minute:
             return
+        now = time.monotonic()
+        with self._lock:
+            times = self._orders[symbol]
+            if limit and len(times) == times.maxlen and now - times[0] < self.WINDOW:
+                raise RiskRejected(f"Order rate limit: {self.max_orders_per_minute} orders per minute for {symbol}")
+            times.append(now)
+    
+    def status(self):
+        return {
+            "halted": self.halted,
+            "halted_symbols": sorted(self.halted_symbols),
+            "daily_pnl": self.daily_pnl(),
+            "limits": {"max_position": self.max_position, "max_notional": self.max_notional,
+                       "max_orders_per_minute": self.max_orders_per_minute,
+                       "max_daily_loss": self.max_daily_loss},
+        }
+
+# Global risk engine, shared by every IB connection
+risk_engine = RiskEngine(risk_max_position, risk_max_notional, risk_max_orders_per_minute, risk_max_daily_loss)
+metrics.gauge('tradingbot_trading_halted', 'Whether new entries are halted everywhere', lambda: risk_engine.halted)
+metrics.gauge('tradingbot_halted_symbols', 'Symbols with new entries halted', lambda: len(risk_engine.halted_symbols))
+metrics.gauge('tradingbot_daily_realized_pnl', 'Realized P&L since midnight', risk_engine.daily_pnl)
+
+class TradeJournal:
+    """Trade history: a fixed-size in-memory ring plus an append-only journal.
+    
+    Records are appended to a deque(maxlen) and handed to a background
+    writer thread, which writes them in batches to JSONL segments under
+    JOURNAL_DIR, so disk I/O never runs on the order path. Segments roll
+    over at JOURNAL_SEGMENT_BYTES and only the newest JOURNAL_MAX_SEGMENTS
+    are kept. page() serves recent trades from memory and older ones by
+    reading segments backwards, never loading a whole file.
+    """
+    
+    def __init__(self, directory, memory_size=1000, segment_bytes=16 * 1024 * 1024,
+                 max_segments=20, flush_interval=0.5):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.flush_interval = flush_interval
+        self._recent = deque(maxlen=memory_size)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._queue = None
+        self._writer = None
+        
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            # Resume numbering and the in-memory view from the journal on disk
+            history = list(itertools.islice(self._iter_disk(), memory_size))
+            if history:
+                self._seq = history[0]['seq']
+            self._recent.extend(reversed(history))
             
-        self.is_initializing = True
-        self.last_init_attempt = time.time()
+            self._queue = queue.Queue()
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+    
+    def record(self, message, **fields):
+        """Append a trade record; returns it"""
+        with self._lock:
+            self._seq += 1
+            entry = {'seq': self._seq, 'time': datetime.now(timezone.utc).isoformat(), 'message': message}
+            entry.update(fields)
+            self._recent.append(entry)
+        if self._queue is not None:
+            self._queue.put(entry)
+        return entry
+    
+    def page(self, before=None, limit=50):
+        """Up to limit records with seq < before, newest first"""
+        results = []
+        with self._lock:
+            recent = list(self._recent)
+        for entry in reversed(recent):
+            if before is None or entry['seq'] < before:
+                results.append(entry)
+                if len(results) >= limit:
+                    return results
         
-        def init_worker():
-            try:
-                logger.info("Starting bot initialization...")
-                new_bot = TradingBotAsync(ib_host, ib_port, client_id, order_size)
-                logger.info("Bot connected to IB successfully")
-                
-                # Try to set contract
-                logger.info(f"Setting contract for {instructment} on {exchange}...")
-                new_bot.set_contract(exchange, "STK", instructment)
-                
-                if new_bot.contract:
-                    logger.info(f"✓ Bot initialized successfully with contract: {new_bot.contract}")
-                    logger.info(f"✓ Order size set to: {order_size} shares")
-                    self.bot = new_bot
-                else:
-                    logger.warning("✗ Warning: Contract not set properly")
-                    
-            except Exception as e:
-                logger.error(f"✗ Error initializing bot: {str(e)}")
-                logger.info("Will retry initialization in 30 seconds...")
-            finally:
-                self.is_initializing = False
+        # Older than the in-memory window: continue from disk
+        cutoff = before if before is not None else float('inf')
+        if recent:
+            cutoff = min(cutoff, recent[0]['seq'])
+        if cutoff <= 1:
+            return results
+        for entry in self._iter_disk():
+            if entry['seq'] < cutoff:
+                results.append(entry)
+                if len(results) >= limit:
+                    break
+        return results
+    
+    def _segments(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.startswith('trades-') and name.endswith('.jsonl'))
+    
+    def _iter_disk(self):
+        """Journal records newest first, reading each segment backwards"""
+        for name in reversed(self._segments()):
+            for line in self._iter_lines_reverse(os.path.join(self.directory, name)):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # Torn last line after a crash
+    
+    @staticmethod
+    def _iter_lines_reverse(path, block_size=65536):
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            tail = b''
+            while position > 0:
+                size = min(block_size, position)
+                position -= size
+                f.seek(position)
+                lines = (f.read(size) + tail).split(b'\n')
+                tail = lines.pop(0)
+                for line in reversed(lines):
+                    if line.strip():
+                        yield line
+            if tail.strip():
+                yield tail
+    
+    def _open_segment(self, first_seq):
+        path = os.path.join(self.directory, f"trades-{first_seq:012d}.jsonl")
+        segments = self._segments()
+        for name in segments[:max(0, len(segments) + 1 - self.max_segments)]:
+            os.remove(os.path.join(self.directory, name))
+        return open(path, 'a', encoding='utf-8')
+    
+    def _write_loop(self):
+        segments = self._segments()
+        f = None
+        if segments:
+            f = open(os.path.join(self.directory, segments[-1]), 'a', encoding='utf-8')
         
-        self.initialization_thread = threading.Thread(target=init_worker, daemon=True)
-        self.initialization_thread.start()
+        while True:
+            batch = [self._queue.get()]
+            # Collect whatever else arrives within the flush interval
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            stop = None in batch
+            entries = [entry for entry in batch if entry is not None]
+            try:
+                for entry in entries:
+                    if f is None or f.tell() >= self.segment_bytes:
+                        if f is not None:
+                            f.close()
+                        f = self._open_segment(entry['seq'])
+                    f.write(json.dumps(entry, default=str) + '\n')
+                if f is not None:
+                    f.flush()
+            except OSError as e:
+                logger.error(f"Trade journal write failed: {e}")
+            
+            if stop:
+                if f is not None:
+                    f.close()
+                return
+    
+    def close(self, timeout=5):
+        """Flush pending records and stop the writer"""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout)
 
-# Global bot manager
-bot_manager = BotManager()
+trade_journal = TradeJournal(journal_dir, journal_memory_size, journal_segment_bytes,
+                             journal_max_segments, journal_flush_interval)
+atexit.register(trade_journal.close)
 
 class TradingBotAsync:
-    def __init__(self, host, port, clientId, order_size=500):
+    def __init__(self, host, port, clientId, order_size=500, ib=None, loop=None,
+                 contract_spec=None, warmup=None, journal=None, account=None, on_change=None):
         self.host = host
         self.port = port
         self.clientId = clientId
+        self.account = account  # Orders go to this account when set
         self.order_size = order_size
-        self.ib = IB()
+        self.ib = ib or IB()
         self.contract = None
-        self.L_log = []
+        self.contract_spec = contract_spec  # (exchange, secType, symbol) qualified on connect
+        self.warmup = warmup or []
+        self.journal = journal or trade_journal
+        self.positions = PositionBook(account)
+        self.contracts = ContractRegistry(contract_cache_size, contract_cache_ttl)
+        self.quotes = QuoteCache(self.ib, quote_cache_size)
+        self.lanes = OrderLanes(lane_max_depth, max_pending_signals)
         
-        # Queue for communication between threads
-        self.command_queue = queue.Queue()
-        self.result_queue = queue.Queue()
+        # Event loop the IB connection lives on; commands are handed to it
+        # with run_coroutine_threadsafe and each caller waits on its own
+        # future. Without a loop we own one in a dedicated thread, with one
+        # (ASGI mode) we share the server's loop.
+        self.owns_loop = loop is None
+        self.loop = asyncio.new_event_loop() if self.owns_loop else loop
         
-        # Start the async thread
-        self.async_thread = threading.Thread(target=self._run_async_loop, daemon=True)
-        self.async_thread.start()
+        # Futures of commands still running on the IB loop, by request ID
+        self.pending_requests = {}
+        # Parent orders still being worked (limit fallbacks, slicing), by task
+        self.executions = {}
         
-        # Wait for connection
-        time.sleep(2)
+        # Connection state maintained by the supervisor
+        self.ready = threading.Event()
+        self.connection_error = None
+        self.reconnect_count = 0
+        self.time_to_ready = None  # Seconds from start/disconnect to ready
+        self._down_since = time.monotonic()
+        self._stopping = False
+        self._disconnected = None
+        self.latency = None  # Last health ping round trip, seconds
+        self.last_ping = None
+        self.on_change = on_change  # Called on connection and position changes
+        
+        # Keep the position book current across reconnects
+        self.ib.positionEvent += self.positions.on_position
+        self.ib.positionEvent += self._state_changed
+        self.ib.execDetailsEvent += self.positions.on_exec
+        self.ib.disconnectedEvent += self._on_disconnected
+        
+        # Feed the risk engine's prices and realized P&L
+        self.ib.execDetailsEvent += risk_engine.on_exec
+        self.ib.positionEvent += risk_engine.on_position
+        self.ib.commissionReportEvent += risk_engine.on_commission
+        
+        if self.owns_loop:
+            # Start the async thread
+            self.async_thread = threading.Thread(target=self._run_async_loop, daemon=True)
+            self.async_thread.start()
+        else:
+            self.async_thread = None
+            asyncio.run_coroutine_threadsafe(self._supervise(), self.loop)
+        
+    def is_ready(self):
+        """Connected to IB with the default contract qualified"""
+        return self.ready.is_set()
         
     def _run_async_loop(self):
         """Run the asyncio event loop in a separate thread"""
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        asyncio.set_event_loop(self.loop)
+        self.loop.create_task(self._supervise())
+        
+        # Serve commands until stop() is called; the loop sleeps in select()
+        # between commands instead of polling
+        self.loop.run_forever()
+        
+        # Unwind the supervisor and any commands still running before closing
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
         
-        async def async_main():
+    async def _async_connect(self):
+        """Connect to IB and load the position book"""
+        await self.ib.connectAsync(self.host, self.port, self.clientId)
+        logger.info(f"Connected to IB at {self.host}:{self.port}")
+        
+        # Rebuild the position book from IB; events keep it current after this
+        self.positions.load(self.ib.positions())
+        self._reattach_orders()
+    
+    def _reattach_orders(self):
+        """Carry working parent orders over a reconnect.
+        
+        ib_insync replaces its Trade objects on connect, so the children the
+        parents wait on would never hear from IB again. Each working child
+        is pointed at the Trade IB reports now for its permId or orderId,
+        fills made while disconnected included, or marked Cancelled when IB
+        no longer knows it. Each parent's reservation is then cut to what is
+        still unfilled, since the position snapshot already has those fills.
+        """
+        current = {}
+        for trade in self.ib.trades():
+            if trade.order.permId:
+                current['perm', trade.order.permId] = trade
+            if trade.order.orderId:
+                current['order', trade.order.clientId, trade.order.orderId] = trade
+        
+        for parent in list(self.executions.values()):
+            for child in parent.children:
+                if child.isDone():
+                    continue
+                permId = child.orderStatus.permId or child.order.permId
+                trade = (current.get(('perm', permId)) if permId else None) or \
+                    current.get(('order', child.order.clientId, child.order.orderId))
+                if trade is child:
+                    continue
+                if trade is None:
+                    child.orderStatus.status = 'Cancelled'
+                    child.log.append(TradeLogEntry(datetime.now(timezone.utc), 'Cancelled',
+                                                   'Order not found at IB after reconnecting'))
+                    logger.warning(f"Order {child.order.orderId} for {parent.contract.symbol} is gone after reconnecting")
+                else:
+                    self._mirror_trade(parent, child, trade)
+                child.statusEvent.emit(child)
+            if parent.reservation is not None:
+                unfilled = max(0, parent.qty - parent.filled)
+                self.positions.reconcile(parent.reservation, unfilled if parent.action == 'BUY' else -unfilled)
+    
+    def _mirror_trade(self, parent, child, trade):
+        """Point a stale child Trade at its replacement and forward its events"""
+        status = trade.orderStatus
+        filled = sum(fill.execution.shares for fill in trade.fills)
+        if filled > status.filled:  # Completed orders are reported without fill counts
+            status.filled = filled
+            status.remaining = max(0, trade.order.totalQuantity - filled)
+        seen = {fill.execution.execId for fill in child.fills}
+        missed = [fill for fill in trade.fills if fill.execution.execId not in seen]
+        child.orderStatus, child.fills, child.log = status, trade.fills, trade.log
+        for fill in missed:
+            self._on_child_fill(parent, child, fill)
+        trade.statusEvent += lambda trade: child.statusEvent.emit(child)
+        trade.fillEvent += lambda trade, fill: child.fillEvent.emit(child, fill)
+        logger.info(f"Order {child.order.orderId} for {parent.contract.symbol} reattached: {status.status}, "
+                    f"{status.filled:g} filled")
+        
+    async def _supervise(self):
+        """Keep the bot connected: connect, qualify, reconnect with backoff.
+        
+        Readiness is set the moment IB is connected and the default contract
+        is qualified, and cleared as soon as IB reports a disconnect.
+        """
+        self._disconnected = asyncio.Event()
+        delay = reconnect_backoff_initial
+        
+        while not self._stopping:
             try:
-                # Connect to IB
-                await self.ib.connectAsync(self.host, self.port, self.clientId)
-                print(f"Connected to IB at {self.host}:{self.port}")
-                
-                # Process commands from the queue
-                while True:
-                    try:
-                        # Check for commands with timeout
-                        try:
-                            command = self.command_queue.get(timeout=0.1)
-                        except queue.Empty:
-                            await asyncio.sleep(0.1)
-                            continue
-                            
-                        if command['action'] == 'set_contract':
-                            await self._async_set_contract(command['exchange'], command['secType'], command['symbol'])
-                        elif command['action'] == 'test_permissions':
-                            result = await self._async_test_permissions()
-                            self.result_queue.put(result)
-                        elif command['action'] == 'check_position':
-                            result = await self._async_check_position(command['direction'], command['contract'])
-                            self.result_queue.put(result)
-                        elif command['action'] == 'submit_order':
-                            result = await self._async_submit_order(command['contract'], command['direction'], command['qty'])
-                            self.result_queue.put(result)
-                        elif command['action'] == 'close_position':
-                            result = await self._async_close_position(command['contract'], command['direction'])
-                            self.result_queue.put(result)
-                        elif command['action'] == 'stop':
-                            break
-                            
-                    except Exception as e:
-                        print(f"Error in async loop: {e}")
-                        self.result_queue.put({'error': str(e)})
-                        
+                if not self.ib.isConnected():
+                    await self._async_connect()
+                    self._disconnected.clear()
+                if self.contract is None and self.contract_spec:
+                    await self._async_set_contract(*self.contract_spec)
+                    logger.info(f"✓ Bot initialized successfully with contract: {self.contract}")
+                    logger.info(f"✓ Order size set to: {self.order_size} shares")
             except Exception as e:
-                print(f"Failed to connect to IB: {e}")
-                self.result_queue.put({'error': f'Connection failed: {e}'})
+                self.connection_error = str(e)
+                self._state_changed()
+                if not self.ib.isConnected():
+                    # Reset a half-open connection before the next attempt
+                    self.ib.disconnect()
+                wait = random.uniform(0, delay)  # Full jitter
+                logger.warning(f"✗ Bot not ready: {e}. Retrying in {wait:.1f}s")
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, retry_interval)
+                continue
+            
+            if not self.ib.isConnected():
+                continue  # Dropped again while qualifying
+            
+            delay = reconnect_backoff_initial
+            self.connection_error = None
+            self.time_to_ready = time.monotonic() - self._down_since
+            self.ready.set()
+            self._state_changed()
+            logger.info(f"✓ Bot ready in {self.time_to_ready:.3f}s")
+            
+            # Stream quotes again after a reconnect, and always for the configured contract
+            self.quotes.resubscribe()
+            self.quotes.track(self.contract, pin=True)
+            
+            if self.warmup:
+                self.loop.create_task(self._async_warm_up(self.warmup))
+            
+            # Sleep until IB drops the connection, pinging it meanwhile
+            while not self._disconnected.is_set():
+                if health_ping_interval <= 0:
+                    await self._disconnected.wait()
+                    break
+                try:
+                    await asyncio.wait_for(self._disconnected.wait(), health_ping_interval)
+                except asyncio.TimeoutError:
+                    await self._async_ping()
+            self._disconnected.clear()
+    
+    async def _async_ping(self):
+        """Time a reqCurrentTime round trip for the health snapshot"""
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.ib.reqCurrentTimeAsync(), health_ping_timeout)
+            self.latency = time.perf_counter() - started
+        except Exception as e:
+            self.latency = None
+            logger.warning(f"IB ping failed: {e!r}")
+        self.last_ping = time.time()
+        self._state_changed()
+    
+    def _state_changed(self, *args):
+        """Tell the owner (the health snapshot) that connection or positions changed"""
+        if self.on_change is not None:
+            self.on_change()
+    
+    def _on_disconnected(self):
+        """disconnectedEvent handler: stop taking signals and wake the supervisor"""
+        if self.ready.is_set():
+            logger.warning("✗ Disconnected from IB, reconnecting...")
+            self.reconnect_count += 1
+            self._down_since = time.monotonic()
+        self.ready.clear()
+        self.latency = None
+        self._state_changed()
+        if self._disconnected is not None:
+            self._disconnected.set()
         
-        loop.run_until_complete(async_main())
+    async def _execute(self, command):
+        """Run a single command on the IB event loop"""
+        if not self.ib.isConnected():
+            return {'error': f"IB not connected: {self.connection_error or 'connecting'}",
+                    'request_id': command['request_id']}
+        
+        started = time.perf_counter()
+        order_ref.set(command.get('order_ref') or command['request_id'])
+        if 'dispatched_at' in command:
+            metrics.observe('tradingbot_stage_seconds', started - command['dispatched_at'], stage='handoff')
+        
+        # Every command runs as its own task, so a slow order never holds up
+        # an unrelated position check
+        try:
+            if command['action'] == 'set_contract':
+                result = await self._async_set_contract(command['exchange'], command['secType'], command['symbol'])
+            elif command['action'] == 'resolve_contract':
+                result = await self._async_resolve_contract(command['symbol'], command['exchange'], command['currency'],
+                                                            command.get('exchange_hint'))
+            elif command['action'] == 'warm_up':
+                result = await self._async_warm_up(command['symbols'])
+            elif command['action'] == 'handle_signal':
+                result = await self._async_handle_signal(command['message'])
+            elif command['action'] == 'handle_batch':
+                result = await self._async_handle_batch(command['messages'])
+            elif command['action'] == 'run_queued':
+                result = await self._async_run_queued(command['message'], command['legs'], command['replay'])
+            elif command['action'] == 'test_permissions':
+                result = await self._async_test_permissions()
+            else:
+                result = {'error': f"Unknown command: {command['action']}"}
+        except Exception as e:
+            logger.error(f"[{command['request_id']}] Error in async loop: {e}")
+            result = {'error': str(e)}
+        metrics.observe('tradingbot_command_seconds', time.perf_counter() - started, action=command['action'])
+        
+        if isinstance(result, dict):
+            result['request_id'] = command['request_id']
+        return result
+    
+    def _dispatch(self, command, request_id=None):
+        """Hand a command to the IB event loop and return its future"""
+        if self.loop.is_closed():
+            raise RuntimeError('IB event loop is not running')
+        
+        command['request_id'] = request_id or new_request_id()
+        command['dispatched_at'] = time.perf_counter()
+        future = asyncio.run_coroutine_threadsafe(self._execute(command), self.loop)
+        future.action = command['action']
+        self.pending_requests[command['request_id']] = future
+        future.add_done_callback(lambda _: self.pending_requests.pop(command['request_id'], None))
+        return future
+    
+    async def run_command(self, command, request_id=None):
+        """Await a command from async code, e.g. an ASGI handler.
+        
+        On the bot's own loop the command runs directly, with no thread
+        handoff; from any other loop it is dispatched and awaited.
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            command['request_id'] = request_id or new_request_id()
+            return await self._execute(command)
+        return await asyncio.wrap_future(self._dispatch(command, request_id))
+    
+    def _wait(self, future, timeout):
+        """Wait for a command's own result; cancel it if the caller gives up"""
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            metrics.inc('tradingbot_timeouts_total', action=getattr(future, 'action', 'unknown'))
+            raise
+    
+    def stop(self):
+        """Disconnect from IB and stop the event loop"""
+        self._stopping = True
+        self.ready.clear()
+        self._state_changed()
+        
+        def _shutdown():
+            for task in list(self.executions):
+                task.cancel()
+            self.ib.disconnect()
+            if self.owns_loop:
+                self.loop.stop()
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(_shutdown)
         
     async def _async_set_contract(self, exchange, secType, symbol):
         """Set contract in async context"""
+        self.contract = await self._async_resolve_contract(symbol, exchange_hint=exchange)
+        
+        # Signals that name the default symbol without exchange/currency
+        # resolve to the same contract
+        self.contracts.put(ContractRegistry.key(symbol), self.contract)
+        
+    def _contract_candidates(self, symbol, exchange=None, currency=None, exchange_hint=None):
+        """Contracts to try, in priority order, for a symbol"""
         # Determine if this is a US stock or HK stock based on symbol
-        is_hk_stock = (symbol.isdigit() or 
-                      symbol.startswith('0') or 
-                      symbol.endswith('.HK') or
-                      exchange in ['SEHK', 'HKEX'])
+        is_hk_stock = (currency == 'HKD' or
+                      (currency is None and
+                       (symbol.isdigit() or 
+                        symbol.startswith('0') or 
+                        symbol.endswith('.HK') or
+                        (exchange or exchange_hint) in ['SEHK', 'HKEX'])))
         
         if is_hk_stock:
             # Hong Kong stock contracts
@@ -185,131 +1787,642 @@ class TradingBotAsync:
                 Stock(symbol, 'SMART', 'HKD'),
                 Stock(f"{symbol}.HK", 'SMART', 'HKD'),
             ]
-            logger.info(f"Detected Hong Kong stock: {symbol}")
+            logger.debug(f"Detected Hong Kong stock: {symbol}")
         else:
             # US stock contracts
             contracts_to_try = [
-                Stock(symbol, 'SMART', 'USD'),
-                Stock(symbol, 'NASDAQ', 'USD'),
-                Stock(symbol, 'NYSE', 'USD'),
+                Stock(symbol, 'SMART', currency or 'USD'),
+                Stock(symbol, 'NASDAQ', currency or 'USD'),
+                Stock(symbol, 'NYSE', currency or 'USD'),
             ]
-            logger.info(f"Detected US stock: {symbol}")
+            logger.debug(f"Detected US stock: {symbol}")
+        
+        # An explicitly requested exchange is tried first
+        if exchange:
+            explicit = Stock(symbol, exchange, contracts_to_try[0].currency)
+            contracts_to_try = [explicit] + [c for c in contracts_to_try if c.exchange != exchange]
+        return contracts_to_try
+        
+    async def _async_resolve_contract(self, symbol, exchange=None, currency=None, exchange_hint=None):
+        """Qualified contract for a symbol, served from the registry when cached"""
+        contract = self.contracts.get(ContractRegistry.key(symbol, exchange, currency))
+        if contract is not None:
+            return contract
+        
+        resolved = await self._async_qualify_batch([(symbol, exchange, currency)], exchange_hint)
+        if resolved[0] is None:
+            raise Exception(f"Could not qualify contract for symbol {symbol}. Check market data permissions and symbol format.")
+        return resolved[0]
+        
+    async def _async_qualify_batch(self, specs, exchange_hint=None):
+        """Qualify (symbol, exchange, currency) specs in one batched request.
+        
+        All fallback candidates of all specs go out together, so the batch
+        costs one IB round trip instead of one per candidate. Each spec
+        takes its first candidate that qualified, in priority order, and is
+        added to the registry. Returns contracts (or None) in spec order.
+        """
+        candidates = [self._contract_candidates(symbol, exchange, currency, exchange_hint)
+                      for symbol, exchange, currency in specs]
+        flat = [contract for group in candidates for contract in group]
+        
+        try:
+            qualified = await self.ib.qualifyContractsAsync(*flat)
+        except Exception as e:
+            logger.warning(f"✗ Contract qualification failed for {len(specs)} symbols: {e}")
+            return [None] * len(specs)
+        qualified_ids = {id(contract) for contract in qualified}
+        
+        results = []
+        for spec, group in zip(specs, candidates):
+            contract = next((c for c in group if id(c) in qualified_ids), None)
+            if contract is not None:
+                logger.debug(f"Contract qualified: {contract}")
+                self.contracts.put(ContractRegistry.key(*spec), contract)
+            results.append(contract)
+        return results
+        
+    async def _async_warm_up(self, symbols):
+        """Qualify a list of symbols ahead of the first signal for each"""
+        pending = [spec for spec in symbols if self.contracts.get(ContractRegistry.key(*spec)) is None]
+        resolved = len(symbols) - len(pending)
+        for start in range(0, len(pending), qualify_batch_size):
+            batch = pending[start:start + qualify_batch_size]
+            results = await self._async_qualify_batch(batch)
+            for spec, contract in zip(batch, results):
+                if contract is None:
+                    logger.warning(f"Warm-up failed for {spec[0]}")
+            resolved += sum(contract is not None for contract in results)
+        logger.info(f"✓ Contract registry warmed up: {resolved}/{len(symbols)} symbols")
+        return {'success': f'{resolved} of {len(symbols)} symbols qualified'}
+        
+    def _lane_key(self, message):
+        """Order lane for a signal: its symbol, or the configured instrument's"""
+        symbol = message.get("symbol")
+        return str(symbol).upper() if symbol else self.contract.symbol
+    
+    async def _async_handle_signal(self, message):
+        """Run a signal in its symbol's lane, after earlier signals for that symbol"""
+        try:
+            async with self.lanes.hold([self._lane_key(message)]):
+                return await self._async_process_signal(message)
+        except Backpressure as e:
+            metrics.inc('tradingbot_rejects_total', reason='backpressure')
+            return {'error': str(e), 'http_status': e.http_status}
+    
+    async def _async_process_signal(self, message):
+        """Route a validated webhook signal to a close or an entry order"""
+        direction = message["direction"]
+        completion = message.get("completion")
+        order_type = message.get("order_type")
+        price = message.get("price")
+        
+        # Route to the requested instrument, or the configured one
+        symbol = message.get("symbol")
+        if symbol:
+            try:
+                with metrics.timer('tradingbot_stage_seconds', stage='contract'):
+                    contract = await self._async_resolve_contract(str(symbol), message.get("exchange"), message.get("currency"))
+            except Exception as e:
+                return {'error': f"Unknown symbol '{symbol}': {e}"}
+        else:
+            contract = self.contract
+        self.quotes.track(contract)
+        
+        # Handle close positions
+        if direction in ["close_long", "close_short"]:
+            return await self._async_close_position(contract, direction, completion,
+                                                    order_type=order_type, price=price)
+        
+        # Handle open positions
+        # Check for an existing position or a working order and claim the
+        # new order in one step, so duplicate alerts cannot both pass
+        qty = message.get("qty") or self.order_size
+        market_price = await self._async_risk_price(contract)
+        try:
+            with metrics.timer('tradingbot_stage_seconds', stage='position_check'):
+                signed_qty = qty if direction == "long" else -qty
+                reservation = self.positions.reserve(contract.conId, signed_qty, self._position_threshold(contract),
+                                                     self._risk_check(contract, market_price))
+        except RiskRejected as e:
+            return self._risk_rejected(contract, e)
+        if reservation is None:
+            return {'skipped': f"{direction} position already exists, skipping order"}
+        
+        # No existing position, place new order with the signal's or the configured size
+        return await self._async_submit_order(contract, direction, qty, completion, reservation, order_type, price)
+        
+    async def _async_handle_batch(self, messages, sent=()):
+        """Run a batch once the lanes of all its symbols are free"""
+        try:
+            async with self.lanes.hold([self._lane_key(message) for message in messages]):
+                return await self._async_process_batch(messages, sent)
+        except Backpressure as e:
+            metrics.inc('tradingbot_rejects_total', reason='backpressure')
+            return {'error': str(e), 'http_status': e.http_status}
+    
+    async def _async_process_batch(self, messages, sent=()):
+        """Handle the legs of a batch signal together.
+        
+        Uncached symbols are qualified in one request, every leg reserves
+        its position in a single pass over the book, and all orders are
+        placed before any of them is awaited, so the batch takes about as
+        long as its slowest leg. Legs listed in sent already have orders at
+        IB and are skipped. Returns one result dict per leg.
+        """
+        results = [None] * len(messages)
+        contracts = [self.contract] * len(messages)
+        for i in sent:
+            results[i] = {'skipped': self.ALREADY_SENT}
+        
+        # Route each leg to its instrument, qualifying new symbols together
+        specs = {i: (str(message["symbol"]), message.get("exchange"), message.get("currency"))
+                 for i, message in enumerate(messages) if message.get("symbol") and results[i] is None}
+        with metrics.timer('tradingbot_stage_seconds', stage='contract'):
+            missing = list(dict.fromkeys(spec for spec in specs.values()
+                                         if self.contracts.get(ContractRegistry.key(*spec)) is None))
+            qualified = dict(zip(missing, await self._async_qualify_batch(missing))) if missing else {}
+        for i, spec in specs.items():
+            contracts[i] = self.contracts.get(ContractRegistry.key(*spec)) or qualified.get(spec)
+            if contracts[i] is None:
+                results[i] = {'error': f"Unknown symbol '{spec[0]}': could not qualify contract"}
+        for i in range(len(messages)):
+            if results[i] is None:
+                self.quotes.track(contracts[i])
+        
+        # Closes first stop the entries still working on their contracts
+        closes = [i for i in range(len(messages))
+                  if results[i] is None and messages[i]["direction"] in ("close_long", "close_short")]
+        for i, stopped in zip(closes, await asyncio.gather(*(self._async_stop_entries(contracts[i])
+                                                               for i in closes))):
+            if not stopped:
+                results[i] = {'error': self._entries_not_stopped(contracts[i])}
+        
+        # Check and claim positions, risk limits included, for every leg at once
+        legs = [i for i in range(len(messages)) if results[i] is None]
+        entries = [i for i in legs if messages[i]["direction"] in ("long", "short")]
+        prices = dict(zip(entries, await asyncio.gather(*(self._async_risk_price(contracts[i]) for i in entries))))
+        with metrics.timer('tradingbot_stage_seconds', stage='position_check'):
+            reserved = self.positions.reserve_batch([
+                (contracts[i].conId, messages[i]["direction"], messages[i].get("qty") or self.order_size,
+                 self._position_threshold(contracts[i]), self._risk_check(contracts[i], prices.get(i)))
+                for i in legs])
         
-        for i, contract in enumerate(contracts_to_try):
+        orders = []
+        for i, (reservation, signed_qty, error) in zip(legs, reserved):
+            direction = messages[i]["direction"]
+            completion = messages[i].get("completion")
+            order_type = messages[i].get("order_type")
+            price = messages[i].get("price")
+            if isinstance(error, RiskRejected):
+                results[i] = self._risk_rejected(contracts[i], error)
+            elif error is not None:
+                results[i] = {'error': f"Position check failed: {error}"}
+            elif direction in ["close_long", "close_short"]:
+                if reservation is None:
+                    results[i] = {'error': self._nothing_to_close(direction, signed_qty)}
+                else:
+                    orders.append((i, self._async_close_position(contracts[i], direction, completion,
+                                                                 reservation, signed_qty, order_type, price)))
+            elif reservation is None:
+                results[i] = {'skipped': f"{direction} position already exists, skipping order"}
+            else:
+                orders.append((i, self._async_submit_order(contracts[i], direction, abs(signed_qty),
+                                                           completion, reservation, order_type, price)))
+        
+        # Every order is placed as soon as its task starts; the completion
+        # waits then run side by side. Each leg tags its orders with its own ref
+        ref = order_ref.get()
+        for (i, _), result in zip(orders, await asyncio.gather(*(with_order_ref(f"{ref}/{i}", order)
+                                                                  for i, order in orders))):
+            results[i] = result
+        return results
+    
+    ALREADY_SENT = "Orders were already sent to IB before the restart"
+    
+    def _sent_to_ib(self, ref):
+        """Whether IB has an order tagged ref: working, finished or filled today"""
+        return (any(trade.order.orderRef == ref for trade in self.ib.trades())
+                or any(fill.execution.orderRef == ref for fill in self.ib.fills()))
+    
+    async def _async_run_queued(self, message, legs=None, replay=False):
+        """Run a signal queue entry: a single signal, or a batch's legs.
+        
+        A replayed entry may have reached IB before the restart, so its
+        orders are looked up by orderRef first and not sent again; the
+        position book keeps the rest from opening a position twice.
+        """
+        ref = order_ref.get()
+        if legs is None:
+            if replay and self._sent_to_ib(ref):
+                metrics.inc('tradingbot_signal_queue_reconciled_total')
+                return {'skipped': self.ALREADY_SENT}
+            return await self._async_handle_signal(message)
+        
+        sent = [i for i in range(len(legs)) if self._sent_to_ib(f"{ref}/{i}")] if replay else []
+        if sent:
+            metrics.inc('tradingbot_signal_queue_reconciled_total', len(sent))
+        return await self._async_handle_batch(legs, sent)
+    
+    async def _async_test_permissions(self):
+        """Test market data permissions: a quote for the configured contract"""
+        try:
+            with self.quotes.hold(self.contract) as ticker:
+                await self._async_quote(ticker)
+            price = quote_price(ticker)
+            if price is None:
+                return {'error': f'No market data for {self.contract.symbol} within {quote_timeout:g}s'}
+            return {'success': f'Market data permissions OK for {self.contract.symbol}: {price:g}'}
+        except Exception as e:
+            return {'error': f'Market data permission test failed: {e}'}
+            
+    def _new_order(self, order):
+        """Apply the settings every order shares"""
+        order.tif = 'GTC'  # Good Till Cancelled instead of DAY
+        order.outsideRth = True  # Allow outside regular trading hours
+        if self.account:
+            order.account = self.account
+        order.orderRef = order_ref.get()
+        return order
+    
+    def _place_child(self, parent, order, reservation):
+        """Place one of a parent order's IB orders and follow its events"""
+        with metrics.timer('tradingbot_stage_seconds', stage='place_order'):
+            trade = self.ib.placeOrder(parent.contract, self._new_order(order))
+        parent.children.append(trade)
+        # The parent releases the reservation once it has finished, not
+        # when this child does
+        self.positions.track(reservation, trade, release=False)
+        
+        def on_status(trade):
+            if trade.orderStatus.status in ('PreSubmitted', 'Submitted') or trade.fills:
+                parent.acked.set()
+        
+        trade.statusEvent += on_status
+        trade.fillEvent += lambda trade, fill: self._on_child_fill(parent, trade, fill)
+        on_status(trade)
+        return trade
+    
+    def _on_child_fill(self, parent, trade, fill):
+        """Report slippage and time to fill for every execution"""
+        execution = fill.execution
+        parent.time_to_fill = time.monotonic() - parent.started
+        parent.first_fill.set()
+        slippage = parent.slippage_bps(execution.price)
+        metrics.observe('tradingbot_time_to_fill_seconds', parent.time_to_fill, mode=parent.mode)
+        self.journal.record(f"Execution: {parent.action} {execution.shares} {parent.contract.symbol} @ {execution.price}",
+                            kind='fill', symbol=parent.contract.symbol, conId=parent.contract.conId,
+                            action=parent.action, qty=execution.shares, price=execution.price,
+                            reference_price=parent.reference_price, slippage_bps=slippage,
+                            time_to_fill=round(parent.time_to_fill, 3), mode=parent.mode,
+                            orderId=trade.order.orderId, execId=execution.execId, account=self.account)
+    
+    @staticmethod
+    async def _async_wait_done(trade, timeout=None):
+        """Wait until a trade is done or Inactive; False if the timeout passed first"""
+        done = asyncio.Event()
+        
+        def on_status(*args):
+            if trade.isDone() or trade.orderStatus.status == 'Inactive':
+                done.set()
+        
+        on_status()
+        if not done.is_set():
+            trade.statusEvent += on_status
             try:
-                logger.info(f"Trying contract {i+1}: {contract.symbol} on {contract.exchange} ({contract.currency})")
-                qualified_contracts = await self.ib.qualifyContractsAsync(contract)
-                if qualified_contracts:
-                    self.contract = qualified_contracts[0]
-                    logger.info(f"✓ Contract qualified successfully: {self.contract}")
+                await asyncio.wait_for(done.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                trade.statusEvent -= on_status
+        return True
+    
+    async def _async_quote(self, ticker):
+        """Wait until a streaming ticker has a usable price; at once for a
+        contract already in the quote cache"""
+        quoted = asyncio.Event()
+        
+        def on_update(*args):
+            if quote_price(ticker) is not None:
+                quoted.set()
+        
+        on_update()
+        if not quoted.is_set():
+            ticker.updateEvent += on_update
+            try:
+                await asyncio.wait_for(quoted.wait(), quote_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"No quote for {ticker.contract.symbol} within {quote_timeout}s")
+            finally:
+                ticker.updateEvent -= on_update
+        return ticker
+    
+    @staticmethod
+    def _limit_price(ticker, action):
+        """Limit price at the quote, rounded onto the tick grid away from crossing"""
+        price = quote_price(ticker, limit_price_source)
+        if price is None:
+            return None
+        tick = ticker.minTick if valid_price(ticker.minTick) else limit_tick
+        ticks = math.floor(price / tick + 1e-9) if action == 'BUY' else math.ceil(price / tick - 1e-9)
+        return round(ticks * tick, 8)
+    
+    async def _async_work_order(self, parent, reservation):
+        """Work a parent order to the end in its execution mode.
+        
+        Runs as its own task on the IB loop, so slicing carries on after the
+        webhook has had its answer. Owns the reservation from here on.
+        """
+        try:
+            if parent.mode == 'limit':
+                await self._async_work_limit(parent, reservation)
+            elif parent.mode == 'sliced':
+                await self._async_work_sliced(parent, reservation)
+            else:
+                trade = self._place_child(parent, MarketOrder(parent.action, parent.qty), reservation)
+                await self._async_wait_done(trade)
+        except Exception as e:
+            parent.reason = f"Order stopped: {e}"
+            logger.error(f"{parent.mode} {parent.action} {parent.qty} {parent.contract.symbol} stopped: {e}")
+        finally:
+            if parent.stopped.is_set():
+                parent.reason = parent.stop_reason
+            self.positions.release(reservation)
+            parent.done.set()
+        
+        if parent.mode != 'market':
+            self.journal.record(f"{parent.mode.capitalize()} order done: {parent.action} {parent.filled:g}/{parent.qty} {parent.contract.symbol}{parent.fill_summary()}",
+                                kind='parent', symbol=parent.contract.symbol, conId=parent.contract.conId,
+                                action=parent.action, qty=parent.qty, filled=parent.filled,
+                                avg_price=parent.avg_price(), reference_price=parent.reference_price,
+                                slippage_bps=parent.slippage_bps(parent.avg_price()), mode=parent.mode,
+                                children=len(parent.children), reason=parent.reason, account=self.account)
+    
+    @staticmethod
+    def _halted(parent):
+        """Stop working an entry once its symbol is halted, or once it is stopped"""
+        if parent.stopped.is_set():
+            return True
+        if parent.opening and risk_engine.is_halted(parent.contract.symbol):
+            parent.reason = f"Trading halted with {parent.qty - parent.filled:g} unfilled"
+            logger.warning(f"{parent.mode.capitalize()} {parent.action} {parent.contract.symbol}: {parent.reason}")
+            return True
+        return False
+    
+    async def _async_work_limit(self, parent, reservation):
+        """Rest a limit order at the quote, then send the unfilled rest at market"""
+        contract = parent.contract
+        with self.quotes.hold(contract) as ticker:
+            await self._async_quote(ticker)
+        if parent.reference_price is None:
+            parent.reference_price = quote_price(ticker, limit_price_source)
+        if parent.stopped.is_set():
+            return
+        
+        price = self._limit_price(ticker, parent.action)
+        if price is None:
+            logger.warning(f"No quote for {contract.symbol}, sending {parent.action} {parent.qty} at market")
+        else:
+            trade = self._place_child(parent, LimitOrder(parent.action, parent.qty, price), reservation)
+            if await self._async_wait_done(trade, limit_timeout):
+                if trade.orderStatus.status != 'Filled' and not parent.stopped.is_set():
+                    # Rejected or cancelled by IB: that is no reason to go to market
+                    message = trade.log[-1].message if trade.log and trade.log[-1].message else 'no reason given'
+                    parent.reason = f"Limit order {trade.orderStatus.status}: {message}"
+                    logger.warning(f"{parent.action} {parent.qty} {contract.symbol}: {parent.reason}")
+                    return
+            else:
+                self.ib.cancelOrder(trade.order)
+                # Only send the rest once IB confirms nothing more can fill here
+                if not await self._async_wait_done(trade, order_completion_timeout):
+                    parent.reason = f"Limit order {trade.order.orderId} did not confirm its cancel"
+                    logger.warning(f"{parent.reason}; not sending the rest at market")
                     return
-            except Exception as e:
-                logger.info(f"✗ Contract {i+1} failed: {e}")
-                continue
         
-        # If all attempts fail, raise an error
-        raise Exception(f"Could not qualify contract for symbol {symbol}. Check market data permissions and symbol format.")
+        remaining = parent.qty - parent.filled
+        if remaining > 0 and not self._halted(parent):
+            trade = self._place_child(parent, MarketOrder(parent.action, remaining), reservation)
+            await self._async_wait_done(trade)
+    
+    async def _async_work_sliced(self, parent, reservation):
+        """Send market child orders, one at a time, within the participation cap.
         
-    async def _async_test_permissions(self):
-        """Test market data permissions"""
-        try:
-            # Try to get market data for a simple HK stock
-            test_contract = Stock('0005', 'SEHK', 'HKD')  # HSBC Holdings
-            qualified = await self.ib.qualifyContractsAsync(test_contract)
-            if qualified:
-                return {'success': 'Market data permissions OK for HK stocks'}
-            else:
-                return {'error': 'Could not qualify HK test contract'}
-        except Exception as e:
-            return {'error': f'Market data permission test failed: {e}'}
+        While IB reports no volume the cap cannot be measured: children are
+        held to SLICE_MIN_SIZE, or the order stops when that is 0.
+        """
+        contract = parent.contract
+        deadline = parent.started + slice_max_duration
+        with self.quotes.hold(contract) as ticker:
+            await self._async_quote(ticker)
+            if parent.reference_price is None:
+                parent.reference_price = quote_price(ticker)
+            start_volume = ticker.volume if ticker.volume == ticker.volume else None
+            volume_warned = False
+            # The slicer has taken the order; children may wait on the cap
+            parent.acked.set()
             
-    async def _async_close_position(self, contract, direction):
+            while not self._halted(parent):
+                ticker = self.quotes.ticker(contract.conId) or ticker  # Replaced on a reconnect
+                remaining = parent.qty - parent.filled
+                size = min(slice_size, remaining)
+                volume = ticker.volume if ticker.volume == ticker.volume else None
+                if slice_participation > 0 and start_volume is None and volume is not None:
+                    start_volume = volume - parent.filled  # Volume arrived after the order started
+                if slice_participation > 0 and volume is None:
+                    if not slice_min_size:
+                        parent.reason = (f"No market volume to hold {slice_participation:g} participation to, "
+                                         f"stopped with {remaining} unfilled; set SLICE_MIN_SIZE to slice anyway")
+                        logger.warning(f"Sliced {parent.action} {contract.symbol}: {parent.reason}")
+                        return
+                    if not volume_warned:
+                        volume_warned = True
+                        logger.warning(f"Sliced {parent.action} {contract.symbol}: no market volume from IB, "
+                                       f"sending children of at most SLICE_MIN_SIZE={slice_min_size}")
+                    size = min(size, slice_min_size)
+                elif slice_participation > 0:
+                    # Market volume since the start includes our own fills
+                    allowed = slice_participation * (volume - start_volume) - parent.filled
+                    size = min(size, int(allowed))
+                
+                if size > 0:
+                    trade = self._place_child(parent, MarketOrder(parent.action, size), reservation)
+                    if not await self._async_wait_done(trade, max(0, deadline - time.monotonic())):
+                        self.ib.cancelOrder(trade.order)
+                        await self._async_wait_done(trade, order_completion_timeout)
+                    elif trade.orderStatus.filled == 0:
+                        parent.reason = f"Child order {trade.orderStatus.status}: {trade.log[-1].message if trade.log else 'Unknown reason'}"
+                        return
+                
+                remaining = parent.qty - parent.filled
+                if remaining <= 0:
+                    return
+                if time.monotonic() + slice_interval > deadline:
+                    parent.reason = f"Stopped after {slice_max_duration:g}s with {remaining} unfilled"
+                    logger.warning(f"Sliced {parent.action} {contract.symbol}: {parent.reason}")
+                    return
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(parent.stopped.wait(), slice_interval)
+    
+    async def _async_execute_order(self, contract, action, qty, reservation, completion=None,
+                                   order_type=None, price=None, opening=True):
+        """Start working an order and wait for its completion policy.
+        
+        Returns the parent order and its status. 'filled' waits for the whole
+        parent order, however many children it takes.
+        """
+        completion = completion or order_completion
+        if completion not in ORDER_COMPLETION_POLICIES:
+            raise ValueError(f"Invalid completion policy: {completion}")
+        
+        # Without a signal price, slippage is measured from the cached quote
+        reference_price = price if price is not None else self.quotes.price(contract.conId)
+        parent = ParentOrder(contract, action, qty, order_type or execution_mode, reference_price, opening)
+        parent.reservation = reservation
+        task = self.loop.create_task(self._async_work_order(parent, reservation))
+        self.executions[task] = parent
+        task.add_done_callback(lambda task: self.executions.pop(task, None))
+        
+        target = {'ack': parent.acked, 'first_fill': parent.first_fill, 'filled': parent.done}[completion]
+        waiters = [asyncio.ensure_future(target.wait()), asyncio.ensure_future(parent.done.wait())]
+        with metrics.timer('tradingbot_stage_seconds', stage='fill_wait'):
+            finished, _ = await asyncio.wait(waiters, timeout=order_completion_timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+        for waiter in waiters:
+            waiter.cancel()
+        
+        status = parent.status()
+        if not finished:
+            logger.info(f"{action} {qty} {contract.symbol} still {status} after {order_completion_timeout}s ({completion} policy)")
+        metrics.inc('tradingbot_orders_total', action=action, status=status)
+        return parent, status
+    
+    @staticmethod
+    def _order_label(parent):
+        """Order type shown in replies, for anything but a plain market order"""
+        return '' if parent.mode == 'market' else f" [{parent.mode}]"
+    
+    async def _async_close_position(self, contract, direction, completion=None, reservation=None, signed_qty=None,
+                                    order_type=None, price=None):
         """Close existing position in async context"""
+        parent = None
         try:
-            positions = self.ib.positions()
-            target_position = None
-            
-            # Find the existing position
-            for pos in positions:
-                if (pos.contract.symbol == contract.symbol and 
-                    pos.contract.exchange == contract.exchange and
-                    pos.contract.secType == contract.secType):
-                    target_position = pos
-                    break
-            
-            if not target_position:
-                return {'error': 'No position found to close'}
-            
-            current_position = target_position.position
-            
-            # Determine if we should close this position
-            if direction == "close_long" and current_position <= 0:
-                return {'error': 'No long position to close'}
-            elif direction == "close_short" and current_position >= 0:
-                return {'error': 'No short position to close'}
+            if reservation is None:
+                if not await self._async_stop_entries(contract):
+                    return {'error': self._entries_not_stopped(contract)}
+                # Orders that are still working count towards the position, so a
+                # repeated close signal does not close the same shares twice
+                reservation, signed_qty = self.positions.reserve_close(contract.conId, direction)
+                if reservation is None:
+                    return {'error': self._nothing_to_close(direction, signed_qty)}
             
             # Determine the closing order action and quantity
-            if direction == "close_long":
-                action = "SELL"
-                qty = abs(current_position)  # Close entire long position
-            else:  # close_short
-                action = "BUY"
-                qty = abs(current_position)  # Close entire short position
-            
-            # Create market order to close position
-            order = MarketOrder(action, qty)
-            order.tif = 'GTC'
-            order.outsideRth = True
+            action = "BUY" if signed_qty > 0 else "SELL"
+            qty = abs(signed_qty)  # Close entire position
+            risk_engine.count_order(contract.symbol)  # Closes count towards the rate but are never refused
             
-            trade = self.ib.placeOrder(contract, order)
-            
-            # Wait a moment for order processing
-            await asyncio.sleep(2)
+            # Work the closing order and wait until the completion policy is
+            # met or its deadline passes
+            parent, status = await self._async_execute_order(contract, action, qty, reservation, completion,
+                                                             order_type, price, opening=False)
             
             # Check if order was filled or still pending
-            if trade.orderStatus.status in ['Filled', 'PartiallyFilled']:
-                status_msg = f"Position closed: {action} {qty} {contract.symbol} (was {current_position})"
-            elif trade.orderStatus.status == 'Submitted':
+            if status in ['Filled', 'PartiallyFilled']:
+                status_msg = f"Position closed: {action} {qty} {contract.symbol} (was {-signed_qty}){parent.fill_summary()}"
+            elif status in ['Submitted', 'PreSubmitted']:
                 status_msg = f"Close order submitted: {action} {qty} {contract.symbol}"
-            elif trade.orderStatus.status == 'Cancelled':
-                return {'error': f'Close order cancelled: {trade.log[-1].message if trade.log else "Unknown reason"}'}
+            elif status in ['Cancelled', 'ApiCancelled', 'Inactive']:
+                return {'error': f'Close order cancelled: {parent.cancel_reason()}'}
             else:
-                status_msg = f"Close order status: {trade.orderStatus.status} - {action} {qty} {contract.symbol}"
+                status_msg = f"Close order status: {status} - {action} {qty} {contract.symbol}"
+            status_msg += self._order_label(parent)
             
-            self.L_log.append([datetime.now(timezone.utc), status_msg])
+            self.journal.record(status_msg, kind='close', symbol=contract.symbol, conId=contract.conId,
+                                action=action, qty=qty, status=status,
+                                orderId=parent.children[0].order.orderId if parent.children else None,
+                                mode=parent.mode, avg_price=parent.avg_price(),
+                                slippage_bps=parent.slippage_bps(parent.avg_price()),
+                                time_to_fill=parent.time_to_fill, account=self.account)
             logger.info(status_msg)
             
             return {'success': status_msg}
             
         except Exception as e:
             error_msg = f'Position close failed: {e}'
-            self.L_log.append([datetime.now(timezone.utc), error_msg])
+            self.journal.record(error_msg, kind='close', symbol=contract.symbol, error=str(e))
             return {'error': error_msg}
+        finally:
+            if reservation is not None and parent is None:
+                self.positions.release(reservation)
         
-    async def _async_check_position(self, direction, contract):
-        """Check position in async context"""
-        try:
-            positions = self.ib.positions()
-            
-            for pos in positions:
-                if (pos.contract.symbol == contract.symbol and 
-                    pos.contract.exchange == contract.exchange and
-                    pos.contract.secType == contract.secType):
-                    
-                    # For position checking, use a minimum threshold
-                    # US stocks typically trade in units of 1, HK stocks in units of 100-500
-                    min_position_threshold = 1 if contract.currency == 'USD' else 100
-                    
-                    if direction == "long" and pos.position >= min_position_threshold:
-                        return True
-                    elif direction == "short" and pos.position <= -min_position_threshold:
-                        return True
-            return False
-        except Exception as e:
-            return {'error': f'Position check failed: {e}'}
-            
-    async def _async_submit_order(self, contract, direction, qty):
-        """Submit order in async context"""
+    async def _async_stop_entries(self, contract):
+        """Stop the contract's working entry orders ahead of a close, so the
+        close flattens only what they filled: no more children are sent and
+        working ones are cancelled. False if one is still working after
+        ORDER_COMPLETION_TIMEOUT"""
+        parents = [parent for parent in self.executions.values()
+                   if parent.opening and parent.contract.conId == contract.conId and not parent.done.is_set()]
+        if not parents:
+            return True
+        for parent in parents:
+            parent.stop(f"Stopped by a close signal after {parent.filled:g} of {parent.qty} filled")
+            for trade in parent.children:
+                if not trade.isDone() and trade.orderStatus.status != 'Inactive':
+                    self.ib.cancelOrder(trade.order)
+        logger.info(f"Stopping {len(parents)} working {contract.symbol} entry order(s) before closing")
+        waiters = [asyncio.ensure_future(parent.done.wait()) for parent in parents]
+        _, working = await asyncio.wait(waiters, timeout=order_completion_timeout)
+        for waiter in working:
+            waiter.cancel()
+        return not working
+    
+    @staticmethod
+    def _entries_not_stopped(contract):
+        return (f"Close not sent: working {contract.symbol} entry orders did not stop "
+                f"within {order_completion_timeout:g}s")
+    
+    def _risk_check(self, contract, price):
+        """Risk check for PositionBook.reserve, run against the exposure it sees.
+        Notional is priced from the cached quote, else price (a quote the
+        caller waited for), else the risk engine's last fill"""
+        price = self.quotes.price(contract.conId) or price
+        return lambda signed_qty, exposure: risk_engine.check_entry(contract.symbol, contract.conId, signed_qty,
+                                                                    exposure, price)
+    
+    async def _async_risk_price(self, contract):
+        """A quote for the notional limit, waiting up to QUOTE_TIMEOUT when the
+        limit is set and neither a quote nor a fill prices the contract yet"""
+        price = self.quotes.price(contract.conId) or risk_engine.last_price(contract.conId)
+        if price or not risk_engine.max_notional:
+            return price
+        with self.quotes.hold(contract) as ticker:
+            return quote_price(await self._async_quote(ticker))
+    
+    def _risk_rejected(self, contract, error):
+        metrics.inc('tradingbot_rejects_total', reason='risk')
+        logger.warning(f"Risk check refused {contract.symbol}: {error}")
+        self.journal.record(f"Risk rejected: {error}", kind='risk', symbol=contract.symbol, error=str(error),
+                            account=self.account)
+        return {'error': str(error), 'http_status': error.http_status}
+    
+    @staticmethod
+    def _nothing_to_close(direction, exposure):
+        """Error for a close signal with no matching exposure"""
+        if exposure == 0:
+            return 'No position found to close'
+        if direction == "close_long":
+            return 'No long position to close'
+        return 'No short position to close'
+    
+    @staticmethod
+    def _position_threshold(contract):
+        """Smallest position that counts as an open long/short"""
+        # US stocks typically trade in units of 1, HK stocks in units of 100-500
+        return 1 if contract.currency == 'USD' else 100
+    
+    async def _async_submit_order(self, contract, direction, qty, completion, reservation, order_type=None,
+                                  price=None):
+        """Place an entry order against its reservation from PositionBook.reserve"""
+        parent = None
         try:
             if direction == "long":
                 action = "BUY"
@@ -317,167 +2430,927 @@ class TradingBotAsync:
                 action = "SELL"
             else:
                 return {'error': f'Invalid direction: {direction}'}
-                
-            # Create market order with proper settings
-            order = MarketOrder(action, qty)
-            order.tif = 'GTC'  # Good Till Cancelled instead of DAY
-            order.outsideRth = True  # Allow outside regular trading hours
-            
-            trade = self.ib.placeOrder(contract, order)
             
-            # Wait a moment for order processing
-            await asyncio.sleep(2)
+            # Work the order and wait until the completion policy is met or
+            # its deadline passes
+            parent, status = await self._async_execute_order(contract, action, qty, reservation, completion,
+                                                             order_type, price)
             
             # Check if order was filled or still pending
-            if trade.orderStatus.status in ['Filled', 'PartiallyFilled']:
-                status_msg = f"Order {trade.orderStatus.status}: {action} {qty} {contract.symbol}"
-            elif trade.orderStatus.status == 'Submitted':
+            if status in ['Filled', 'PartiallyFilled']:
+                status_msg = f"Order {status}: {action} {qty} {contract.symbol}{parent.fill_summary()}"
+            elif status in ['Submitted', 'PreSubmitted']:
                 status_msg = f"Order submitted: {action} {qty} {contract.symbol}"
-            elif trade.orderStatus.status == 'Cancelled':
-                return {'error': f'Order cancelled: {trade.log[-1].message if trade.log else "Unknown reason"}'}
+            elif status in ['Cancelled', 'ApiCancelled', 'Inactive']:
+                return {'error': f'Order cancelled: {parent.cancel_reason()}'}
             else:
-                status_msg = f"Order status: {trade.orderStatus.status} - {action} {qty} {contract.symbol}"
+                status_msg = f"Order status: {status} - {action} {qty} {contract.symbol}"
+            status_msg += self._order_label(parent)
             
-            self.L_log.append([datetime.now(timezone.utc), status_msg])
-            print(status_msg)
+            self.journal.record(status_msg, kind='open', symbol=contract.symbol, conId=contract.conId,
+                                action=action, qty=qty, status=status,
+                                orderId=parent.children[0].order.orderId if parent.children else None,
+                                mode=parent.mode, avg_price=parent.avg_price(),
+                                slippage_bps=parent.slippage_bps(parent.avg_price()),
+                                time_to_fill=parent.time_to_fill, account=self.account)
+            logger.info(status_msg)
             
             return {'success': status_msg}
             
         except Exception as e:
             error_msg = f'Order failed: {e}'
-            self.L_log.append([datetime.now(timezone.utc), error_msg])
+            self.journal.record(error_msg, kind='open', symbol=contract.symbol, error=str(e))
             return {'error': error_msg}
+        finally:
+            if reservation is not None and parent is None:
+                self.positions.release(reservation)
     
-    def set_contract(self, exchange, secType, symbol):
+    def set_contract(self, exchange, secType, symbol, request_id=None):
         """Thread-safe contract setting"""
-        self.command_queue.put({
+        self.contract_spec = (exchange, secType, symbol)
+        future = self._dispatch({
             'action': 'set_contract',
             'exchange': exchange,
             'secType': secType,
             'symbol': symbol
-        })
-        time.sleep(3)  # Give more time for contract qualification
+        }, request_id)
+        try:
+            result = self._wait(future, timeout=10)
+            if isinstance(result, dict) and 'error' in result:
+                logger.error(f"[{result['request_id']}] Contract setup error: {result['error']}")
+        except concurrent.futures.TimeoutError:
+            logger.error("Contract setup timeout")
         
-    def test_market_data_permissions(self):
-        """Test if we have market data permissions for HK stocks"""
-        self.command_queue.put({
-            'action': 'test_permissions'
-        })
+    def resolve_contract(self, symbol, exchange=None, currency=None, request_id=None, exchange_hint=None):
+        """Thread-safe contract lookup; cached contracts skip the IB loop"""
+        contract = self.contracts.get(ContractRegistry.key(symbol, exchange, currency))
+        if contract is not None:
+            return contract
+        
+        future = self._dispatch({
+            'action': 'resolve_contract',
+            'symbol': symbol,
+            'exchange': exchange,
+            'currency': currency,
+            'exchange_hint': exchange_hint
+        }, request_id)
         
         try:
-            result = self.result_queue.get(timeout=10)
+            result = self._wait(future, timeout=10)
+            if isinstance(result, dict) and 'error' in result:
+                raise Exception(result['error'])
             return result
-        except queue.Empty:
-            return {'error': 'Market data permission test timeout'}
+        except concurrent.futures.TimeoutError:
+            raise Exception(f"Contract lookup timeout for {symbol}")
+        
+    def apply_settings(self, contract=None):
+        """Pick up reloaded settings on the IB loop, keeping the connection and
+        positions. contract is the new instrument, already qualified"""
+        def apply():
+            self.order_size = order_size
+            self.lanes.max_depth = lane_max_depth
+            self.lanes.max_pending = max_pending_signals
+            self.quotes.resize(quote_cache_size)
+            spec = (exchange, "STK", instructment)
+            if contract is not None:
+                self.contract = contract
+                self.contracts.put(ContractRegistry.key(instructment), contract)
+                self.quotes.track(contract, pin=True)
+            elif spec != self.contract_spec:
+                if self.is_ready():
+                    # Connected after the others qualified it: trade the old one until this qualifies
+                    self.loop.create_task(self._async_set_contract(*spec))
+                else:
+                    self.contract = None  # The supervisor qualifies it on connect
+            self.contract_spec = spec
+            self._state_changed()
+        
+        self.loop.call_soon_threadsafe(apply)
+    
+    def warm_up(self, symbols, request_id=None):
+        """Pre-qualify (symbol, exchange, currency) specs without waiting"""
+        return self._dispatch({
+            'action': 'warm_up',
+            'symbols': symbols
+        }, request_id)
         
-    def check_contract_position(self, direction, contract):
-        """Thread-safe position checking"""
-        self.command_queue.put({
-            'action': 'check_position',
-            'direction': direction,
-            'contract': contract
-        })
+    def handle_signal(self, message, request_id=None):
+        """Thread-safe signal handling; returns a success/skipped/error dict"""
+        future = self._dispatch({
+            'action': 'handle_signal',
+            'message': message
+        }, request_id)
         
         try:
-            result = self.result_queue.get(timeout=10)
-            if isinstance(result, dict) and 'error' in result:
-                print(f"Position check error: {result['error']}")
-                return False
-            return result
-        except queue.Empty:
-            print("Position check timeout")
-            return False
-            
-    def submit_order(self, contract, direction, qty):
-        """Thread-safe order submission"""
-        self.command_queue.put({
-            'action': 'submit_order',
-            'contract': contract,
-            'direction': direction,
-            'qty': qty
-        })
+            return self._wait(future, timeout=signal_timeout)
+        except concurrent.futures.TimeoutError:
+            return {'error': 'Signal processing timeout'}
+    
+    async def async_handle_signal(self, message, request_id=None):
+        """Signal handling for async callers on any event loop"""
+        return await self.run_command({
+            'action': 'handle_signal',
+            'message': message
+        }, request_id)
+        
+    def handle_batch(self, messages, request_id=None):
+        """Thread-safe batch handling; returns a result dict per leg, or an
+        error dict for the whole batch"""
+        future = self._dispatch({
+            'action': 'handle_batch',
+            'messages': messages
+        }, request_id)
         
         try:
-            result = self.result_queue.get(timeout=30)
-            if isinstance(result, dict):
-                if 'error' in result:
-                    raise Exception(result['error'])
-                elif 'success' in result:
-                    return result['success']
-            return result
-        except queue.Empty:
-            raise Exception("Order submission timeout")
+            return self._wait(future, timeout=signal_timeout)
+        except concurrent.futures.TimeoutError:
+            return {'error': 'Batch processing timeout'}
+    
+    async def async_handle_batch(self, messages, request_id=None):
+        """Batch handling for async callers on any event loop"""
+        return await self.run_command({
+            'action': 'handle_batch',
+            'messages': messages
+        }, request_id)
     
-    def close_position(self, contract, direction):
-        """Thread-safe position closing"""
-        self.command_queue.put({
-            'action': 'close_position',
-            'contract': contract,
-            'direction': direction
-        })
+    def run_queued(self, entry_id, message, legs=None, request_id=None, replay=False):
+        """Hand a signal queue entry to the event loop without waiting; its
+        orders are tagged with the entry's ID. Returns the command's future"""
+        return self._dispatch({
+            'action': 'run_queued',
+            'order_ref': entry_id,
+            'message': message,
+            'legs': legs,
+            'replay': replay
+        }, request_id)
+        
+    def test_market_data_permissions(self, request_id=None):
+        """Test if we have market data permissions for HK stocks"""
+        future = self._dispatch({
+            'action': 'test_permissions'
+        }, request_id)
         
         try:
-            result = self.result_queue.get(timeout=30)
-            if isinstance(result, dict):
-                if 'error' in result:
-                    raise Exception(result['error'])
-                elif 'success' in result:
-                    return result['success']
-            return result
-        except queue.Empty:
-            raise Exception("Position closing timeout")
+            return self._wait(future, timeout=10)
+        except concurrent.futures.TimeoutError:
+            return {'error': 'Market data permission test timeout'}
 
-# Initialize bot manager and start first initialization attempt
-logger.info("Starting bot manager...")
-bot_manager._start_initialization()
+# Initialize bot manager and start first initialization attempt.
+# In ASGI mode the bot is started by the server's lifespan handler, once
+# the shared event loop exists.
+if server_mode != 'asgi':
+    logger.info("Starting bot manager...")
+    bot_manager._start_initialization()
 
 # Webhook setup
 app = Flask(__name__)
 
-# Simple rate limiting and security
-request_counts = defaultdict(lambda: deque())
+class RateLimiter:
+    """Per-client rate limiter with O(1) state per client.
+    
+    'sliding_window' approximates a sliding window from the counts of the
+    current and previous fixed windows; 'token_bucket' refills limit tokens
+    per window. Clients live in a bounded LRU, so a scan from many IPs
+    cannot grow memory without limit, and are spread over lock stripes so
+    concurrent requests rarely wait on each other.
+    """
+    
+    ALGORITHMS = ['sliding_window', 'token_bucket']
+    
+    def __init__(self, limit, window, algorithm='sliding_window', max_clients=10000, stripes=16):
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError(f"Invalid rate limit algorithm: {algorithm}")
+        self.limit = limit
+        self.window = window
+        self.algorithm = algorithm
+        self._rate = limit / window
+        self._stripes = [(threading.Lock(), OrderedDict()) for _ in range(stripes)]
+        self._max_per_stripe = max(1, max_clients // stripes)
+    
+    def is_limited(self, client, now=None):
+        """Count a request from client; True if it is over the limit"""
+        now = time.monotonic() if now is None else now
+        lock, clients = self._stripes[hash(client) % len(self._stripes)]
+        with lock:
+            state = clients.get(client)
+            if state is None:
+                # [window start, current count, previous count] or [tokens, last refill]
+                state = [now, 0, 0] if self.algorithm == 'sliding_window' else [float(self.limit), now]
+                clients[client] = state
+                if len(clients) > self._max_per_stripe:
+                    clients.popitem(last=False)  # Evict the least recently seen client
+            else:
+                clients.move_to_end(client)
+            
+            if self.algorithm == 'token_bucket':
+                state[0] = min(self.limit, state[0] + (now - state[1]) * self._rate)
+                state[1] = now
+                if state[0] < 1:
+                    return True
+                state[0] -= 1
+                return False
+            
+            elapsed = now - state[0]
+            if elapsed >= self.window:
+                # Roll forward; after two idle windows the history is empty
+                state[2] = state[1] if elapsed < 2 * self.window else 0
+                state[1] = 0
+                state[0] += self.window * int(elapsed // self.window)
+                elapsed = now - state[0]
+            estimate = state[2] * (1 - elapsed / self.window) + state[1]
+            if estimate >= self.limit:
+                return True
+            state[1] += 1
+            return False
+    
+    def __len__(self):
+        return sum(len(clients) for _, clients in self._stripes)
+
+def parse_route_limits(spec, default_window=None):
+    """RATE_LIMIT_ROUTES: '/health=120/60,/metrics=30/60' -> {path: (limit, window)}"""
+    limits = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        path, _, rule = item.strip().partition('=')
+        limit, _, window = rule.partition('/')
+        limits[path] = (int(limit), int(window or default_window or rate_limit_window))
+    return limits
+
+# Rate limiting and security
+# Every allowed path has its own budget, so health probes never use up the
+# webhook's; other paths share a 'default' budget
 RATE_LIMIT_WINDOW = rate_limit_window
 RATE_LIMIT_MAX_REQUESTS = rate_limit_requests
-BLOCKED_USER_AGENTS = ['Go-http-client', 'python-requests', 'curl', 'wget']
-ALLOWED_PATHS = ['/', '/webhook', '/test', '/health']
+BLOCKED_USER_AGENTS = blocked_user_agents
+BLOCKED_BODY_PREFIXES = [b'\x16\x03', b'SSH-']  # TLS handshake, SSH banner
+ALLOWED_PATHS = ['/', '/webhook', '/test', '/health', '/ready', '/metrics', '/trades', '/quote', '/admin/halt',
+                 '/admin/config']
+SIGNAL_DIRECTIONS = ["long", "short", "close_long", "close_short"]
+# Probes are served from memory, so they get a generous default budget
+PROBE_RATE_LIMITS = '/health=600/60,/ready=600/60'
+
+def build_rate_limiters(limit, window):
+    """One limiter per allowed path, with its RATE_LIMIT_ROUTES budget or the default one"""
+    route_limits = parse_route_limits(f"{PROBE_RATE_LIMITS},{rate_limit_routes}", window)
+    return {
+        path: RateLimiter(*route_limits.get(path, (limit, window)),
+                          algorithm=rate_limit_algorithm, max_clients=rate_limit_max_clients)
+        for path in ALLOWED_PATHS + ['default']
+    }
+
+rate_limiters = build_rate_limiters(RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_WINDOW)
+
+def is_rate_limited(ip, path='default'):
+    """Rate limiting by IP, with a separate budget per route"""
+    limiter = rate_limiters.get(path) or rate_limiters['default']
+    return limiter.is_limited(ip)
 
-def is_rate_limited(ip):
-    """Simple rate limiting by IP"""
-    now = time.time()
-    requests = request_counts[ip]
+class SecurityRules:
+    """Compiled request filter.
     
-    # Remove old requests outside the window
-    while requests and requests[0] < now - RATE_LIMIT_WINDOW:
-        requests.popleft()
+    User-Agents are matched with a single precompiled regex, paths against
+    a frozenset, and bodies only by their first few bytes, so junk traffic
+    is rejected without the body ever being buffered.
+    """
     
-    # Check if over limit
-    if len(requests) >= RATE_LIMIT_MAX_REQUESTS:
-        return True
+    def __init__(self, allowed_paths, blocked_user_agents=(), blocked_body_prefixes=(), sniff_bytes=8):
+        self.allowed_paths = frozenset(allowed_paths)
+        blocked_user_agents = [ua for ua in blocked_user_agents if ua]
+        self.user_agents = (re.compile('|'.join(re.escape(ua) for ua in blocked_user_agents), re.IGNORECASE)
+                            if blocked_user_agents else None)
+        self.body_prefixes = tuple(p.encode('latin-1') if isinstance(p, str) else p
+                                   for p in blocked_body_prefixes)
+        self.sniff_bytes = max([sniff_bytes] + [len(p) for p in self.body_prefixes])
+    
+    @classmethod
+    def load(cls, allowed_paths, blocked_user_agents, blocked_body_prefixes, sniff_bytes, rules_file=''):
+        """Build the rules from settings, with a JSON rules file taking precedence.
+        
+        The file may set "blocked_user_agents", "blocked_body_prefixes"
+        (latin-1 strings, e.g. "\\u0016\\u0003") and "sniff_bytes".
+        """
+        if rules_file:
+            with open(rules_file) as f:
+                rules = json.load(f)
+            blocked_user_agents = rules.get('blocked_user_agents', blocked_user_agents)
+            blocked_body_prefixes = rules.get('blocked_body_prefixes', blocked_body_prefixes)
+            sniff_bytes = int(rules.get('sniff_bytes', sniff_bytes))
+            logger.info(f"Loaded security rules from {rules_file}")
+        return cls(allowed_paths, blocked_user_agents, blocked_body_prefixes, sniff_bytes)
+    
+    def is_malicious(self, path, user_agent):
+        """Check the path and User-Agent"""
+        # Check for suspicious paths
+        if path not in self.allowed_paths and not path.startswith('/webhook'):
+            return True
+        
+        # Check user agent (optional - might block legitimate requests)
+        return bool(user_agent and self.user_agents and self.user_agents.search(user_agent))
+    
+    def is_malicious_body(self, head):
+        """Check the first bytes of the body for TLS/SSH handshakes"""
+        return bool(head) and head.startswith(self.body_prefixes)
+
+security_rules = SecurityRules.load(ALLOWED_PATHS, BLOCKED_USER_AGENTS, BLOCKED_BODY_PREFIXES,
+                                    body_sniff_bytes, security_rules_file)
+
+class _ReplayStream:
+    """WSGI input that replays bytes already read from the start of the body"""
     
-    # Add current request
-    requests.append(now)
-    return False
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+    
+    def read(self, size=-1):
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.stream.read(), b''
+            return data
+        data, self.head = self.head[:size], self.head[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+    
+    def readline(self, size=-1):
+        if size is None or size < 0:
+            size = -1
+        end = self.head.find(b'\n') + 1 or len(self.head)
+        if size >= 0:
+            end = min(end, size)
+        line, self.head = self.head[:end], self.head[end:]
+        if self.head or line.endswith(b'\n') or len(line) == size:
+            return line
+        return line + self.stream.readline(size - len(line) if size >= 0 else -1)
+
+def sniff_wsgi_input(environ, size):
+    """First bytes of a WSGI request body, leaving the body readable from the start"""
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    stream = environ.get('wsgi.input')
+    if length <= 0 or stream is None:
+        return b''
+    size = min(size, length)
+    # Buffered socket readers (the Flask dev server) can look without consuming
+    peek = getattr(stream, 'peek', None)
+    if peek is not None:
+        return peek(size)[:size]
+    head = stream.read(size)
+    environ['wsgi.input'] = _ReplayStream(head, stream)
+    return head
 
 def is_malicious_request():
     """Detect potentially malicious requests"""
-    # Check for SSL/TLS handshake attempts
-    if request.data and request.data.startswith(b'\x16\x03'):
+    environ = request.environ
+    if security_rules.is_malicious(request.path, environ.get('HTTP_USER_AGENT', '')):
         return True
+    return security_rules.is_malicious_body(sniff_wsgi_input(environ, security_rules.sniff_bytes))
+
+class SignalDedupCache:
+    """Bounded, time-expiring map of signal keys to their first response.
     
-    # Check for SSH attempts
-    if request.data and b'SSH-' in request.data:
-        return True
+    The first request for a key gets to process the signal; duplicates
+    wait on (or immediately read) the first request's future. Only
+    successful or queued responses to idempotency keys are kept, so a
+    signal that failed can be retried; body-hash keys are dropped once the
+    first request answers, since a keyless signal may legitimately repeat
+    (long, close_long, long).
+    """
     
-    # Check for suspicious paths
-    if request.path not in ALLOWED_PATHS and not request.path.startswith('/webhook'):
-        return True
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, future)
     
-    # Check user agent (optional - might block legitimate requests)
-    user_agent = request.headers.get('User-Agent', '').lower()
-    if any(blocked in user_agent for blocked in ['bot', 'scanner', 'crawler']):
-        return True
+    def claim(self, key, ttl, request_id=None):
+        """Returns (is_first, future) for a signal key; the future carries the
+        first request's ID"""
+        if key is None:
+            return True, None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= now:
+                return False, entry[1]
+            
+            future = concurrent.futures.Future()
+            future.request_id = request_id
+            self._entries[key] = (now + ttl, future)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return True, future
+    
+    def complete(self, key, future, response):
+        """Publish the first request's response to any duplicates"""
+        if key is None:
+            return
+        if response[1] not in (200, 202) or key.startswith('body:'):
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] is future:
+                    del self._entries[key]
+        future.set_result(response)
+
+signal_dedup = SignalDedupCache(dedup_cache_size)
+
+def duplicate_pending(first_response, request_id):
+    """Answer for a duplicate whose first request is still running"""
+    message = (f"Duplicate of request {first_response.request_id or 'unknown'}, which is still processing; "
+               f"retry later for its result")
+    logger.warning(f"[{request_id}] {message}")
+    return message, 409
+
+def duplicate_response(response, request_id, first_request_id):
+    """A duplicate's reply: the first request's response, marked as a duplicate"""
+    payload, status = response
+    logger.info("[%s] Duplicate of request %s, returning its result", request_id, first_request_id)
+    if isinstance(payload, dict):
+        return {**payload, 'duplicate_of': first_request_id}, status
+    return f"Duplicate of request {first_request_id}: {payload}", status
+
+def signal_key(message, body, header_key=None):
+    """Dedup key and TTL for a signal: an explicit idempotency key, or a
+    hash of the body while an identical one is in flight"""
+    explicit = header_key or message.get("idempotency_key")
+    if explicit:
+        return f"key:{explicit}", idempotency_key_ttl
+    if dedup_window <= 0:
+        return None, 0
+    return f"body:{hashlib.blake2b(body, digest_size=16).hexdigest()}", dedup_window
+
+# Signal schema, compiled once: allowed values as sets, optional fields by type
+_SIGNAL_DIRECTIONS = frozenset(SIGNAL_DIRECTIONS)
+_COMPLETION_POLICIES = frozenset(ORDER_COMPLETION_POLICIES)
+_EXECUTION_MODES = frozenset(EXECUTION_MODES)
+_SIGNAL_FIELD_TYPES = {
+    'symbol': (str, int),
+    'exchange': str,
+    'currency': str,
+    'idempotency_key': (str, int),
+    'account': str,
+    'strategy': str,
+    'qty': int,
+    'price': (int, float),
+}
+
+def validate_signal(message):
+    """Check a parsed webhook message; returns an error string or None"""
+    if not message or not isinstance(message, dict):
+        return "Error: No JSON data received or invalid JSON format"
+    
+    direction = message.get("direction")
+    if not direction:
+        return "Error: 'direction' field is required"
+    
+    if not isinstance(direction, str) or direction not in _SIGNAL_DIRECTIONS:
+        return f"Error: Invalid direction '{direction}'. Must be 'long', 'short', 'close_long', or 'close_short'"
+    
+    completion = message.get("completion")
+    if completion is not None and (not isinstance(completion, str) or completion not in _COMPLETION_POLICIES):
+        return f"Error: Invalid completion '{completion}'. Must be one of {', '.join(ORDER_COMPLETION_POLICIES)}"
+    
+    order_type = message.get("order_type")
+    if order_type is not None and (not isinstance(order_type, str) or order_type not in _EXECUTION_MODES):
+        return f"Error: Invalid order_type '{order_type}'. Must be one of {', '.join(EXECUTION_MODES)}"
+    
+    for field, types in _SIGNAL_FIELD_TYPES.items():
+        value = message.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, types)):
+            return f"Error: Invalid {field} '{value}'"
+    
+    # Sizes and prices must be positive
+    for field in ('qty', 'price'):
+        value = message.get(field)
+        if value is not None and value <= 0:
+            return f"Error: Invalid {field} '{value}'"
+    
+    return None
+
+def parse_signal(body):
+    """Decode and validate a webhook body in one pass.
+    
+    Returns (message, legs, error): legs is the list of signals for a
+    batch and None for a single signal.
+    """
+    try:
+        message = json_loads(body) if body else None
+    except ValueError:
+        message = None
+    legs = batch_legs(message)
+    error = validate_signal(message) if legs is None else validate_batch(legs)
+    return message, legs, error
+
+def signal_route(message, legs=None):
+    """(account, strategy) choosing the IB connection for a signal or batch.
+    
+    Batch legs inherit the batch's account and strategy and must all
+    route the same way.
+    """
+    if legs is None:
+        return message.get("account"), message.get("strategy")
+    envelope = message if isinstance(message, dict) else {}
+    routes = {(leg.get("account", envelope.get("account")), leg.get("strategy", envelope.get("strategy")))
+              for leg in legs}
+    if len(routes) > 1:
+        raise ValueError("All signals in a batch must use the same account and strategy")
+    return routes.pop()
+
+def batch_legs(message):
+    """The legs of a batch webhook (a JSON array, or an object with a
+    'signals' array), or None for a single signal"""
+    if isinstance(message, list):
+        return message
+    if isinstance(message, dict) and "signals" in message:
+        return message["signals"]
+    return None
+
+def validate_batch(legs):
+    """Check every leg of a batch; returns an error string or None"""
+    if not isinstance(legs, list) or not legs:
+        return "Error: 'signals' must be a non-empty array"
+    if len(legs) > batch_max_signals:
+        return f"Error: Batch of {len(legs)} signals exceeds the limit of {batch_max_signals}"
+    for i, leg in enumerate(legs):
+        error = validate_signal(leg)
+        if error:
+            return f"Error in signal {i}: {error.removeprefix('Error: ')}"
+    return None
+
+def signal_symbol(message):
+    """Symbol a single signal trades, as the risk engine keys it"""
+    return str(message.get("symbol") or instructment).upper()
+
+def risk_response(error, request_id):
+    """Reply for a signal refused by the risk checks before it reached IB"""
+    metrics.inc('tradingbot_rejects_total', reason='risk')
+    logger.warning("[%s] Risk check refused the signal: %s", request_id, error)
+    return f"Error processing webhook: {error}", error.http_status
+
+def signal_response(result, request_id):
+    """Turn a handle_signal result into the webhook's (text, status) reply"""
+    if not isinstance(result, dict):
+        result = {'success': result}
+    if 'error' in result:
+        error_msg = f"Error processing webhook: {result['error']}"
+        logger.error("[%s] %s", request_id, error_msg)
+        return error_msg, result.get('http_status', 400)
     
-    return False
+    msg = f"Webhook received: {result.get('success') or result.get('skipped')}"
+    logger.info("[%s] %s", request_id, msg)
+    return msg, 200
+
+def batch_response(results, request_id):
+    """Turn handle_batch results into a JSON reply with one entry per leg.
+    
+    200 when every leg succeeded or was skipped, 207 when some failed and
+    400 when all of them did.
+    """
+    if isinstance(results, dict):
+        return signal_response(results, request_id)
+    legs = []
+    for i, result in enumerate(results):
+        text, status = signal_response(result, f"{request_id}/{i}")
+        legs.append({'signal': i, 'status': status, 'message': text})
+    failed = sum(leg['status'] != 200 for leg in legs)
+    status = 200 if not failed else 400 if failed == len(legs) else 207
+    return {'request_id': request_id, 'results': legs}, status
+
+class SignalQueue:
+    """Write-ahead log of accepted signals, drained into the bots by a worker.
+
+    accept() appends a signal to signals.wal and returns as soon as the
+    record is as durable as the fsync policy asks, so the webhook never
+    waits on IB; concurrent appends share one fsync. A worker thread hands
+    entries to their bot in log order, at most max_inflight at a time, and
+    logs a done record with each result. Entries the bot cannot take yet
+    (not ready, lanes full) are retried every retry_interval.
+
+    Only one entry per route and symbol is with a bot at a time, and later
+    entries for that symbol wait behind one being retried, so a close can
+    never reach IB ahead of the entry it closes.
+
+    On startup the log is read back: unfinished entries are replayed, and
+    recent idempotency keys answer duplicates again. Every order carries
+    its entry ID as orderRef, so a replayed entry that reached IB before
+    the restart is found among IB's orders and fills and not sent again.
+    The log is rewritten without finished entries once it passes
+    compact_bytes.
+    """
+
+    def __init__(self, directory, get_bot, fsync='always', fsync_interval=0.05, max_pending=10000,
+                 max_inflight=64, max_age=0, retry_interval=1, compact_bytes=16 * 1024 * 1024,
+                 max_finished=4096):
+        if fsync not in SIGNAL_QUEUE_FSYNC_POLICIES:
+            raise ValueError(f"SIGNAL_QUEUE_FSYNC must be one of {', '.join(SIGNAL_QUEUE_FSYNC_POLICIES)}")
+        self.directory = directory
+        self.path = os.path.join(directory, 'signals.wal')
+        self.get_bot = get_bot
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_pending = max_pending
+        self.max_inflight = max_inflight
+        self.max_age = max_age
+        self.retry_interval = retry_interval
+        self.compact_bytes = compact_bytes
+        self.max_finished = max_finished
+
+        self.pending = OrderedDict()  # id -> signal record, in log order
+        self._finished = OrderedDict()  # id -> done record with a live dedup key
+        self._lock = threading.Lock()  # Log writes and the pending/finished maps
+        self._sync_lock = threading.Lock()
+        self._written = self._synced = 0
+        self._file = None
+
+        self._work = threading.Condition()
+        self._queue = deque()  # Signal records waiting for a bot
+        self._results = deque()  # (record, result) pairs waiting to be logged
+        self._running = set()  # (route, symbol) of the entries with a bot
+        self._inflight = 0
+        self._retry_at = 0.0
+        self._stopping = False
+        self._worker = None
+        self._closed = threading.Event()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._compact()
+        self._queue.extend(self.pending.values())
+        if self.pending:
+            logger.info(f"Signal queue: replaying {len(self.pending)} unfinished signals from {self.path}")
+        if fsync == 'interval':
+            threading.Thread(target=self._sync_loop, daemon=True).start()
+
+    def _load(self):
+        """Read the log back and answer duplicates of its live keys again"""
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json_loads(line)
+                    except ValueError:
+                        # Only the last record can be torn, and it was never acknowledged
+                        logger.warning(f"Signal queue: skipping an incomplete record in {self.path}")
+                        continue
+                    if record['op'] == 'signal':
+                        record['replay'] = True
+                        self.pending[record['id']] = record
+                    else:
+                        self.pending.pop(record['id'], None)
+                        self._remember(record)
+
+        now = time.time()
+        for record in itertools.chain(self._finished.values(), self.pending.values()):
+            if record['key'] and record['expires'] > now:
+                is_first, future = signal_dedup.claim(record['key'], record['expires'] - now, record['request_id'])
+                if is_first:
+                    response = record.get('response') or self._accepted(record)
+                    signal_dedup.complete(record['key'], future, tuple(response))
+
+    def _remember(self, done):
+        if done['key']:
+            self._finished[done['id']] = done
+            while len(self._finished) > self.max_finished:
+                self._finished.popitem(last=False)
+
+    @staticmethod
+    def _encode(record):
+        return json.dumps(record, default=str).encode('utf-8') + b'\n'
+
+    def _append(self, record):
+        """Write a record to the log and track it; returns its write number"""
+        line = self._encode(record)
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._written += 1
+            written = self._written
+            if record['op'] == 'signal':
+                self.pending[record['id']] = record
+            else:
+                self.pending.pop(record['id'], None)
+                self._remember(record)
+            full = self._file.tell() >= self.compact_bytes
+        if full:
+            self._compact()
+        return written
+
+    def _sync(self, written):
+        """Group commit: one fsync covers every record written before it"""
+        with self._sync_lock:
+            if self._synced >= written:
+                return
+            with self._lock:
+                target = self._written
+            os.fsync(self._file.fileno())
+            self._synced = target
+
+    def _sync_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            try:
+                self._sync(self._written)
+            except OSError as e:
+                logger.error(f"Signal queue: fsync failed: {e}")
+
+    def _compact(self):
+        """Rewrite the log with the unfinished signals and the finished ones
+        whose dedup keys are still live, then switch to it atomically"""
+        now = time.time()
+        with self._sync_lock, self._lock:
+            records = [done for done in self._finished.values() if done['expires'] > now]
+            records += self.pending.values()
+            temp = self.path + '.tmp'
+            with open(temp, 'wb') as f:
+                f.writelines(self._encode(record) for record in records)
+                f.flush()
+                os.fsync(f.fileno())
+            if self._file is not None:
+                self._file.close()
+            os.replace(temp, self.path)
+            if hasattr(os, 'O_DIRECTORY'):
+                fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            self._file = open(self.path, 'ab')
+            self._synced = self._written
+
+    @staticmethod
+    def _accepted(record):
+        return f"Webhook accepted: signal queued as {record['id']}", 202
+
+    def accept(self, request_id, route, message, legs=None, key=None, ttl=0):
+        """Log a signal or batch for the worker; returns the webhook's
+        (text, status) reply: 202 once logged, 503 when the queue is full"""
+        if len(self.pending) >= self.max_pending:
+            metrics.inc('tradingbot_rejects_total', reason='queue_full')
+            logger.warning("[%s] Signal queue is full", request_id)
+            return f"Signal queue is full ({self.max_pending} signals pending). Please try again later.", 503
+
+        now = time.time()
+        record = {'op': 'signal', 'id': new_request_id(), 'time': now, 'request_id': request_id,
+                  'route': list(route), 'message': message if legs is None else None, 'legs': legs,
+                  'key': key, 'expires': now + ttl if key else None}
+        written = self._append(record)
+        if self.fsync == 'always':
+            self._sync(written)
+
+        with self._work:
+            self._queue.append(record)
+            self._work.notify()
+        self.start()
+        text, status = self._accepted(record)
+        logger.info("[%s] %s", request_id, text)
+        return text, status
+
+    def start(self):
+        """Start the worker; in ASGI mode only once the server's loop is attached"""
+        with self._work:
+            if self._worker is None and not self._stopping:
+                self._worker = threading.Thread(target=self._drain, daemon=True)
+                self._worker.start()
+
+    def _drain(self):
+        """Worker: log finished entries and hand queued ones to the bots"""
+        while True:
+            with self._work:
+                while True:
+                    if self._stopping:
+                        return
+                    if self._results:
+                        record, result = self._results.popleft()
+                        break
+                    wait = self._retry_at - time.monotonic()
+                    if self._queue and self._inflight < self.max_inflight and wait <= 0:
+                        record, result = self._take_ready(), None
+                        if record is not None:
+                            self._inflight += 1
+                            break
+                    self._work.wait(wait if self._queue and wait > 0 else None)
+
+            try:
+                if result is not None:
+                    self._finish(record, result)
+                elif not self._submit(record):
+                    with self._work:
+                        self._inflight -= 1
+                        self._running.difference_update(self._symbols(record))
+                        self._queue.appendleft(record)
+                        self._retry_at = time.monotonic() + self.retry_interval
+            except Exception as e:
+                logger.error(f"[{record['request_id']}] Signal queue error: {e}")
+                if result is None:
+                    self._done(record)  # Left in the log, so it replays on the next start
+
+    @staticmethod
+    def _symbols(record):
+        """(route, symbol) of each contract an entry trades"""
+        route = tuple(record['route'])
+        return {(route, signal_symbol(message)) for message in record['legs'] or [record['message']]}
+
+    def _take_ready(self):
+        """Take the first queued entry whose symbols have no entry with a bot
+        or ahead of it in the queue; None when every entry must wait"""
+        blocked = set(self._running)
+        for i, record in enumerate(self._queue):
+            symbols = self._symbols(record)
+            if blocked.isdisjoint(symbols):
+                del self._queue[i]
+                self._running |= symbols
+                return record
+            blocked |= symbols
+        return None
+
+    def _done(self, record):
+        """Free an entry's slot and symbols for the entries behind it"""
+        with self._work:
+            self._inflight -= 1
+            self._running.difference_update(self._symbols(record))
+            self._work.notify()
+
+    def _submit(self, record):
+        """Hand an entry to its bot; False when no bot can take it yet"""
+        if self.max_age and time.time() - record['time'] > self.max_age:
+            self._finish(record, {'error': f"Dropped after {self.max_age:g}s in the signal queue"})
+            self._done(record)
+            return True
+        try:
+            bot = self.get_bot(*record['route'])
+        except ValueError as e:
+            # The route was removed from the configuration since the signal was logged
+            self._finish(record, {'error': str(e)})
+            self._done(record)
+            return True
+        if not bot or not bot.contract:
+            return False
+
+        try:
+            future = bot.run_queued(record['id'], record['message'], record['legs'], record['request_id'],
+                                    record.get('replay', False))
+        except RuntimeError:
+            return False
+        future.add_done_callback(lambda future: self._on_result(bot, record, future))
+        return True
+
+    def _on_result(self, bot, record, future):
+        """Runs on the bot's loop: queue the result for the worker to log"""
+        try:
+            result = future.result()
+        except BaseException:
+            result = None
+
+        # Refused before reaching IB, or cut off by a disconnect: run it again,
+        # reconciled against IB's orders in case it got that far
+        retry = result is None or (isinstance(result, dict) and 'error' in result and
+                                   (result.get('http_status') in (429, 503) or not bot.ib.isConnected()))
+        with self._work:
+            self._inflight -= 1
+            self._running.difference_update(self._symbols(record))
+            if retry:
+                record['replay'] = True
+                self._queue.appendleft(record)
+                self._retry_at = time.monotonic() + self.retry_interval
+            else:
+                self._results.append((record, result))
+            self._work.notify()
+
+    def _finish(self, record, result):
+        """Log an entry's outcome; it will not be replayed after this"""
+        if record['legs'] is None:
+            response = signal_response(result, record['request_id'])
+        else:
+            response = batch_response(result, record['request_id'])
+        self._append({'op': 'done', 'id': record['id'], 'time': time.time(), 'request_id': record['request_id'],
+                      'key': record['key'], 'expires': record['expires'], 'response': list(response)})
+
+    def close(self):
+        """Stop the worker and sync the log; unfinished entries replay on the next start"""
+        with self._work:
+            self._stopping = True
+            self._work.notify_all()
+        self._closed.set()
+        if self._file is not None and not self._file.closed:
+            self._sync(self._written)
+            with self._lock:
+                self._file.close()
+
+signal_queue = None
+if signal_queue_dir:
+    signal_queue = SignalQueue(signal_queue_dir, bot_manager.get_bot, signal_queue_fsync,
+                               signal_queue_fsync_interval, signal_queue_max_pending, signal_queue_max_inflight,
+                               signal_queue_max_age, signal_queue_retry_interval, signal_queue_compact_bytes,
+                               dedup_cache_size)
+    atexit.register(signal_queue.close)
+    metrics.gauge('tradingbot_signal_queue_pending', 'Signals logged in the signal queue and not yet finished',
+                  lambda: len(signal_queue.pending))
+    metrics.gauge('tradingbot_signal_queue_inflight', 'Signal queue entries handed to a bot and running',
+                  lambda: signal_queue._inflight)
+metrics.describe('tradingbot_signal_queue_reconciled_total',
+                 'Replayed signals (or batch legs) IB already had orders for, so not sent again')
 
 @app.before_request
 def security_filter():
@@ -487,13 +3360,19 @@ def security_filter():
         
     client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
     
+    with metrics.timer('tradingbot_stage_seconds', stage='security_filter'):
+        rate_limited = is_rate_limited(client_ip, request.path)
+        malicious = not rate_limited and is_malicious_request()
+    
     # Rate limiting
-    if is_rate_limited(client_ip):
+    if rate_limited:
+        metrics.inc('tradingbot_rate_limited_total')
         logger.warning(f"Rate limited IP: {client_ip}")
         abort(429)  # Too Many Requests
     
     # Malicious request detection
-    if is_malicious_request():
+    if malicious:
+        metrics.inc('tradingbot_rejects_total', reason='malicious')
         logger.warning(f"Blocked malicious request from {client_ip}: {request.path}")
         abort(400)  # Bad Request
 
@@ -509,82 +3388,486 @@ def test():
     else:
         return f"Test POST received. Data: {request.get_data(as_text=True)}"
 
+def health_status(detail=False, token=None):
+    """Liveness payload shared by the Flask and ASGI servers.
+    
+    Served from the in-memory snapshot: answering at all means the process
+    is alive, so the status is always 200. The detailed payload adds every
+    connection's state and its IB ping latency; it names accounts and
+    gateways, so it needs ADMIN_TOKEN.
+    """
+    if detail:
+        denied = admin_denied(token)
+        if denied:
+            return denied
+    summary, detailed, _ = bot_manager.health()
+    return (detailed if detail else summary), 200
+
+def ready_status():
+    """Readiness payload: 200 once the default route can take signals, else 503"""
+    summary, _, ready = bot_manager.health()
+    return summary, 200 if ready else 503
+
+def is_detail(value):
+    return (value or '').lower() in ('1', 'true', 'yes')
+
 @app.route('/health')
 def health():
-    """Health check endpoint"""
-    bot = bot_manager.get_bot()
-    if bot and bot.contract:
-        return {"status": "healthy", "bot": "connected", "contract": str(bot.contract)}
-    else:
-        return {"status": "initializing", "bot": "connecting"}, 503
+    """Liveness check endpoint; ?detail=1 adds per-connection state and needs ADMIN_TOKEN"""
+    return health_status(is_detail(request.args.get('detail')), admin_token_header(request.headers.get))
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    if request.method == 'POST':
+@app.route('/ready')
+def ready():
+    """Readiness check endpoint"""
+    return ready_status()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics endpoint"""
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+def trades_page(token, before, limit):
+    """Page of the trade journal, newest first, with the cursor for the next
+    page; needs ADMIN_TOKEN"""
+    denied = admin_denied(token)
+    if denied:
+        return denied
+    
+    try:
+        before = int(before) if before else None
+        limit = max(1, min(int(limit or 50), 500))
+    except ValueError:
+        return {"error": "'before' and 'limit' must be integers"}, 400
+    trades = trade_journal.page(before, limit)
+    return {"trades": trades, "next_before": trades[-1]['seq'] if len(trades) == limit else None}, 200
+
+def quote_status(symbol=None, exchange=None, currency=None, account=None, strategy=None):
+    """Quotes from the cache, never waiting on IB: one symbol's, or every
+    streaming contract's, most recently used first"""
+    try:
+        bot = bot_manager.get_bot(account, strategy)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if bot is None:
+        return {"error": "Bot not ready, initialization in progress"}, 503
+    if not symbol:
+        return {"quotes": bot.quotes.quotes()}, 200
+    
+    contract = bot.contracts.get(ContractRegistry.key(symbol, exchange, currency))
+    quote = bot.quotes.quote(contract.conId) if contract is not None else None
+    if quote is None:
+        return {"error": f"No streaming quote for '{symbol}'; quotes start with the symbol's first signal"}, 404
+    return quote, 200
+
+def admin_token_header(get_header):
+    """Admin token from X-Admin-Token or an Authorization: Bearer header"""
+    authorization = get_header('Authorization') or ''
+    return get_header('X-Admin-Token') or authorization.removeprefix('Bearer ').strip()
+
+def admin_denied(token):
+    """Error response unless token is ADMIN_TOKEN"""
+    if not admin_token:
+        return {"error": "Admin endpoints are disabled; set ADMIN_TOKEN"}, 403
+    if not token or not hmac.compare_digest(token.encode(), admin_token.encode()):
+        return {"error": "Invalid admin token"}, 403
+    return None
+
+def admin_halt(method, token, body):
+    """GET: the risk engine's state. POST {"halted": true|false, "symbol": "AAPL"}:
+    halt or resume new entries, for one symbol or, without one, everywhere"""
+    denied = admin_denied(token)
+    if denied:
+        return denied
+    
+    if method == 'POST':
         try:
-            # Log the raw request data for debugging
-            raw_data = request.get_data(as_text=True)
-            logger.info(f"Raw webhook data received: {raw_data}")
-            logger.info(f"Content-Type: {request.content_type}")
-            
-            # Try to get JSON data
-            message = request.json
-            if not message:
-                logger.error("Error: No JSON data could be parsed")
-                return "Error: No JSON data received or invalid JSON format", 400
-            
-            logger.info(f"Parsed JSON: {message}")
-            
-            direction = message.get("direction")
-            if not direction:
-                logger.error("Error: 'direction' field missing from JSON")
-                return "Error: 'direction' field is required", 400
-            
-            if direction not in ["long", "short", "close_long", "close_short"]:
-                logger.error(f"Error: Invalid direction value: {direction}")
-                return f"Error: Invalid direction '{direction}'. Must be 'long', 'short', 'close_long', or 'close_short'", 400
+            command = json_loads(body) if body else None
+        except ValueError:
+            command = None
+        if not isinstance(command, dict) or not isinstance(command.get("halted"), bool):
+            return {"error": "'halted' must be true or false"}, 400
+        symbol = command.get("symbol")
+        if symbol is not None and (isinstance(symbol, bool) or not isinstance(symbol, (str, int))):
+            return {"error": f"Invalid symbol '{symbol}'"}, 400
+        symbol = str(symbol).upper() if symbol is not None else None
+        
+        risk_engine.halt(command["halted"], symbol)
+        message = f"{'Halted' if command['halted'] else 'Resumed'} trading{f' for {symbol}' if symbol else ''}"
+        logger.warning(message)
+        trade_journal.record(message, kind='halt', symbol=symbol, halted=command["halted"])
+    return risk_engine.status(), 200
+
+# Runtime reconfiguration, one at a time
+config_lock = threading.Lock()
+config_state = {'version': 0, 'updated_at': None, 'source': config_file or 'environment',
+                'pending': None, 'error': None}
+
+def config_status():
+    settings = {name: globals()[attr] for name, (attr, _, _) in RELOADABLE_SETTINGS.items()}
+    contracts = {name: str(bot.contract.localSymbol or bot.contract.symbol) if bot.contract else None
+                 for name, bot in list(bot_manager.bots.items())}
+    return dict(config_state, settings=settings, contracts=contracts)
+
+def reconfigure(changes, source='admin'):
+    """Validate and apply runtime settings; returns (payload, status).
+    
+    A change takes effect whole, in one update of the module's settings,
+    without reconnecting or dropping positions. A new INSTRUMENT or EXCHANGE
+    is first qualified on every ready connection in the background: the
+    change is answered with 202 and applied once all of them succeed, or
+    not at all.
+    """
+    try:
+        settings = parse_settings(changes)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if not config_lock.acquire(blocking=False):
+        return {"error": "A configuration change is still qualifying its contract",
+                "pending": config_state['pending']}, 409
+    
+    spec = (settings.get('EXCHANGE', exchange), settings.get('INSTRUMENT', instructment))
+    ready = {name: bot for name, bot in list(bot_manager.bots.items()) if bot.is_ready()}
+    if spec == (exchange, instructment) or not ready:
+        try:
+            _apply_settings(settings, source)
+        finally:
+            config_lock.release()
+        return config_status(), 200
+    
+    config_state['pending'] = settings
+    threading.Thread(target=_qualify_and_apply, args=(settings, source, spec, ready), daemon=True,
+                     name='reconfigure').start()
+    return config_status(), 202
+
+def _qualify_and_apply(settings, source, spec, bots):
+    """Qualify the new instrument on each ready connection, then apply"""
+    exchange_hint, symbol = spec
+    try:
+        contracts = {name: bot.resolve_contract(symbol, exchange_hint=exchange_hint)
+                     for name, bot in bots.items()}
+        _apply_settings(settings, source, contracts)
+    except Exception as e:
+        config_state['error'] = f"Not applied, could not qualify {symbol} on {exchange_hint}: {e}"
+        logger.error(config_state['error'])
+        trade_journal.record(config_state['error'], kind='config', source=source,
+                             settings=settings, applied=False)
+    finally:
+        config_state['pending'] = None
+        config_lock.release()
+
+def _apply_settings(settings, source, contracts=None):
+    started = time.perf_counter()
+    updates = settings_globals(settings)
+    if 'RATE_LIMIT_REQUESTS' in settings or 'RATE_LIMIT_WINDOW' in settings:
+        limit = settings.get('RATE_LIMIT_REQUESTS', RATE_LIMIT_MAX_REQUESTS)
+        window = settings.get('RATE_LIMIT_WINDOW', RATE_LIMIT_WINDOW)
+        updates.update(RATE_LIMIT_MAX_REQUESTS=limit, RATE_LIMIT_WINDOW=window,
+                       rate_limiters=build_rate_limiters(limit, window))
+    # One update: a request reads either the old settings or the new ones
+    globals().update(updates)
+    
+    risk_engine.configure(risk_max_position, risk_max_notional, risk_max_orders_per_minute, risk_max_daily_loss)
+    for name, bot in list(bot_manager.bots.items()):
+        bot.apply_settings((contracts or {}).get(name))
+    config_state.update(version=config_state['version'] + 1, updated_at=datetime.now(timezone.utc).isoformat(),
+                        source=source, error=None)
+    
+    message = f"Settings changed by {source}: {', '.join(f'{k}={v}' for k, v in settings.items())}"
+    logger.warning(f"{message} ({(time.perf_counter() - started) * 1000:.1f} ms)")
+    trade_journal.record(message, kind='config', source=source, settings=settings, applied=True)
+
+def reload_config_file():
+    """Apply CONFIG_FILE again, e.g. on SIGHUP. Settings removed from the
+    file keep their current values"""
+    try:
+        changes = load_config_file(config_file)
+    except ValueError as e:
+        logger.error(f"CONFIG_FILE not reloaded: {e}")
+        return
+    payload, status = reconfigure(changes, source=config_file)
+    if status >= 400:
+        logger.error(f"CONFIG_FILE not reloaded: {payload['error']}")
+
+def admin_config(method, token, body):
+    """GET: the runtime settings. POST {"ORDER_SIZE": 200, "INSTRUMENT": "AAPL", ...}:
+    change them by their env names"""
+    denied = admin_denied(token)
+    if denied:
+        return denied
+    
+    if method == 'POST':
+        try:
+            changes = json_loads(body) if body else None
+        except ValueError:
+            changes = None
+        return reconfigure(changes)
+    return config_status(), 200
+
+@app.route('/quote')
+def quote():
+    """Cached bid/ask/last: ?symbol=AAPL (with exchange, currency, account or strategy), or all"""
+    args = request.args
+    return quote_status(args.get('symbol'), args.get('exchange'), args.get('currency'),
+                        args.get('account'), args.get('strategy'))
+
+@app.route('/admin/halt', methods=['GET', 'POST'])
+def admin_halt_endpoint():
+    """Kill switch: halt or resume trading; needs ADMIN_TOKEN"""
+    return admin_halt(request.method, admin_token_header(request.headers.get), request.get_data())
+
+@app.route('/admin/config', methods=['GET', 'POST'])
+def admin_config_endpoint():
+    """Runtime settings: view or change them without a restart; needs ADMIN_TOKEN"""
+    return admin_config(request.method, admin_token_header(request.headers.get), request.get_data())
+
+@app.route('/trades')
+def trades():
+    """Recent trades; pass ?before=<next_before> to page back through history. Needs ADMIN_TOKEN"""
+    return trades_page(admin_token_header(request.headers.get), request.args.get('before'),
+                       request.args.get('limit'))
+
+async def run_blocking(func, *args):
+    """Call a blocking function from the webhook pipeline; off the loop when
+    it is the shared ASGI loop, directly on a Flask request's loop"""
+    if asyncio.get_running_loop() is bot_manager.loop:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+async def process_webhook(body, request_id, header_key=None):
+    """The /webhook pipeline shared by the Flask and ASGI servers: parse,
+    route, risk-check, dedup, then queue or run the signal. Returns the
+    (text or JSON, status) reply; header_key is the Idempotency-Key header"""
+    try:
+        logger.debug("[%s] Raw webhook body: %r", request_id, body)
+        with metrics.timer('tradingbot_stage_seconds', stage='parse'):
+            message, legs, error = parse_signal(body)
+        if error:
+            metrics.inc('tradingbot_rejects_total', reason='invalid')
+            logger.error("[%s] %s", request_id, error)
+            return error, 400
+        
+        logger.info("[%s] Signal received: %s", request_id, message)
+        for leg in legs or [message]:
+            metrics.inc('tradingbot_signals_total', direction=leg["direction"])
+        
+        route = signal_route(message, legs)
+        bot_manager.route(*route)  # Unknown accounts and strategies fail here, with a 400
+        if legs is None:
+            risk_engine.check_signal(signal_symbol(message), message["direction"])
+        
+        # Retries and duplicate alerts get the first signal's answer
+        key, ttl = signal_key(message if isinstance(message, dict) else {}, body, header_key)
+        is_first, first_response = signal_dedup.claim(key, ttl, request_id)
+        if not is_first:
+            metrics.inc('tradingbot_duplicates_total')
+            try:
+                # Shielded: a duplicate giving up must not cancel the first request's future
+                response = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(first_response)),
+                                                  signal_timeout)
+                return duplicate_response(response, request_id, first_response.request_id or 'unknown')
+            except asyncio.TimeoutError:
+                return duplicate_pending(first_response, request_id)
+        
+        response = ("Error processing webhook: signal was not processed", 500)
+        try:
+            if signal_queue is not None:
+                # Durable mode: answer once the signal is logged; the queue places it
+                with metrics.timer('tradingbot_stage_seconds', stage='queue'):
+                    response = await run_blocking(signal_queue.accept, request_id, route, message, legs,
+                                                  key, ttl)
+                return response
             
             # Get bot instance (will trigger initialization if needed)
-            bot = bot_manager.get_bot()
+            with metrics.timer('tradingbot_stage_seconds', stage='get_bot'):
+                bot = bot_manager.get_bot(*route)
             if not bot or not bot.contract:
+                metrics.inc('tradingbot_rejects_total', reason='not_ready')
                 logger.warning("Bot not initialized or contract not available, will retry soon...")
-                return "Bot not ready, initialization in progress. Please try again in a moment.", 503
-            
-            # Handle close positions
-            if direction in ["close_long", "close_short"]:
-                result = bot.close_position(bot.contract, direction)
-                if result:
-                    success_msg = f"Webhook received: {result}"
-                    logger.info(success_msg)
-                    return success_msg
-                else:
-                    skip_msg = f"Webhook received: No {direction.replace('close_', '')} position to close"
-                    logger.info(skip_msg)
-                    return skip_msg
-            
-            # Handle open positions (existing logic)
-            # Check if position already exists
-            position_exists = bot.check_contract_position(direction, bot.contract)
-            
-            if not position_exists:
-                # No existing position, place new order with minimum required size
-                result = bot.submit_order(bot.contract, direction, order_size)
-                success_msg = f"Webhook received: {result}"
-                logger.info(success_msg)
-                return success_msg
+                response = ("Bot not ready, initialization in progress. Please try again in a moment.", 503)
+            elif legs is not None:
+                try:
+                    with metrics.timer('tradingbot_stage_seconds', stage='batch'):
+                        results = await asyncio.wait_for(bot.async_handle_batch(legs, request_id),
+                                                         signal_timeout)
+                except asyncio.TimeoutError:
+                    metrics.inc('tradingbot_timeouts_total', action='handle_batch')
+                    results = {'error': 'Batch processing timeout'}
+                response = batch_response(results, request_id)
             else:
-                # Position already exists
-                skip_msg = f"Webhook received: {direction} position already exists, skipping order"
-                logger.info(skip_msg)
-                return skip_msg
-                
-        except Exception as e:
-            error_msg = f"Error processing webhook: {str(e)}"
-            logger.error(error_msg)
-            return error_msg, 400
+                try:
+                    with metrics.timer('tradingbot_stage_seconds', stage='signal'):
+                        result = await asyncio.wait_for(bot.async_handle_signal(message, request_id),
+                                                        signal_timeout)
+                except asyncio.TimeoutError:
+                    metrics.inc('tradingbot_timeouts_total', action='handle_signal')
+                    result = {'error': 'Signal processing timeout'}
+                response = signal_response(result, request_id)
+        finally:
+            signal_dedup.complete(key, first_response, response)
+        return response
+    
+    except RiskRejected as e:
+        return risk_response(e, request_id)
+    except Exception as e:
+        error_msg = f"Error processing webhook: {str(e)}"
+        logger.error(f"[{request_id}] {error_msg}")
+        return error_msg, 400
+
+_idle_request_loops = deque()  # Event loops for Flask request threads, reused across requests
+
+def run_request(coro):
+    """Run a coroutine to completion on a Flask request thread. Loops are
+    pooled: creating one per request costs a selector and a self-pipe"""
+    try:
+        loop = _idle_request_loops.pop()
+    except IndexError:
+        loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        _idle_request_loops.append(loop)
+
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    request_id = request.headers.get('X-Request-ID') or new_request_id()
+    return run_request(process_webhook(request.get_data(), request_id, request.headers.get('Idempotency-Key')))
+
+############################
+# ASGI server mode: the same routes as the Flask app, served on the event
+# loop ib_insync runs on, so handlers await IB operations directly
+############################
+
+async def _asgi_read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        event = await receive()
+        body += event.get('body', b'')
+        more_body = event.get('more_body', False)
+    return body
+
+async def _asgi_send(send, status, body, content_type='text/html; charset=utf-8'):
+    if isinstance(body, dict):
+        body = json.dumps(body)
+        content_type = 'application/json'
+    body = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()),
+                    (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def _asgi_lifespan(receive, send):
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            bot_manager.attach_loop(asyncio.get_running_loop())
+            if not bot_manager.bots:
+                logger.info("Starting bot manager...")
+                bot_manager._start_initialization()
+            if signal_queue is not None:
+                signal_queue.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            bot_manager.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
 
-# Run the Flask app
+async def asgi_app(scope, receive, send):
+    """ASGI entry point, e.g. `uvicorn trading_bot_webhooking_v2:asgi_app`"""
+    if scope['type'] == 'lifespan':
+        return await _asgi_lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    
+    path = scope['path']
+    method = scope['method']
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    
+    if enable_security_filter:
+        client_ip = headers.get('x-forwarded-for') or (scope.get('client') or ('unknown',))[0]
+        with metrics.timer('tradingbot_stage_seconds', stage='security_filter'):
+            rate_limited = is_rate_limited(client_ip, path)
+            malicious = not rate_limited and security_rules.is_malicious(path, headers.get('user-agent', ''))
+        if rate_limited:
+            metrics.inc('tradingbot_rate_limited_total')
+            logger.warning(f"Rate limited IP: {client_ip}")
+            return await _asgi_send(send, 429, "Too Many Requests")
+        if malicious:
+            metrics.inc('tradingbot_rejects_total', reason='malicious')
+            logger.warning(f"Blocked malicious request from {client_ip}: {path}")
+            return await _asgi_send(send, 400, "Bad Request")
+    
+    # Sniff the first chunk before buffering the rest of the body
+    event = await receive()
+    body = event.get('body', b'')
+    if enable_security_filter and security_rules.is_malicious_body(body[:security_rules.sniff_bytes]):
+        metrics.inc('tradingbot_rejects_total', reason='malicious')
+        logger.warning(f"Blocked malicious request from {client_ip}: {path}")
+        return await _asgi_send(send, 400, "Bad Request")
+    if event.get('more_body', False):
+        body += await _asgi_read_body(receive)
+    
+    if path == '/' and method in ('GET', 'HEAD'):
+        return await _asgi_send(send, 200, "Trading Bot Webhook Server - Use POST /webhook for signals")
+    elif path == '/test' and method == 'GET':
+        return await _asgi_send(send, 200, "Webhook server is running! Use POST to /webhook with JSON data.")
+    elif path == '/test' and method == 'POST':
+        return await _asgi_send(send, 200, f"Test POST received. Data: {body.decode('utf-8', 'replace')}")
+    elif path == '/health' and method in ('GET', 'HEAD'):
+        query = urllib.parse.parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        token = admin_token_header(lambda name: headers.get(name.lower()))
+        payload, status = health_status(is_detail(query.get('detail', [None])[0]), token)
+        return await _asgi_send(send, status, payload)
+    elif path == '/ready' and method in ('GET', 'HEAD'):
+        payload, status = ready_status()
+        return await _asgi_send(send, status, payload)
+    elif path == '/quote' and method == 'GET':
+        query = urllib.parse.parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        payload, status = quote_status(*(query.get(name, [None])[0]
+                                         for name in ('symbol', 'exchange', 'currency', 'account', 'strategy')))
+        return await _asgi_send(send, status, payload)
+    elif path == '/admin/halt' and method in ('GET', 'POST'):
+        token = admin_token_header(lambda name: headers.get(name.lower()))
+        payload, status = admin_halt(method, token, body)
+        return await _asgi_send(send, status, payload)
+    elif path == '/admin/config' and method in ('GET', 'POST'):
+        token = admin_token_header(lambda name: headers.get(name.lower()))
+        payload, status = await asyncio.to_thread(admin_config, method, token, body)
+        return await _asgi_send(send, status, payload)
+    elif path == '/trades' and method == 'GET':
+        query = urllib.parse.parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        token = admin_token_header(lambda name: headers.get(name.lower()))
+        payload, status = trades_page(token, query.get('before', [None])[0], query.get('limit', [None])[0])
+        return await _asgi_send(send, status, payload)
+    elif path == '/metrics' and method == 'GET':
+        return await _asgi_send(send, 200, metrics.render(), 'text/plain; version=0.0.4')
+    elif path == '/webhook' and method == 'POST':
+        request_id = headers.get('x-request-id') or new_request_id()
+        text, status = await process_webhook(body, request_id, headers.get('idempotency-key'))
+        return await _asgi_send(send, status, text)
+    elif path in ALLOWED_PATHS:
+        return await _asgi_send(send, 405, "Method Not Allowed")
+    return await _asgi_send(send, 404, "Not Found")
+
+# Run the webhook server
 if __name__ == '__main__':
     logger.info(f"Starting webhook server on port {webhook_port}...")
     logger.info("Bot will initialize automatically when IB Gateway becomes available")
-    app.run(host='0.0.0.0', port=webhook_port)
\ No newline at end of file
+    if config_file and hasattr(signal, 'SIGHUP'):
+        # Reload off the signal handler, which may interrupt a thread holding a lock
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+            target=reload_config_file, daemon=True, name='config-reload').start())
+    if server_mode == 'asgi':
+        try:
+            import uvicorn
+        except ImportError:
+            raise SystemExit("SERVER_MODE=asgi requires uvicorn: pip install uvicorn")
+        # Plain asyncio loop: ib_insync runs on the same loop as the server
+        uvicorn.run(asgi_app, host='0.0.0.0', port=webhook_port, loop='asyncio', lifespan='on')
+    else:
+        if signal_queue is not None:
+            signal_queue.start()  # Replays unfinished signals without waiting for a webhook
+        app.run(host='0.0.0.0', port=webhook_port)